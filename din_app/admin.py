@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DINRequest, EmailStatus
+from .models import DINRequest, EmailStatus, DINResult, DINFrontier, DINJob, APIToken
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
@@ -22,4 +22,33 @@ class DINRequestAdmin(admin.ModelAdmin):
 class EmailStatusAdmin(admin.ModelAdmin):
     list_display = ('id', 'status')  # Fields to display in the list view
     search_fields = ('din_request',)  # Fields to search
-    list_filter = ('status',)  # Fields to filter by
\ No newline at end of file
+    list_filter = ('status',)  # Fields to filter by
+
+@admin.register(DINResult)
+class DINResultAdmin(admin.ModelAdmin):
+    list_display = ('id', 'din', 'status', 'din_request', 'fetched_at')
+    search_fields = ('din',)
+    raw_id_fields = ('din_request',)
+    show_full_result_count = False  # Avoid a full COUNT(*) on a very large table
+
+@admin.register(DINFrontier)
+class DINFrontierAdmin(admin.ModelAdmin):
+    list_display = ('user', 'frontier', 'is_scheduled', 'last_run_at')
+    list_filter = ('is_scheduled',)
+
+@admin.register(DINJob)
+class DINJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'description', 'status', 'total_dins', 'created_at', 'completed_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('user__username', 'description')
+
+@admin.register(APIToken)
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('key_prefix', 'user', 'name', 'is_active', 'created_at', 'last_used_at')
+    list_filter = ('is_active',)
+    search_fields = ('user__username', 'name', 'key_prefix')
+    readonly_fields = ('user', 'key_prefix', 'key_hash', 'created_at', 'last_used_at')
+
+    def has_add_permission(self, request):
+        # Keys are only shown once, by the create_api_token command
+        return False
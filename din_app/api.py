@@ -0,0 +1,154 @@
+import time
+from datetime import timedelta
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.cache import cache
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import DINRequest
+from .utils import staff_check
+
+# GET /api/v1/requests/ returns the user's 100 most recent requests and a
+# `next_since` cursor; GET /api/v1/requests/?since=<cursor> returns only the
+# requests updated after the cursor, oldest change first, a page at a time.
+# The cursor is "<updated_at>,<id>", so requests sharing an updated_at are
+# not skipped across pages.
+# updated_at is stamped by the app before its transaction commits, so a change
+# can become visible after a later-stamped one was already returned. The
+# cursor therefore never passes now - DIN_API_CURSOR_LAG: changes inside that
+# window are returned again on the next poll, and clients apply requests by id.
+# Each user has a cache version in Redis that is bumped whenever one of their
+# requests changes (see invalidate_user_requests), so:
+#   - the ETag is the version and cursor, and a poll whose If-None-Match
+#     still matches is answered 304 from one cache read, without touching
+#     the database;
+#   - responses are cached under (user, version, since) until the next change.
+VERSION_KEY = 'din_requests_version:{user_id}'
+RESPONSE_KEY = 'din_requests:{user_id}:{version}:{since}'
+
+def user_requests_version(user_id):
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so a version lost from the cache is never reused
+        cache.add(key, time.time_ns() // 1000, timeout=None)
+        version = cache.get(key)
+    return version
+
+def invalidate_user_requests(*user_ids):
+    """
+    Bump the users' versions, expiring their cached responses and ETags.
+    """
+    for user_id in set(user_ids):
+        key = VERSION_KEY.format(user_id=user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+
+def request_api_data(req):
+    email_status = req.email_status.status if hasattr(req, 'email_status') else None
+    return {
+        'id': req.id,
+        'job_id': req.job_id,
+        'start_range': req.start_range,
+        'end_range': req.end_range,
+        'status': req.status,
+        'progress': req.progress,
+        'done_dins': req.done_dins,
+        'success_dins': req.success_dins,
+        'failed_dins': req.failed_dins,
+        'cached_dins': req.cached_dins,
+        'email_status': email_status,
+        'output_format': req.output_format,
+        'output_url': req.output_csv.url if req.output_csv else None,
+        'is_cancelled': req.is_cancelled,
+        'created_at': req.created_at.isoformat(),
+        'updated_at': req.updated_at.isoformat(),
+    }
+
+def format_cursor(updated_at, din_request_id):
+    # 'Z' rather than '+00:00', which would need escaping in a query string
+    return f"{updated_at.isoformat().replace('+00:00', 'Z')},{din_request_id}"
+
+def parse_cursor(value):
+    """
+    Return (updated_at, din_request_id), or None if value is not a cursor.
+    """
+    timestamp, _, din_request_id = value.rpartition(',')
+    updated_at = parse_datetime(timestamp)
+    if updated_at is None or not din_request_id.isdigit():
+        return None
+    return updated_at, int(din_request_id)
+
+def settled_cursor(updated_at, din_request_id):
+    """
+    Format a cursor for the last request returned, held back to the lag window.
+    """
+    settled_at = timezone.now() - timedelta(seconds=settings.DIN_API_CURSOR_LAG)
+    if updated_at > settled_at:
+        return format_cursor(settled_at, 0)
+    return format_cursor(updated_at, din_request_id)
+
+def changed_requests(user_id, since):
+    """
+    Return (requests, next_since, has_more) in one joined query. Without since,
+    the 100 most recent requests; with since, those updated after the cursor.
+    A full page moves the cursor to its last request, so paging always makes
+    progress; otherwise the cursor stays DIN_API_CURSOR_LAG behind the clock.
+    """
+    queryset = DINRequest.objects.filter(user_id=user_id).select_related('email_status')
+    if since is None:
+        requests = list(queryset.order_by('-created_at')[:100])
+        has_more = False
+        last = max(requests, key=lambda req: (req.updated_at, req.id), default=None)
+        cursor = settled_cursor(last.updated_at, last.id) if last else None
+    else:
+        updated_at, din_request_id = since
+        page_size = settings.DIN_API_PAGE_SIZE
+        requests = list(
+            queryset.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=din_request_id))
+            .order_by('updated_at', 'id')[:page_size + 1]
+        )
+        has_more = len(requests) > page_size
+        requests = requests[:page_size]
+        if has_more:
+            cursor = format_cursor(requests[-1].updated_at, requests[-1].id)
+        elif requests:
+            cursor = settled_cursor(requests[-1].updated_at, requests[-1].id)
+        else:
+            cursor = format_cursor(*since)
+    return requests, cursor, has_more
+
+@login_required
+@user_passes_test(staff_check)
+def requests_api(request):
+    since_param = request.GET.get('since')
+    since = None
+    if since_param:
+        since = parse_cursor(since_param)
+        if since is None:
+            return JsonResponse({'error': 'since must be a next_since value from an earlier response'}, status=400)
+
+    user_id = request.user.id
+    version = user_requests_version(user_id)
+    etag = f'"{version}:{since_param or ""}"'
+    if request.headers.get('If-None-Match') == etag:
+        return HttpResponse(status=304, headers={'ETag': etag})
+
+    response_key = RESPONSE_KEY.format(user_id=user_id, version=version, since=since_param or '')
+    payload = cache.get(response_key)
+    if payload is None:
+        requests, cursor, has_more = changed_requests(user_id, since)
+        payload = {
+            'requests': [request_api_data(req) for req in requests],
+            'next_since': cursor,
+            'has_more': has_more,
+        }
+        cache.set(response_key, payload, timeout=settings.DIN_API_CACHE_TTL)
+    response = JsonResponse(payload)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
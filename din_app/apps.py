@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DinAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'din_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
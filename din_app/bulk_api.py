@@ -0,0 +1,377 @@
+import asyncio
+import hashlib
+import json
+import secrets
+from datetime import timedelta
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from .models import APIToken, DINJob, DINRequest
+from .dinset import DINSet
+from .frontier import MAX_DIN
+from .results import STREAM_FORMATS, csv_header, iter_result_bytes
+from .utils import read_din_csv, validate_din_range, staff_check
+from .views import parse_job_options, create_din_set_job, create_range_job, queue_din_job, with_live_progress, job_progress
+
+# Bulk jobs API for pipelines, authenticated with "Authorization: Bearer <key>":
+#   POST /api/v1/jobs/                     submit a range, DIN list or CSV upload
+#   GET  /api/v1/jobs/<id>/                job state
+#   GET  /api/v1/jobs/<id>/results/        results as CSV or NDJSON
+# The results stream is the job's finished shards in order, up to the first
+# shard still running, so it only ever grows at the end: a download cut short
+# resumes with "Range: bytes=<received>-", and ?follow=1 keeps the response
+# open and streams shards as they finish. Failed and cancelled shards count as
+# finished but add no bytes, so one bad shard does not hold back the rest.
+TOKEN_TOUCH_INTERVAL = timedelta(minutes=1)  # last_used_at is written at most this often
+FINISHED_SHARD_STATUSES = ('completed', 'skipped', 'failed', 'cancelled')
+EMPTY_SHARD_STATUSES = ('failed', 'cancelled')  # Finished, but their partial rows are not streamed
+SIZE_KEY = 'din_results_size:{din_request_id}:{stream_format}'
+SIZE_CACHE_TTL = 7 * 24 * 3600
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+def create_token(user, name=''):
+    """
+    Create an API token for user. Returns (token, key); only the key's hash
+    is stored, so the key cannot be shown again.
+    """
+    key = secrets.token_urlsafe(32)
+    token = APIToken.objects.create(user=user, name=name, key_prefix=key[:8], key_hash=hash_key(key))
+    return token, key
+
+def authenticate_token(request):
+    """
+    Return the active APIToken of a staff user named by the Authorization header, or None.
+    """
+    scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() not in ('bearer', 'token') or not key.strip():
+        return None
+    try:
+        token = APIToken.objects.select_related('user').get(key_hash=hash_key(key.strip()), is_active=True)
+    except APIToken.DoesNotExist:
+        return None
+    if not staff_check(token.user):
+        return None
+    now = timezone.now()
+    if token.last_used_at is None or now - token.last_used_at > TOKEN_TOUCH_INTERVAL:
+        APIToken.objects.filter(id=token.id).update(last_used_at=now)
+    return token
+
+def token_required(view):
+    """
+    Authenticate a sync or async view with an API token instead of the session,
+    setting request.user to the token's user. CSRF does not apply.
+    """
+    def unauthorized():
+        return JsonResponse({'error': 'A valid API token is required'}, status=401, headers={'WWW-Authenticate': 'Bearer'})
+
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            token = await sync_to_async(authenticate_token)(request)
+            if token is None:
+                return unauthorized()
+            request.user = token.user
+            return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            token = authenticate_token(request)
+            if token is None:
+                return unauthorized()
+            request.user = token.user
+            return view(request, *args, **kwargs)
+    wrapper.csrf_exempt = True  # Set directly: csrf_exempt() would hide an async view
+    return wrapper
+
+def finished_shards(job_id):
+    """
+    Return ((id, status) of the job's shards up to the first unfinished one, whether more may finish).
+    """
+    job_status = DINJob.objects.filter(id=job_id).values_list('status', flat=True).first()
+    shards = list(DINRequest.objects.filter(job_id=job_id).order_by('id').values_list('id', 'status'))
+    finished = []
+    for shard_id, status in shards:
+        if status not in FINISHED_SHARD_STATUSES:
+            break
+        finished.append((shard_id, status))
+    return finished, len(finished) < len(shards) and job_status == 'processing'
+
+def shard_stream_size(din_request_id, stream_format):
+    """
+    Bytes a finished shard takes in the results stream, cached for completed shards.
+    """
+    key = SIZE_KEY.format(din_request_id=din_request_id, stream_format=stream_format)
+    size = cache.get(key)
+    if size is None:
+        size = sum(len(chunk) for chunk in iter_result_bytes(din_request_id, stream_format))
+        # A skipped shard can be resumed and gain rows, so only completed shards are cached
+        if DINRequest.objects.filter(id=din_request_id, status='completed').exists():
+            cache.set(key, size, timeout=SIZE_CACHE_TTL)
+    return size
+
+def available_size(shards, stream_format):
+    header = len(csv_header()) if stream_format == 'csv' else 0
+    return header + sum(
+        shard_stream_size(shard_id, stream_format)
+        for shard_id, status in shards if status not in EMPTY_SHARD_STATUSES
+    )
+
+def results_etag(job_id, stream_format):
+    # Finished shards only change if a skipped, failed or cancelled one is resumed,
+    # which drops its id from this list
+    resumable = DINRequest.objects.filter(
+        job_id=job_id, status__in=('skipped',) + EMPTY_SHARD_STATUSES,
+    ).order_by('id').values_list('id', flat=True)
+    digest = hashlib.sha256(','.join(map(str, resumable)).encode()).hexdigest()[:16]
+    return f'"job-{job_id}-{stream_format}-{digest}"'
+
+async def _iterate(chunks):
+    """
+    Pull a sync iterator of database-backed chunks one chunk per thread hop.
+    """
+    done = object()
+    while True:
+        chunk = await sync_to_async(next)(chunks, done)
+        if chunk is done:
+            return
+        yield chunk
+
+async def stream_job_results(job_id, stream_format, start=0, stop=None, follow=False):
+    """
+    Yield bytes [start, stop) of a job's results stream: the CSV header, then
+    each finished shard's rows in order. Whole shards before start are skipped
+    by their cached size. With follow, waits for further shards every
+    DIN_API_FOLLOW_INTERVAL until the job stops running or
+    DIN_API_FOLLOW_MAX_AGE has passed; the client then resumes with a Range.
+    """
+    position = 0
+
+    def clip(chunk):
+        nonlocal position
+        chunk_start, position = position, position + len(chunk)
+        low = max(start - chunk_start, 0)
+        high = len(chunk) if stop is None else min(stop - chunk_start, len(chunk))
+        return chunk[low:high]
+
+    if stream_format == 'csv':
+        part = clip(csv_header())
+        if part:
+            yield part
+    loop = asyncio.get_running_loop()
+    closes_at = loop.time() + settings.DIN_API_FOLLOW_MAX_AGE
+    streamed = 0  # Id of the last shard streamed; a resumed shard before it is not revisited
+    while True:
+        shards, more = await sync_to_async(finished_shards)(job_id)
+        for shard_id, status in shards:
+            if shard_id <= streamed:
+                continue
+            streamed = shard_id
+            if status in EMPTY_SHARD_STATUSES:
+                continue
+            if stop is not None and position >= stop:
+                return
+            if position < start:
+                size = await sync_to_async(shard_stream_size)(shard_id, stream_format)
+                if position + size <= start:
+                    position += size
+                    continue
+            async for chunk in _iterate(iter_result_bytes(shard_id, stream_format)):
+                part = clip(chunk)
+                if part:
+                    yield part
+                if stop is not None and position >= stop:
+                    return
+        if not (follow and more) or loop.time() >= closes_at:
+            return
+        await asyncio.sleep(settings.DIN_API_FOLLOW_INTERVAL)
+
+def parse_range(header):
+    """
+    Return (start, stop) for a single "bytes=start-[end]" range, or None.
+    """
+    unit, _, spec = header.partition('=')
+    first, _, last = spec.strip().partition('-')
+    if unit.strip() != 'bytes' or ',' in spec or not first.isdigit() or (last and not last.isdigit()):
+        return None
+    if last and int(last) < int(first):
+        return None
+    return int(first), int(last) + 1 if last else None
+
+def job_data(job):
+    shards = with_live_progress(list(job.shards.order_by('id')))
+    status_counts = {}
+    for shard in shards:
+        status_counts[shard.status] = status_counts.get(shard.status, 0) + 1
+    finished = 0
+    for shard in shards:
+        if shard.status not in FINISHED_SHARD_STATUSES:
+            break
+        finished += 1
+    return {
+        'id': job.id,
+        'status': job.status,
+        'description': job.description,
+        'total_dins': job.total_dins,
+        'output_format': job.output_format,
+        'progress': job_progress(shards),
+        'shards': {'total': len(shards), 'finished_in_order': finished, 'by_status': status_counts},
+        'is_cancelled': job.is_cancelled,
+        'created_at': job.created_at.isoformat(),
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+        'results_url': reverse('api_job_results', args=[job.id]),
+        'output_url': job.output_file.url if job.output_file else None,
+    }
+
+def _form_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else str(value)
+
+def parse_din_list(values):
+    """
+    Return (din_set, invalid values) for a list of DINs given as numbers or strings.
+    """
+    numbers, invalid = [], []
+    for value in values:
+        din = str(value).strip()
+        if din.isascii() and din.isdigit() and 0 < int(din) <= MAX_DIN:
+            numbers.append(int(din))
+        else:
+            invalid.append(value)
+    return DINSet.from_numbers(numbers), invalid
+
+@token_required
+def jobs_api(request):
+    """
+    Submit a job. JSON bodies give "type": "range" with "start", "end" and
+    optionally "empty_policy", or "type": "list" with "dins"; a multipart form
+    uploads a CSV as "file". Both take the form's output_format, priority,
+    cache_max_age_hours and force_refresh. Answers 201 with the job's state.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Use POST to submit a job'}, status=405, headers={'Allow': 'POST'})
+    if request.content_type == 'multipart/form-data':
+        data = {key: value for key, value in request.POST.items()}
+        data['type'] = 'csv'
+    else:
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'Request body must be JSON or a multipart CSV upload'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Request body must be a JSON object'}, status=400)
+
+    job_options, error_msg = parse_job_options({key: _form_value(value) for key, value in data.items() if key != 'dins'})
+    if error_msg:
+        return JsonResponse({'error': error_msg}, status=400)
+
+    warnings = []
+    empty_policy = 'scan'
+    input_type = data.get('type')
+    if input_type == 'range':
+        start_range, end_range = _form_value(data.get('start')), _form_value(data.get('end'))
+        if not (start_range.isdigit() and end_range.isdigit()):
+            return JsonResponse({'error': 'start and end must be positive integers'}, status=400)
+        start_range, end_range = int(start_range), int(end_range)
+        is_valid, error_msg = validate_din_range(start_range, end_range)
+        if not is_valid:
+            return JsonResponse({'error': error_msg}, status=400)
+        empty_policy = data.get('empty_policy', 'scan')
+        if empty_policy not in dict(DINRequest.EMPTY_POLICY_CHOICES):
+            return JsonResponse({'error': 'Invalid empty_policy'}, status=400)
+        job, sub_requests = create_range_job(request.user, start_range, end_range, empty_policy, job_options)
+    elif input_type in ('list', 'csv'):
+        if input_type == 'list':
+            if not isinstance(data.get('dins'), list):
+                return JsonResponse({'error': 'dins must be a list of DINs'}, status=400)
+            din_set, invalid = parse_din_list(data['dins'])
+            if invalid:
+                return JsonResponse({'error': f'{len(invalid)} invalid DINs', 'invalid': invalid[:10]}, status=400)
+            description = f'API list of {len(din_set)} DINs'
+        else:
+            csv_file = request.FILES.get('file')
+            if csv_file is None:
+                return JsonResponse({'error': 'Upload the CSV as the "file" field'}, status=400)
+            is_valid, error_msg, din_set, report = read_din_csv(csv_file.file)
+            if not is_valid:
+                return JsonResponse({'error': error_msg}, status=400)
+            if report['invalid'] or report['duplicates']:
+                warnings.append(
+                    f"{report['invalid']} invalid rows skipped and {report['duplicates']} duplicate DINs removed"
+                )
+            description = csv_file.name
+        if not din_set:
+            return JsonResponse({'error': 'No valid DINs to fetch'}, status=400)
+        job, sub_requests = create_din_set_job(request.user, description, din_set, job_options)
+    else:
+        return JsonResponse({'error': 'type must be "range", "list" or a multipart CSV upload'}, status=400)
+
+    queue_din_job(job, sub_requests, empty_policy)
+    response = JsonResponse({**job_data(job), 'warnings': warnings}, status=201)
+    response['Location'] = reverse('api_job', args=[job.id])
+    return response
+
+@token_required
+def job_api(request, job_id):
+    try:
+        job = DINJob.objects.get(id=job_id, user=request.user)
+    except DINJob.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    response = JsonResponse(job_data(job))
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@token_required
+async def job_results_api(request, job_id):
+    """
+    Stream a job's results (see stream_job_results) as ?format=csv or ndjson.
+    A single "Range: bytes=start-[end]" is answered 206 with the bytes
+    available now, which for a running job is the finished shards so far;
+    If-Range with a stale ETag gets the whole stream instead.
+    """
+    stream_format = request.GET.get('format', 'csv')
+    if stream_format not in STREAM_FORMATS:
+        return JsonResponse({'error': 'format must be csv or ndjson'}, status=400)
+    if not await DINJob.objects.filter(id=job_id, user=request.user).aexists():
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    etag = await sync_to_async(results_etag)(job_id, stream_format)
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': f'attachment; filename="din_job_{job_id}.{stream_format}"',
+        'X-Accel-Buffering': 'no',
+    }
+    byte_range = parse_range(request.headers.get('Range', ''))
+    if byte_range and request.headers.get('If-Range', etag) != etag:
+        byte_range = None
+    if byte_range is None:
+        follow = request.GET.get('follow') in ('1', 'true')
+        return StreamingHttpResponse(
+            stream_job_results(job_id, stream_format, follow=follow),
+            content_type=CONTENT_TYPES[stream_format], headers=headers,
+        )
+
+    shards, more = await sync_to_async(finished_shards)(job_id)
+    available = await sync_to_async(available_size)(shards, stream_format)
+    start, stop = byte_range
+    if start >= available:
+        return JsonResponse(
+            {'error': 'Range starts past the results available', 'available': available, 'complete': not more},
+            status=416, headers={**headers, 'Content-Range': f'bytes */{available}'},
+        )
+    stop = available if stop is None else min(stop, available)
+    complete_length = '*' if more else available
+    return StreamingHttpResponse(
+        stream_job_results(job_id, stream_format, start, stop),
+        status=206, content_type=CONTENT_TYPES[stream_format],
+        headers={**headers, 'Content-Range': f'bytes {start}-{stop - 1}/{complete_length}', 'Content-Length': stop - start},
+    )
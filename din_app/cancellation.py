@@ -0,0 +1,57 @@
+import logging
+import redis
+from .redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger('din_app')
+
+# Cancelling a request sets din:cancel:<id> in Redis. Lease workers check the
+# flag before each chunk and get_din_data_async before each MCA request, so a
+# cancel stops fetching within one request round trip, without revoking Celery
+# tasks. The flag outlives the request's lease state and is cleared on resume.
+# Redis errors read as "not cancelled", so a Redis hiccup never stops work.
+KEY_PREFIX = 'din:cancel'
+KEY_TTL = 7 * 24 * 3600
+
+class RequestCancelled(Exception):
+    """
+    Raised instead of fetching for a request that has been cancelled.
+    """
+
+    def __init__(self, din_request_id):
+        super().__init__(f"DIN request {din_request_id} was cancelled")
+        self.din_request_id = din_request_id
+
+def _key(din_request_id):
+    return f'{KEY_PREFIX}:{din_request_id}'
+
+def cancel(*din_request_ids):
+    with get_redis().pipeline() as pipe:
+        for din_request_id in din_request_ids:
+            pipe.set(_key(din_request_id), 1, ex=KEY_TTL)
+        pipe.execute()
+
+def clear(din_request_id):
+    get_redis().delete(_key(din_request_id))
+
+def is_cancelled(din_request_id):
+    try:
+        return bool(get_redis().exists(_key(din_request_id)))
+    except redis.RedisError as e:
+        logger.warning(f"Cancellation flags unavailable, assuming not cancelled: {str(e)}")
+        return False
+
+def check(din_request_id):
+    """
+    Raise RequestCancelled if the request has been cancelled.
+    """
+    if is_cancelled(din_request_id):
+        raise RequestCancelled(din_request_id)
+
+async def check_async(din_request_id):
+    try:
+        cancelled = await get_async_redis().exists(_key(din_request_id))
+    except redis.RedisError as e:
+        logger.warning(f"Cancellation flags unavailable, assuming not cancelled: {str(e)}")
+        return
+    if cancelled:
+        raise RequestCancelled(din_request_id)
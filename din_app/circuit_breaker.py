@@ -0,0 +1,150 @@
+import logging
+import redis
+from django.conf import settings
+from .redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger('din_app')
+
+# State machine shared by every worker through one Redis hash:
+#   closed    -> requests flow; `threshold` consecutive failures open the breaker
+#   open      -> requests are refused until `reset_timeout` has passed
+#   half_open -> a single probe request is let through; success closes the
+#                breaker, failure re-opens it. If the probe never reports back,
+#                another one is allowed after `reset_timeout`.
+# ARGV[1] is the operation ('allow', 'peek', 'success' or 'failure'). 'allow'
+# returns the seconds the caller must wait ("0" means go ahead) and takes the
+# half-open probe when it is due; 'peek' returns the same wait without changing
+# anything. The others return the resulting state, or 'opened' / 'reclosed'
+# when the call caused a transition.
+CIRCUIT_BREAKER_SCRIPT = """
+local key = KEYS[1]
+local op = ARGV[1]
+local threshold = tonumber(ARGV[2])
+local reset_timeout = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HGET', key, 'state') or 'closed'
+local opened_at = tonumber(redis.call('HGET', key, 'opened_at') or '0')
+
+if op == 'allow' or op == 'peek' then
+    if state == 'closed' then
+        return '0'
+    end
+    local remaining = reset_timeout - (now - opened_at)
+    if remaining <= 0 then
+        if op == 'allow' then
+            redis.call('HSET', key, 'state', 'half_open', 'opened_at', tostring(now))
+        end
+        return '0'
+    end
+    return tostring(remaining)
+elseif op == 'success' then
+    if state ~= 'closed' then
+        redis.call('HSET', key, 'state', 'closed', 'failures', 0)
+        return 'reclosed'
+    elseif tonumber(redis.call('HGET', key, 'failures') or '0') > 0 then
+        redis.call('HSET', key, 'failures', 0)
+    end
+    return 'closed'
+elseif op == 'failure' then
+    if state == 'half_open' then
+        redis.call('HSET', key, 'state', 'open', 'opened_at', tostring(now))
+        return 'opened'
+    elseif state == 'closed' then
+        if redis.call('HINCRBY', key, 'failures', 1) >= threshold then
+            redis.call('HSET', key, 'state', 'open', 'opened_at', tostring(now), 'failures', 0)
+            return 'opened'
+        end
+    end
+    return state
+end
+return state
+"""
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker whose state lives in Redis.
+    Redis errors fail open so a Redis hiccup never blocks fetching on its own.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.key = f"din:breaker:{name}"
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def _args(self, op):
+        return (CIRCUIT_BREAKER_SCRIPT, 1, self.key, op, self.failure_threshold, self.reset_timeout)
+
+    def _report_transition(self, state):
+        if state == b'opened':
+            logger.warning(f"Circuit breaker '{self.name}' opened for {self.reset_timeout}s")
+        elif state == b'reclosed':
+            logger.info(f"Circuit breaker '{self.name}' closed after a successful probe")
+
+    def check(self):
+        """
+        Raise CircuitOpenError if requests must not be sent right now.
+        """
+        try:
+            wait = float(get_redis().eval(*self._args('allow')))
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable, allowing request: {str(e)}")
+            return
+        if wait > 0:
+            raise CircuitOpenError(self.name, wait)
+
+    def check_ready(self):
+        """
+        Raise CircuitOpenError if check() would refuse a request right now,
+        without changing state: a due half-open probe is left for the first
+        real request to take.
+        """
+        try:
+            wait = float(get_redis().eval(*self._args('peek')))
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable, allowing request: {str(e)}")
+            return
+        if wait > 0:
+            raise CircuitOpenError(self.name, wait)
+
+    async def check_async(self):
+        try:
+            wait = float(await get_async_redis().eval(*self._args('allow')))
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable, allowing request: {str(e)}")
+            return
+        if wait > 0:
+            raise CircuitOpenError(self.name, wait)
+
+    async def record_async(self, success):
+        try:
+            state = await get_async_redis().eval(*self._args('success' if success else 'failure'))
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable, outcome not recorded: {str(e)}")
+            return
+        self._report_transition(state)
+
+    def record(self, success):
+        try:
+            state = get_redis().eval(*self._args('success' if success else 'failure'))
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable, outcome not recorded: {str(e)}")
+            return
+        self._report_transition(state)
+
+def get_mca_breaker():
+    """
+    Return the breaker guarding the NCAPrefillService endpoint.
+    """
+    return CircuitBreaker('mca', settings.MCA_BREAKER_FAILURE_THRESHOLD, settings.MCA_BREAKER_RESET_TIMEOUT)
@@ -0,0 +1,126 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import socket
+import time
+import redis
+from django.conf import settings
+from .redis_client import get_redis
+
+logger = logging.getLogger('din_app')
+
+# Each worker process publishes its controller's snapshot under
+# din:aimd:window:<host>:<pid> after every chunk; the key expires once the
+# process stops publishing, so window_stats() only lists live workers.
+KEY_PREFIX = 'din:aimd:window'
+SNAPSHOT_TTL = 300
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease limit on in-flight MCA requests.
+    While responses come back healthy and under the latency target the window grows
+    by about one request per round trip; a 5xx or timeout cuts it by decrease_factor.
+    """
+
+    def __init__(self, initial_window, min_window, max_window, decrease_factor, latency_target):
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.window = float(initial_window)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = collections.deque()
+
+    @property
+    def limit(self):
+        return max(self.min_window, int(self.window))
+
+    async def acquire(self):
+        """
+        Wait for a free slot in the window. Returns the start time to pass to release().
+        """
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # Pass the wake-up on to the next waiter
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started_at, healthy):
+        """
+        Free a slot and adjust the window from the request's outcome and latency.
+        """
+        self.in_flight -= 1
+        latency = time.monotonic() - started_at
+        if not healthy:
+            # Requests started before the last cut saw the same congestion; only cut once per round trip
+            if started_at >= self._last_decrease:
+                self.window = max(self.min_window, self.window * self.decrease_factor)
+                self._last_decrease = time.monotonic()
+                logger.info(f"MCA concurrency window decreased to {self.window:.1f}")
+        elif latency <= self.latency_target:
+            self.window = min(self.max_window, self.window + 1.0 / self.window)
+        self._wake()
+
+    def snapshot(self):
+        return {'window': round(self.window, 2), 'limit': self.limit, 'in_flight': self.in_flight}
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+_controller = None
+
+def get_controller():
+    """
+    Return the AIMD controller for this worker process, shared across all batches.
+    """
+    global _controller
+    if _controller is None:
+        _controller = AIMDController(
+            initial_window=settings.MCA_AIMD_INITIAL_WINDOW,
+            min_window=settings.MCA_AIMD_MIN_WINDOW,
+            max_window=settings.MCA_AIMD_MAX_WINDOW,
+            decrease_factor=settings.MCA_AIMD_DECREASE_FACTOR,
+            latency_target=settings.MCA_AIMD_LATENCY_TARGET,
+        )
+    return _controller
+
+def publish_snapshot():
+    """
+    Publish this process's window snapshot for window_stats(). Redis errors
+    are logged, never raised.
+    """
+    key = f'{KEY_PREFIX}:{socket.gethostname()}:{os.getpid()}'
+    try:
+        get_redis().set(key, json.dumps(get_controller().snapshot()), ex=SNAPSHOT_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish MCA concurrency window: {str(e)}")
+
+def window_stats():
+    """
+    Return {"<host>:<pid>": snapshot} for every worker process that published recently.
+    """
+    client = get_redis()
+    keys = sorted(client.scan_iter(f'{KEY_PREFIX}:*'))
+    values = client.mget(keys) if keys else []
+    prefix = len(KEY_PREFIX) + 1
+    return {
+        key.decode()[prefix:]: json.loads(value)
+        for key, value in zip(keys, values) if value is not None
+    }
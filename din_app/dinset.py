@@ -0,0 +1,229 @@
+import base64
+import re
+from bisect import bisect_right
+from .frontier import MAX_DIN
+
+# Sets of up to this many intervals are stored as readable [[start, end], ...]
+# pairs. Larger ones, typically sparse uploads where most intervals hold one
+# DIN, are stored as {"varint": <base64>, "count": <DINs>}: the gap before each
+# interval and its length as LEB128 varints, about 3-4 bytes per interval
+# instead of ~20. The count lets json_len size a set without decoding it.
+MAX_JSON_PAIRS = 8
+
+def format_din(number):
+    return f"{number:08d}"
+
+def encode_varints(numbers):
+    out = bytearray()
+    for number in numbers:
+        while number > 0x7F:
+            out.append(number & 0x7F | 0x80)
+            number >>= 7
+        out.append(number)
+    return bytes(out)
+
+def decode_varints(data):
+    number = shift = 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            yield number
+            number = shift = 0
+
+class DINSet:
+    """
+    Immutable, sorted set of DIN numbers stored as non-overlapping [start, end)
+    intervals. Size is O(1), positional access is a binary search over the
+    intervals, and iteration is lazy, so a request covering millions of
+    mostly consecutive DINs takes a few integers instead of a list of strings.
+    Positions follow ascending DIN order.
+    """
+
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        self._offsets = []  # Position of each interval's first DIN
+        total = 0
+        for start, end in intervals:
+            if end <= start:
+                continue
+            if self._ends and start <= self._ends[-1]:
+                if start < self._starts[-1]:
+                    raise ValueError("DINSet intervals must be sorted")
+                if end > self._ends[-1]:
+                    total += end - self._ends[-1]
+                    self._ends[-1] = end
+                continue
+            self._starts.append(start)
+            self._ends.append(end)
+            self._offsets.append(total)
+            total += end - start
+        self._total = total
+
+    @classmethod
+    def from_numbers(cls, numbers):
+        """
+        Build a set from DIN numbers in any order; duplicates are dropped.
+        """
+        intervals = []
+        for number in sorted(set(numbers)):
+            if intervals and intervals[-1][1] == number:
+                intervals[-1][1] = number + 1
+            else:
+                intervals.append([number, number + 1])
+        return cls(intervals)
+
+    @classmethod
+    def from_range(cls, start, end):
+        """
+        Build a set from an inclusive DIN range.
+        """
+        return cls([(start, end + 1)])
+
+    @classmethod
+    def from_json(cls, value):
+        """
+        Build a set from to_json() output, in either encoding.
+        """
+        if isinstance(value, dict):
+            numbers = decode_varints(base64.b64decode(value['varint']))
+            intervals = []
+            end = 0
+            for gap, length in zip(numbers, numbers):  # Consecutive values of one iterator
+                start = end + gap
+                end = start + length
+                intervals.append((start, end))
+            return cls(intervals)
+        return cls(value or ())
+
+    def to_json(self):
+        if len(self._starts) <= MAX_JSON_PAIRS:
+            return [[start, end] for start, end in zip(self._starts, self._ends)]
+        deltas = []
+        previous_end = 0
+        for start, end in zip(self._starts, self._ends):
+            deltas += [start - previous_end, end - start]
+            previous_end = end
+        return {'varint': base64.b64encode(encode_varints(deltas)).decode('ascii'), 'count': self._total}
+
+    @staticmethod
+    def json_len(value):
+        """
+        Number of DINs in to_json() output, without building the set.
+        """
+        if isinstance(value, dict):
+            if 'count' in value:
+                return value['count']
+            return len(DINSet.from_json(value))
+        return sum(end - start for start, end in value or ())
+
+    def __len__(self):
+        return self._total
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end)
+
+    def __contains__(self, number):
+        i = bisect_right(self._starts, number) - 1
+        return i >= 0 and number < self._ends[i]
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._total
+        if not 0 <= position < self._total:
+            raise IndexError("DINSet position out of range")
+        i = bisect_right(self._offsets, position) - 1
+        return self._starts[i] + position - self._offsets[i]
+
+    def __eq__(self, other):
+        return isinstance(other, DINSet) and self.intervals() == other.intervals()
+
+    def __repr__(self):
+        return f"DINSet({self.intervals()!r})"
+
+    def intervals(self):
+        return list(zip(self._starts, self._ends))
+
+    def din_at(self, position):
+        return format_din(self[position])
+
+    def dins(self):
+        """
+        Iterate the DINs as 8-digit strings, lazily.
+        """
+        return map(format_din, self)
+
+    def slice(self, start, stop):
+        """
+        Return the DINs at positions [start, stop) as a new DINSet.
+        """
+        start, stop = max(start, 0), min(stop, self._total)
+        if start >= stop:
+            return DINSet()
+        first = bisect_right(self._offsets, start) - 1
+        intervals = []
+        for i in range(first, len(self._starts)):
+            if self._offsets[i] >= stop:
+                break
+            low = self._starts[i] + max(start - self._offsets[i], 0)
+            high = self._starts[i] + min(stop - self._offsets[i], self._ends[i] - self._starts[i])
+            intervals.append((low, high))
+        return DINSet(intervals)
+
+    def chunks(self, size):
+        """
+        Split into consecutive DINSets of at most size DINs.
+        """
+        for start in range(0, self._total, size):
+            yield self.slice(start, start + size)
+
+class DINBitmap:
+    """
+    Mutable set of DIN numbers in [0, max_din] kept as one bit per number,
+    about 12 MB for every possible DIN however many are added. Used to drop
+    duplicates while streaming an upload, and converted to a DINSet in one
+    ascending scan.
+    """
+
+    def __init__(self, max_din=MAX_DIN):
+        self.max_din = max_din
+        self._bits = bytearray(max_din // 8 + 1)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, number):
+        """
+        Add a number; returns False if it was already present.
+        """
+        index, mask = number >> 3, 1 << (number & 7)
+        if self._bits[index] & mask:
+            return False
+        self._bits[index] |= mask
+        self._count += 1
+        return True
+
+    def to_dinset(self):
+        intervals = []
+        # Only runs of non-zero bytes are visited, and whole 0xFF bytes are taken 8 at a time
+        for run in re.finditer(rb'[^\x00]+', self._bits):
+            base = run.start() * 8
+            for offset, byte in enumerate(run.group()):
+                number = base + offset * 8
+                if byte == 0xFF:
+                    if intervals and intervals[-1][1] == number:
+                        intervals[-1][1] = number + 8
+                    else:
+                        intervals.append([number, number + 8])
+                    continue
+                for bit in range(8):
+                    if byte >> bit & 1:
+                        if intervals and intervals[-1][1] == number + bit:
+                            intervals[-1][1] = number + bit + 1
+                        else:
+                            intervals.append([number + bit, number + bit + 1])
+        return DINSet(intervals)
@@ -0,0 +1,28 @@
+import logging
+import redis
+from .redis_client import get_redis
+
+logger = logging.getLogger('din_app')
+
+# Changes to a user's requests are announced on the Redis pub/sub channel
+# din:events:<user_id>. A message is just the request id: the progress
+# counters and status are read when the update is sent, so the event stream
+# can coalesce many chunk updates into one. Publishing is fire-and-forget;
+# with no stream open for the user, Redis drops the message.
+CHANNEL_PREFIX = 'din:events'
+
+def channel(user_id):
+    return f'{CHANNEL_PREFIX}:{user_id}'
+
+def publish(user_id, *din_request_ids):
+    """
+    Announce changed requests. Redis errors are logged, never raised, so a
+    Redis hiccup cannot fail the save that triggered the event.
+    """
+    try:
+        with get_redis().pipeline(transaction=False) as pipe:
+            for din_request_id in din_request_ids:
+                pipe.publish(channel(user_id), din_request_id)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Request events unavailable, update not published: {str(e)}")
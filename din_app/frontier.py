@@ -0,0 +1,44 @@
+MAX_DIN = 99999999
+
+# DINs are allocated in increasing order, so everything above the newest
+# allocation (the frontier) is empty. Allocated DINs are not contiguous,
+# though: deactivated and never-issued numbers leave runs of 404s below the
+# frontier. A probe therefore checks a window of consecutive DINs and treats
+# the position as past the frontier only if the whole window is empty, which
+# tolerates gaps shorter than the window.
+
+def find_frontier(known, probe_window, width, initial_step, max_din=MAX_DIN):
+    """
+    Find the highest allocated DIN at or above known, a DIN at or below the frontier.
+    probe_window(start) returns the highest DIN with a record in
+    [start, start + width), or None if the window is empty.
+    Gallops upwards from known with doubling steps until a window is empty,
+    then binary searches between the last non-empty and the empty window.
+    Returns the highest DIN with a record seen, or known if none was found.
+    """
+    best = known
+    lo, step = known, initial_step
+    while True:
+        hi = min(lo + step, max_din)
+        found = probe_window(hi)
+        if found is None:
+            break
+        best = max(best, found)
+        if hi >= max_din:
+            return best
+        lo, step = hi, step * 2
+
+    while hi - lo > width:
+        mid = (lo + hi) // 2
+        found = probe_window(mid)
+        if found is None:
+            hi = mid
+        else:
+            best = max(best, found)
+            lo = mid
+
+    # The window at lo covers what is left of [lo, hi)
+    found = probe_window(lo)
+    if found is not None:
+        best = max(best, found)
+    return best
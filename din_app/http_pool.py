@@ -0,0 +1,54 @@
+import asyncio
+import aiohttp
+from django.conf import settings
+
+# One event loop and one ClientSession per worker process, shared by every
+# batch that process runs so TCP connections and DNS lookups are reused.
+_loop = None
+_session = None
+
+def get_event_loop():
+    """
+    Return the long-lived event loop for this worker process, creating it on first use.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+async def get_session():
+    """
+    Return the shared aiohttp session, creating it (and its connector) on first use.
+    Must be awaited on the loop returned by get_event_loop().
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=settings.MCA_HTTP_POOL_LIMIT,
+            limit_per_host=settings.MCA_HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=settings.MCA_HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=settings.MCA_HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+def open_pool():
+    """
+    Create the event loop and session up front (called when a worker process starts).
+    """
+    loop = get_event_loop()
+    loop.run_until_complete(get_session())
+
+def close_pool():
+    """
+    Close the shared session and event loop (called when a worker process shuts down).
+    """
+    global _loop, _session
+    if _loop is None or _loop.is_closed():
+        return
+    if _session is not None and not _session.closed:
+        _loop.run_until_complete(_session.close())
+    _session = None
+    _loop.close()
+    _loop = None
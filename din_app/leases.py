@@ -0,0 +1,216 @@
+from django.conf import settings
+from .redis_client import get_redis
+
+# Work for a request is kept in Redis as intervals of positions in its DIN list:
+#   din:lease:<id>:queue      list of unleased "start:end" intervals (end exclusive)
+#   din:lease:<id>:leases     hash lease id -> "done:claimed:end"
+#   din:lease:<id>:expiry     sorted set lease id -> deadline
+#   din:lease:<id>:remaining  positions not yet completed
+#   din:lease:<id>:seq        lease id counter
+# A worker leases an interval of at most DIN_LEASE_SIZE positions and works
+# through it one chunk at a time. Positions in [done, claimed) are the chunk in
+# flight, [claimed, end) is not started yet. When the queue is empty, a worker
+# steals the back half of the not-started part of the lease with the most work
+# left. A lease whose deadline passes without its holder asking for the next
+# chunk goes back on the queue from `done`. The request is complete when
+# `remaining` reaches zero, which exactly one next_chunk call observes.
+KEY_PREFIX = 'din:lease'
+KEY_TTL = 7 * 24 * 3600
+
+# Keys created after create_job (the first lease, a queue emptied and refilled)
+# would have no TTL, so the scripts that write them renew every key's TTL
+ACQUIRE_SCRIPT = """
+local queue, leases, expiry, seq = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local ttl = tonumber(ARGV[1])
+local max_size = tonumber(ARGV[2])
+local min_steal = tonumber(ARGV[3])
+local key_ttl = tonumber(ARGV[4])
+local now = tonumber(redis.call('TIME')[1])
+
+for _, lease in ipairs(redis.call('ZRANGEBYSCORE', expiry, '-inf', now)) do
+    local value = redis.call('HGET', leases, lease)
+    if value then
+        local done, _, finish = string.match(value, '(%d+):(%d+):(%d+)')
+        redis.call('RPUSH', queue, done .. ':' .. finish)
+        redis.call('HDEL', leases, lease)
+    end
+    redis.call('ZREM', expiry, lease)
+end
+
+local start, finish
+local interval = redis.call('LPOP', queue)
+if interval then
+    local s, e = string.match(interval, '(%d+):(%d+)')
+    start, finish = tonumber(s), tonumber(e)
+    if finish - start > max_size then
+        redis.call('LPUSH', queue, (start + max_size) .. ':' .. finish)
+        finish = start + max_size
+    end
+else
+    local victim, victim_done, victim_claimed, victim_end, most = nil, 0, 0, 0, 0
+    local all = redis.call('HGETALL', leases)
+    for i = 1, #all, 2 do
+        local d, c, e = string.match(all[i + 1], '(%d+):(%d+):(%d+)')
+        if tonumber(e) - tonumber(c) > most then
+            victim, victim_done, victim_claimed, victim_end = all[i], d, tonumber(c), tonumber(e)
+            most = victim_end - victim_claimed
+        end
+    end
+    if victim == nil or most < 2 * min_steal then
+        return {0, #all / 2}
+    end
+    start = victim_end - math.floor(most / 2)
+    finish = victim_end
+    redis.call('HSET', leases, victim, victim_done .. ':' .. victim_claimed .. ':' .. start)
+end
+
+local lease = redis.call('INCR', seq)
+redis.call('HSET', leases, lease, start .. ':' .. start .. ':' .. finish)
+redis.call('ZADD', expiry, now + ttl, lease)
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, key_ttl)
+end
+return {lease, start, finish}
+"""
+
+NEXT_CHUNK_SCRIPT = """
+local leases, expiry, remaining = KEYS[1], KEYS[2], KEYS[3]
+local lease = ARGV[1]
+local chunk_size = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local value = redis.call('HGET', leases, lease)
+if not value then
+    return {-1, -1, -1, 0}
+end
+local d, c, e = string.match(value, '(%d+):(%d+):(%d+)')
+local done, claimed, finish = tonumber(d), tonumber(c), tonumber(e)
+if claimed > finish then
+    claimed = finish
+end
+local left = tonumber(redis.call('DECRBY', remaining, claimed - done))
+if claimed >= finish then
+    redis.call('HDEL', leases, lease)
+    redis.call('ZREM', expiry, lease)
+    return {finish, finish, left, claimed - done}
+end
+local next_claimed = math.min(claimed + chunk_size, finish)
+redis.call('HSET', leases, lease, claimed .. ':' .. next_claimed .. ':' .. finish)
+redis.call('ZADD', expiry, tonumber(redis.call('TIME')[1]) + ttl, lease)
+return {claimed, next_claimed, left, claimed - done}
+"""
+
+RELEASE_SCRIPT = """
+local queue, leases, expiry, remaining = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local value = redis.call('HGET', leases, ARGV[1])
+redis.call('ZREM', expiry, ARGV[1])
+if not value then
+    return {-1, 0}
+end
+redis.call('HDEL', leases, ARGV[1])
+local d, c, e = string.match(value, '(%d+):(%d+):(%d+)')
+local done, claimed, finish = tonumber(d), tonumber(c), tonumber(e)
+local counted = 0
+if ARGV[2] == '1' then
+    counted = claimed - done
+    done = claimed
+end
+local left = tonumber(redis.call('DECRBY', remaining, counted))
+if done < finish then
+    redis.call('LPUSH', queue, done .. ':' .. finish)
+end
+for _, key in ipairs(KEYS) do
+    redis.call('EXPIRE', key, tonumber(ARGV[3]))
+end
+return {left, counted}
+"""
+
+class LeaseLost(Exception):
+    """
+    Raised when a lease expired and was handed to another worker.
+    """
+
+def _keys(din_request_id):
+    prefix = f'{KEY_PREFIX}:{din_request_id}'
+    return {
+        name: f'{prefix}:{name}'
+        for name in ('queue', 'leases', 'expiry', 'remaining', 'seq')
+    }
+
+def to_intervals(positions):
+    """
+    Collapse sorted positions into (start, end) intervals of consecutive positions, end exclusive.
+    """
+    intervals = []
+    for position in positions:
+        if intervals and intervals[-1][1] == position:
+            intervals[-1][1] = position + 1
+        else:
+            intervals.append([position, position + 1])
+    return [tuple(interval) for interval in intervals]
+
+def create_job(din_request_id, positions):
+    """
+    Replace any lease state for a request with a queue holding the given positions.
+    Returns the number of intervals queued.
+    """
+    keys = _keys(din_request_id)
+    intervals = to_intervals(positions)
+    with get_redis().pipeline() as pipe:
+        pipe.delete(*keys.values())
+        if intervals:
+            pipe.rpush(keys['queue'], *[f'{start}:{end}' for start, end in intervals])
+        pipe.set(keys['remaining'], len(positions))
+        for key in keys.values():
+            pipe.expire(key, KEY_TTL)
+        pipe.execute()
+    return len(intervals)
+
+def clear_job(din_request_id):
+    get_redis().delete(*_keys(din_request_id).values())
+
+def acquire(din_request_id):
+    """
+    Lease an interval of positions, stealing from a running lease if none is queued.
+    Returns (lease_id, start, end), or (None, outstanding_leases) when there is nothing to take.
+    """
+    keys = _keys(din_request_id)
+    result = get_redis().eval(
+        ACQUIRE_SCRIPT, 4, keys['queue'], keys['leases'], keys['expiry'], keys['seq'],
+        settings.DIN_LEASE_TTL, settings.DIN_LEASE_SIZE, settings.DIN_BATCH_SIZE, KEY_TTL,
+    )
+    if result[0] == 0:
+        return None, int(result[1])
+    return int(result[0]), int(result[1]), int(result[2])
+
+def next_chunk(din_request_id, lease_id):
+    """
+    Mark the lease's chunk in flight as done and claim the next one, renewing the lease.
+    Returns (start, end, completed_job); start == end once the lease is used up.
+    completed_job is True for the one call that completes the request's last positions.
+    Raises LeaseLost if the lease was reclaimed after expiring.
+    """
+    keys = _keys(din_request_id)
+    start, end, left, counted = get_redis().eval(
+        NEXT_CHUNK_SCRIPT, 3, keys['leases'], keys['expiry'], keys['remaining'],
+        lease_id, settings.DIN_BATCH_SIZE, settings.DIN_LEASE_TTL,
+    )
+    if start == -1:
+        raise LeaseLost(lease_id)
+    return int(start), int(end), counted > 0 and left == 0
+
+def release(din_request_id, lease_id, chunk_done=False):
+    """
+    Give a lease back, queueing its unfinished positions. The chunk in flight is
+    counted as completed if chunk_done, otherwise it is queued again.
+    Returns True if this completed the request's last positions.
+    """
+    keys = _keys(din_request_id)
+    left, counted = get_redis().eval(
+        RELEASE_SCRIPT, 4, keys['queue'], keys['leases'], keys['expiry'], keys['remaining'],
+        lease_id, '1' if chunk_done else '0', KEY_TTL,
+    )
+    return counted > 0 and left == 0
+
+def remaining(din_request_id):
+    value = get_redis().get(_keys(din_request_id)['remaining'])
+    return int(value) if value is not None else 0
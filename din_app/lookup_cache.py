@@ -0,0 +1,76 @@
+import logging
+from datetime import timedelta
+import redis
+from django.conf import settings
+from django.utils import timezone
+from .models import DINCacheEntry
+from .redis_client import get_redis
+from .results import row_to_result_fields, result_to_row
+
+logger = logging.getLogger('din_app')
+
+# Successful lookups are cached in PostgreSQL rather than Redis: the shared
+# Redis is capped at 512MB with allkeys-lru, and filling it with records would
+# push out broker messages. Entries older than DIN_CACHE_TTL are purged by the
+# purge_din_cache beat task. Only the hit/miss counters live in Redis.
+HITS_KEY = 'din:cache:hits'
+MISSES_KEY = 'din:cache:misses'
+
+def effective_max_age(din_request):
+    """
+    Return the cache age limit for a request, or None if it must not use the cache.
+    """
+    if din_request.force_refresh:
+        return None
+    max_age = din_request.cache_max_age if din_request.cache_max_age is not None else settings.DIN_CACHE_TTL
+    return min(max_age, settings.DIN_CACHE_TTL)
+
+def get_cached_rows(dins, max_age):
+    """
+    Return {din: (row, fetched_at)} for DINs with a cache entry no older than max_age seconds.
+    """
+    if max_age is None or max_age <= 0 or not dins:
+        return {}
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    entries = DINCacheEntry.objects.filter(din__in=dins, fetched_at__gte=cutoff).values_list('din', 'data', 'fetched_at')
+    cached = {din: (result_to_row(din, 'success', data), fetched_at) for din, data, fetched_at in entries}
+    record_lookups(hits=len(cached), misses=len(dins) - len(cached))
+    return cached
+
+def store_rows(rows, fetched_at):
+    """
+    Cache the successful rows from a batch, replacing older entries for the same DINs.
+    """
+    entries = []
+    for row in rows:
+        din, status, data = row_to_result_fields(row)
+        if status == 'success':
+            entries.append(DINCacheEntry(din=din, data=data, fetched_at=fetched_at))
+    if entries:
+        DINCacheEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['din'],
+            update_fields=['data', 'fetched_at'],
+            batch_size=1000,
+        )
+
+def purge_expired():
+    cutoff = timezone.now() - timedelta(seconds=settings.DIN_CACHE_TTL)
+    deleted, _ = DINCacheEntry.objects.filter(fetched_at__lt=cutoff).delete()
+    return deleted
+
+def record_lookups(hits, misses):
+    try:
+        with get_redis().pipeline(transaction=False) as pipe:
+            if hits:
+                pipe.incrby(HITS_KEY, hits)
+            if misses:
+                pipe.incrby(MISSES_KEY, misses)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record DIN cache counters: {str(e)}")
+
+def cache_stats():
+    hits, misses = get_redis().mget(HITS_KEY, MISSES_KEY)
+    return {'hits': int(hits or 0), 'misses': int(misses or 0)}
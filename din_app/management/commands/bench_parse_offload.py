@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from aiohttp import web
+import aiohttp
+import asyncio
+import statistics
+import time
+from din_app import parse_pool
+
+def build_response(records):
+    companies = "".join(
+        f"""
+        <companyDetails>
+          <nameOrgOne>COMPANY {i} PRIVATE LIMITED</nameOrgOne>
+          <categoryCompany>Company limited by Shares</categoryCompany>
+          <companyAddress>{i} INDUSTRIAL AREA, PHASE {i % 7}</companyAddress>
+          <state1>MAHARASHTRA</state1>
+          <creationDate>2010-01-{i % 28 + 1:02d}</creationDate>
+        </companyDetails>"""
+        for i in range(records)
+    )
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+  <soap:Body>
+    <ns2:getNCAPrefillDetailsResponse xmlns:ns2="http://ncaprifill.org/wsdl">
+      <return>
+        <dinDetails><firstName>RAMESH</firstName><familyName>SHARMA</familyName></dinDetails>{companies}
+      </return>
+    </ns2:getNCAPrefillDetailsResponse>
+  </soap:Body>
+</soap:Envelope>"""
+
+class Command(BaseCommand):
+    help = 'Measure event-loop lag while fetching and parsing SOAP responses with and without the parse executor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--records', type=int, default=200, help='companyDetails blocks per response (parse cost)')
+        parser.add_argument('--modes', default='inline,thread,process')
+        parser.add_argument('--workers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        body = build_response(options['records'])
+        self.stdout.write(f"Response size {len(body) / 1024:.0f} KiB, {options['requests']} requests, concurrency {options['concurrency']}")
+        self.stdout.write(f"{'mode':<8} {'req/s':>8} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+        for mode in options['modes'].split(','):
+            with override_settings(DIN_PARSE_EXECUTOR=mode, DIN_PARSE_WORKERS=options['workers']):
+                parse_pool.shutdown()
+                try:
+                    elapsed, lags = asyncio.run(self.run_mode(body, options['requests'], options['concurrency']))
+                finally:
+                    parse_pool.shutdown()
+            lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+            p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+            self.stdout.write(
+                f"{mode:<8} {options['requests'] / elapsed:>8.0f} {statistics.median(lags_ms):>11.1f} {p99:>11.1f} {lags_ms[-1]:>11.1f}"
+            )
+
+    async def run_mode(self, body, total_requests, concurrency):
+        async def handler(request):
+            await asyncio.sleep(0.01)  # Simulated server latency
+            return web.Response(text=body, content_type='text/xml')
+
+        app = web.Application()
+        app.router.add_post('/', handler)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        lags = []
+        done = asyncio.Event()
+
+        async def monitor(interval=0.005):
+            while not done.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(interval)
+                lags.append(max(0.0, time.perf_counter() - started - interval))
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_and_parse(session):
+            async with semaphore:
+                async with session.post(f'http://127.0.0.1:{port}/') as response:
+                    text = await response.text()
+                return await parse_pool.parse_response(text)
+
+        monitor_task = asyncio.create_task(monitor())
+        started = time.perf_counter()
+        try:
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+                await asyncio.gather(*[fetch_and_parse(session) for _ in range(total_requests)])
+            elapsed = time.perf_counter() - started
+        finally:
+            done.set()
+            await monitor_task
+            await runner.cleanup()
+        return elapsed, lags
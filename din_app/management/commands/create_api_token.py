@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from din_app.bulk_api import create_token
+from din_app.utils import staff_check
+
+class Command(BaseCommand):
+    help = 'Create an API token for the bulk jobs API and print its key, which is not stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='', help='What the token is for, e.g. the pipeline using it')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist")
+        if not staff_check(user):
+            raise CommandError(f"User {user.username} cannot use the DIN tools (active non-superuser staff only)")
+        token, key = create_token(user, options['name'])
+        self.stdout.write(f"Created API token {token.key_prefix}... for {user.username}. Key (shown only once):")
+        self.stdout.write(key)
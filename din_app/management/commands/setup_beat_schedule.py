@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
+from django.conf import settings
+from django_celery_beat.models import PeriodicTask, CrontabSchedule, IntervalSchedule
 from django.db.utils import ProgrammingError, OperationalError
 import logging
 import time
@@ -7,7 +8,7 @@ import time
 logger = logging.getLogger('din_app')
 
 class Command(BaseCommand):
-    help = 'Set up Celery Beat schedule for cleanup_old_logs task'
+    help = 'Set up Celery Beat schedules for periodic maintenance tasks'
 
     def handle(self, *args, **options):
         max_retries = 5
@@ -34,7 +35,53 @@ class Command(BaseCommand):
                         'enabled': True,
                     }
                 )
-                logger.info('Successfully set up Celery Beat schedule for cleanup_old_logs')
+
+                PeriodicTask.objects.update_or_create(
+                    name='Purge expired DIN cache entries',
+                    defaults={
+                        'crontab': schedule,
+                        'task': 'din_app.tasks.purge_din_cache',
+                        'enabled': True,
+                    }
+                )
+
+                PeriodicTask.objects.update_or_create(
+                    name='Discover newly allocated DINs',
+                    defaults={
+                        'crontab': schedule,
+                        'task': 'din_app.tasks.run_scheduled_frontiers',
+                        'enabled': True,
+                    }
+                )
+
+                flush_schedule, _ = IntervalSchedule.objects.get_or_create(
+                    every=settings.DIN_PROGRESS_FLUSH_INTERVAL,
+                    period=IntervalSchedule.SECONDS,
+                )
+                PeriodicTask.objects.update_or_create(
+                    name='Flush DIN progress counters',
+                    defaults={
+                        'interval': flush_schedule,
+                        'crontab': None,
+                        'task': 'din_app.tasks.flush_din_progress',
+                        'enabled': True,
+                    }
+                )
+
+                sweep_schedule, _ = IntervalSchedule.objects.get_or_create(
+                    every=settings.DIN_LEASE_SWEEP_INTERVAL,
+                    period=IntervalSchedule.SECONDS,
+                )
+                PeriodicTask.objects.update_or_create(
+                    name='Restart DIN lease workers',
+                    defaults={
+                        'interval': sweep_schedule,
+                        'crontab': None,
+                        'task': 'din_app.tasks.sweep_din_leases',
+                        'enabled': True,
+                    }
+                )
+                logger.info('Successfully set up Celery Beat schedules for cleanup_old_logs, purge_din_cache, run_scheduled_frontiers, flush_din_progress and sweep_din_leases')
                 return
 
             except (ProgrammingError, OperationalError) as e:
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from din_app.concurrency import window_stats
+
+class Command(BaseCommand):
+    help = 'Print the AIMD concurrency window of every live worker process'
+
+    def handle(self, *args, **options):
+        stats = window_stats()
+        if not stats:
+            self.stdout.write('No worker process has published a window in the last few minutes')
+            return
+        for worker, snapshot in stats.items():
+            self.stdout.write(
+                f"{worker}: window {snapshot['window']}, limit {snapshot['limit']}, in flight {snapshot['in_flight']}"
+            )
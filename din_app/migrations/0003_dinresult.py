@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0002_dinrequest_din_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DINResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField()),
+                ('din', models.CharField(max_length=20)),
+                ('status', models.TextField()),
+                ('data', models.JSONField(default=dict)),
+                ('fetched_at', models.DateTimeField()),
+                ('din_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='din_app.dinrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['din_request', 'position'], name='din_app_din_din_req_b19157_idx'), models.Index(fields=['din'], name='din_app_din_din_2c225b_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dinresult',
+            constraint=models.UniqueConstraint(fields=('din_request', 'din'), name='unique_din_per_request'),
+        ),
+    ]
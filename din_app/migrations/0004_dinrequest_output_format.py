@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0003_dinresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dinrequest',
+            name='output_format',
+            field=models.CharField(choices=[('csv', 'CSV'), ('csv.gz', 'CSV (gzip)'), ('parquet', 'Parquet')], default='csv', max_length=10),
+        ),
+    ]
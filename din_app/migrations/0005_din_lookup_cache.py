@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0004_dinrequest_output_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DINCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('din', models.CharField(max_length=20, unique=True)),
+                ('data', models.JSONField(default=dict)),
+                ('fetched_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='cache_max_age',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='force_refresh',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0005_din_lookup_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dinrequest',
+            name='empty_policy',
+            field=models.CharField(choices=[('scan', 'Scan every sub-range in order'), ('defer', 'Scan dense sub-ranges first, empty ones last'), ('drop', 'Scan dense sub-ranges, skip empty ones')], default='scan', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='sampled_density',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 16:05
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('din_app', '0006_dinrequest_empty_policy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DINFrontier',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frontier', models.IntegerField(blank=True, null=True)),
+                ('is_scheduled', models.BooleanField(default=False)),
+                ('output_format', models.CharField(choices=[('csv', 'CSV'), ('csv.gz', 'CSV (gzip)'), ('parquet', 'Parquet')], default='csv', max_length=10)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='din_frontier', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:20
+
+import base64
+import json
+from django.db import migrations, models
+
+
+def din_list_to_din_set(apps, schema_editor):
+    DINRequest = apps.get_model('din_app', 'DINRequest')
+    for din_request in DINRequest.objects.exclude(din_list__isnull=True).exclude(din_list='').iterator():
+        intervals = []
+        for number in sorted({int(din) for din in json.loads(din_request.din_list) if str(din).strip().isdigit()}):
+            if intervals and intervals[-1][1] == number:
+                intervals[-1][1] = number + 1
+            else:
+                intervals.append([number, number + 1])
+        din_request.din_set = intervals
+        din_request.save(update_fields=['din_set'])
+
+
+def stored_intervals(din_set):
+    # Sets of many intervals are stored later as {"varint": <base64>, ...}: the
+    # gap before each interval and its length as LEB128 varints (DINSet.to_json)
+    if not isinstance(din_set, dict):
+        return din_set
+    numbers = []
+    number = shift = 0
+    for byte in base64.b64decode(din_set['varint']):
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(number)
+            number = shift = 0
+    intervals = []
+    end = 0
+    for gap, length in zip(numbers[::2], numbers[1::2]):
+        start = end + gap
+        end = start + length
+        intervals.append((start, end))
+    return intervals
+
+
+def din_set_to_din_list(apps, schema_editor):
+    DINRequest = apps.get_model('din_app', 'DINRequest')
+    for din_request in DINRequest.objects.exclude(din_set__isnull=True).iterator():
+        din_request.din_list = json.dumps([
+            f"{number:08d}" for start, end in stored_intervals(din_request.din_set) for number in range(start, end)
+        ])
+        din_request.save(update_fields=['din_list'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0007_dinfrontier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dinrequest',
+            name='din_set',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(din_list_to_din_set, din_set_to_din_list),
+        migrations.RemoveField(
+            model_name='dinrequest',
+            name='din_list',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0008_dinrequest_din_set'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dinrequest',
+            name='priority',
+            field=models.IntegerField(choices=[(2, 'Interactive'), (1, 'Normal'), (0, 'Bulk')], default=1),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('din_app', '0009_dinrequest_priority'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DINJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(default='processing', max_length=20)),
+                ('output_format', models.CharField(choices=[('csv', 'CSV'), ('csv.gz', 'CSV (gzip)'), ('parquet', 'Parquet')], default='csv', max_length=10)),
+                ('output_file', models.FileField(blank=True, null=True, upload_to='outputs/')),
+                ('total_dins', models.IntegerField(default=0)),
+                ('is_cancelled', models.BooleanField(default=False)),
+                ('email_status', models.CharField(default='pending', max_length=20)),
+                ('email_error', models.TextField(blank=True, null=True)),
+                ('email_sent_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='din_app.dinjob'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0010_dinjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dinrequest',
+            name='cached_dins',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='done_dins',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='failed_dins',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dinrequest',
+            name='success_dins',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('din_app', '0011_dinrequest_progress_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dinrequest',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='dinrequest',
+            index=models.Index(fields=['user', 'created_at'], name='din_app_din_user_id_27441d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dinrequest',
+            index=models.Index(fields=['user', 'updated_at'], name='din_app_din_user_id_257549_idx'),
+        ),
+    ]
@@ -3,21 +3,74 @@ from django.contrib.auth.models import User
 import json
 
 class DINRequest(models.Model):
+    OUTPUT_FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('csv.gz', 'CSV (gzip)'),
+        ('parquet', 'Parquet'),
+    ]
+    PRIORITY_CHOICES = [
+        (2, 'Interactive'),
+        (1, 'Normal'),
+        (0, 'Bulk'),
+    ]
+    EMPTY_POLICY_CHOICES = [
+        ('scan', 'Scan every sub-range in order'),
+        ('defer', 'Scan dense sub-ranges first, empty ones last'),
+        ('drop', 'Scan dense sub-ranges, skip empty ones'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     start_range = models.IntegerField(null=True, blank=True)
     end_range = models.IntegerField(null=True, blank=True)
     input_csv = models.FileField(upload_to='inputs/', null=True, blank=True)
-    din_list = models.TextField(null=True, blank=True)  # Store DINs as JSON string
+    din_set = models.JSONField(null=True, blank=True)  # DINSet.to_json(): [start, end) pairs or varint deltas
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     status = models.CharField(max_length=20, default='pending')
     progress = models.FloatField(default=0)
+    # Flushed from the live Redis counters, see progress.py
+    done_dins = models.IntegerField(default=0)
+    success_dins = models.IntegerField(default=0)
+    failed_dins = models.IntegerField(default=0)
+    cached_dins = models.IntegerField(default=0)
     output_csv = models.FileField(upload_to='outputs/', null=True, blank=True)
     is_cancelled = models.BooleanField(default=False)
+    output_format = models.CharField(max_length=10, choices=OUTPUT_FORMAT_CHOICES, default='csv')
+    cache_max_age = models.IntegerField(null=True, blank=True)  # Seconds; None uses DIN_CACHE_TTL
+    force_refresh = models.BooleanField(default=False)  # Skip the lookup cache and re-fetch every DIN
+    empty_policy = models.CharField(max_length=10, choices=EMPTY_POLICY_CHOICES, default='scan')
+    sampled_density = models.FloatField(null=True, blank=True)  # Share of planner-sampled DINs with a record
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=1)  # Fair-share lane, see scheduler.LANE_WEIGHTS
+    job = models.ForeignKey('DINJob', on_delete=models.CASCADE, null=True, blank=True, related_name='shards')
+    updated_at = models.DateTimeField(auto_now=True)  # Cursor for the requests API; set explicitly by queryset updates
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         return f"DIN Request {self.id} by {self.user.username}"
 
+# One submission; its DINRequest shards are merged into one output file and one email
+class DINJob(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    description = models.CharField(max_length=255, blank=True)  # e.g. "Range 1 - 500000" or the CSV file name
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=20, default='processing')
+    output_format = models.CharField(max_length=10, choices=DINRequest.OUTPUT_FORMAT_CHOICES, default='csv')
+    output_file = models.FileField(upload_to='outputs/', null=True, blank=True)
+    total_dins = models.IntegerField(default=0)
+    is_cancelled = models.BooleanField(default=False)
+    email_status = models.CharField(max_length=20, default='pending')
+    email_error = models.TextField(null=True, blank=True)
+    email_sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"DIN Job {self.id} by {self.user.username}"
+
 class EmailStatus(models.Model):
     din_request = models.OneToOneField(DINRequest, on_delete=models.CASCADE, related_name='email_status')
     status = models.CharField(max_length=20, default='pending')
@@ -25,4 +78,59 @@ class EmailStatus(models.Model):
     sent_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
-        return f"Email Status for DIN Request {self.din_request.id}"
\ No newline at end of file
+        return f"Email Status for DIN Request {self.din_request.id}"
+
+class DINResult(models.Model):
+    din_request = models.ForeignKey(DINRequest, on_delete=models.CASCADE, related_name='results')
+    position = models.IntegerField()  # Order of the DIN within its request
+    din = models.CharField(max_length=20)
+    status = models.TextField()
+    data = models.JSONField(default=dict)  # Non-empty PARAMETERS values keyed by parameter name
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['din_request', 'din'], name='unique_din_per_request'),
+        ]
+        indexes = [
+            models.Index(fields=['din_request', 'position']),
+            models.Index(fields=['din']),
+        ]
+
+    def __str__(self):
+        return f"DIN {self.din} for DIN Request {self.din_request_id}"
+
+
+class DINCacheEntry(models.Model):
+    din = models.CharField(max_length=20, unique=True)
+    data = models.JSONField(default=dict)  # Same shape as DINResult.data
+    fetched_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Cached DIN {self.din}"
+
+
+class DINFrontier(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='din_frontier')
+    frontier = models.IntegerField(null=True, blank=True)  # Highest allocated DIN found so far
+    is_scheduled = models.BooleanField(default=False)  # Run discovery with the daily beat task
+    output_format = models.CharField(max_length=10, choices=DINRequest.OUTPUT_FORMAT_CHOICES, default='csv')
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"DIN frontier {self.frontier} for {self.user.username}"
+
+
+# Credential for the bulk jobs API. Only a SHA-256 of the key is stored; the key
+# itself is shown once, by the create_api_token command.
+class APIToken(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)  # e.g. the pipeline using it
+    key_prefix = models.CharField(max_length=8)  # First characters of the key, to tell tokens apart
+    key_hash = models.CharField(max_length=64, unique=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"API token {self.key_prefix}... for {self.user.username}"
@@ -0,0 +1,184 @@
+import logging
+import math
+import time
+import redis
+from django.conf import settings
+from .redis_client import get_redis
+from .results import NOT_FOUND_STATUS
+
+logger = logging.getLogger('din_app')
+
+# DINs known to have no record are kept as Redis bitmaps, one bit per DIN, per
+# day the miss was seen in and per chunk of CHUNK_DINS consecutive DINs
+# (din:empty:<day number>:<chunk>), so a day's misses only take the chunks
+# they fall in, at most 128KB each. Every chunk is listed in din:empty:chunks,
+# scored by its day; past DIN_NEGATIVE_CACHE_MAX_CHUNKS the oldest chunks are
+# dropped to make room, which caps the cache at about 32MB by default in a
+# Redis it shares with the Celery broker. Chunks also expire on their own once
+# their day is older than DIN_NEGATIVE_CACHE_TTL.
+# A lookup with a max age only reads the days that began within it, so a miss
+# is never used once it is older than the max age; misses from the partly
+# covered oldest day are ignored, and a max age under a day reads none.
+KEY_PREFIX = 'din:empty'
+BUCKET_SECONDS = 24 * 3600
+CHUNK_DINS = 1 << 20
+CACHED_EMPTY_STATUS = 'cached-empty'
+# KEYS: the chunk list, then today's chunks. ARGV: chunk cap, TTL, today, oldest day
+# that may still exist, then per chunk the number of offsets followed by the offsets.
+# A chunk not stored yet first makes room by dropping the oldest listed chunks.
+MARK_SCRIPT = """
+local limit = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[4])
+local at = 5
+for i = 2, #KEYS do
+    local count = tonumber(ARGV[at])
+    local stored = redis.call('EXISTS', KEYS[i]) == 1
+    if not stored then
+        while redis.call('ZCARD', KEYS[1]) >= limit do
+            local oldest = redis.call('ZPOPMIN', KEYS[1])
+            if #oldest == 0 then
+                break
+            end
+            redis.call('DEL', oldest[1])
+        end
+        stored = limit > 0
+    end
+    if stored then
+        for j = at + 1, at + count do
+            redis.call('SETBIT', KEYS[i], ARGV[j], 1)
+        end
+        redis.call('EXPIRE', KEYS[i], ARGV[2])
+        redis.call('ZADD', KEYS[1], ARGV[3], KEYS[i])
+    end
+    at = at + count + 1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 0
+"""
+# Clear bits only in bitmaps that still exist, so expired days are not recreated without a TTL
+CLEAR_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for _, number in ipairs(ARGV) do
+            redis.call('SETBIT', key, number, 0)
+        end
+    end
+end
+return 0
+"""
+# Read a byte range of each chunk when its DINs are this dense, otherwise GETBIT each DIN
+MAX_RANGE_READ_BYTES = 16 * 1024
+
+def _bucket(timestamp):
+    return int(timestamp // BUCKET_SECONDS)
+
+def _live_buckets(max_age):
+    """
+    Buckets that began within the last max_age seconds, newest last.
+    """
+    now = time.time()
+    return range(math.ceil((now - max_age) / BUCKET_SECONDS), _bucket(now) + 1)
+
+def _key(bucket, chunk):
+    return f'{KEY_PREFIX}:{bucket}:{chunk}'
+
+def _chunks_key():
+    return f'{KEY_PREFIX}:chunks'
+
+def _by_chunk(numbers):
+    """
+    Group DIN numbers as {chunk: [offset in the chunk]}.
+    """
+    chunks = {}
+    for number in numbers:
+        chunks.setdefault(number // CHUNK_DINS, []).append(number % CHUNK_DINS)
+    return chunks
+
+def is_empty_row(row):
+    """
+    True when a fetched row says the DIN has no record: a 404 or a response with no fields.
+    """
+    status = row[1]
+    if status == NOT_FOUND_STATUS:
+        return True
+    return status == "success" and all(value in (None, "") for value in row[2:])
+
+def effective_max_age(din_request):
+    if din_request.force_refresh:
+        return None
+    max_age = din_request.cache_max_age if din_request.cache_max_age is not None else settings.DIN_NEGATIVE_CACHE_TTL
+    return min(max_age, settings.DIN_NEGATIVE_CACHE_TTL)
+
+def find_known_empty(dins, max_age):
+    """
+    Return the subset of dins recorded as empty within the last max_age seconds,
+    to the day: see the note on buckets above. Redis errors are logged and
+    treated as "nothing known".
+    """
+    buckets = list(_live_buckets(max_age)) if max_age else []
+    if not buckets or not dins:
+        return set()
+    numbers = [int(din) for din in dins]
+    chunks = _by_chunk(set(numbers))
+    try:
+        with get_redis().pipeline(transaction=False) as pipe:
+            for chunk, offsets in chunks.items():
+                low, high = min(offsets), max(offsets)
+                if high // 8 - low // 8 <= MAX_RANGE_READ_BYTES:
+                    for bucket in buckets:
+                        pipe.getrange(_key(bucket, chunk), low // 8, high // 8)
+                else:
+                    for offset in offsets:
+                        for bucket in buckets:
+                            pipe.getbit(_key(bucket, chunk), offset)
+            replies = iter(pipe.execute())
+    except redis.RedisError as e:
+        logger.warning(f"Negative DIN cache unavailable: {str(e)}")
+        return set()
+    empty = set()
+    for chunk, offsets in chunks.items():
+        low, high = min(offsets), max(offsets)
+        first_byte = low // 8
+        if high // 8 - first_byte <= MAX_RANGE_READ_BYTES:
+            merged = bytearray(high // 8 - first_byte + 1)
+            for _ in buckets:
+                for i, byte in enumerate(next(replies)):
+                    merged[i] |= byte
+            empty.update(
+                chunk * CHUNK_DINS + offset for offset in offsets
+                if merged[offset // 8 - first_byte] & (0x80 >> (offset % 8))
+            )
+        else:
+            for offset in offsets:
+                if any([next(replies) for _ in buckets]):
+                    empty.add(chunk * CHUNK_DINS + offset)
+    return {din for din, number in zip(dins, numbers) if number in empty}
+
+def record_rows(rows):
+    """
+    Mark empty DINs in today's chunks and clear DINs that now have a record from all chunks.
+    """
+    empty = [int(row[0]) for row in rows if is_empty_row(row)]
+    found = [int(row[0]) for row in rows if row[1] == "success" and not is_empty_row(row)]
+    if not empty and not found:
+        return
+    now = time.time()
+    current = _bucket(now)
+    ttl = settings.DIN_NEGATIVE_CACHE_TTL + BUCKET_SECONDS
+    try:
+        with get_redis().pipeline(transaction=False) as pipe:
+            if empty:
+                marks = _by_chunk(empty)
+                args = [settings.DIN_NEGATIVE_CACHE_MAX_CHUNKS, ttl, current, _bucket(now - ttl)]
+                for offsets in marks.values():
+                    args += [len(offsets)] + offsets
+                keys = [_chunks_key()] + [_key(current, chunk) for chunk in marks]
+                pipe.eval(MARK_SCRIPT, len(keys), *keys, *args)
+            # Every bitmap that may still exist, including the partly expired oldest day
+            buckets = range(_bucket(now - settings.DIN_NEGATIVE_CACHE_TTL), current + 1)
+            for chunk, offsets in _by_chunk(found).items():
+                keys = [_key(bucket, chunk) for bucket in buckets]
+                pipe.eval(CLEAR_SCRIPT, len(keys), *keys, *offsets)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not update negative DIN cache: {str(e)}")
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from django.conf import settings
+from .utils import extract_din_fields
+
+logger = logging.getLogger('din_app')
+
+_executor = None
+_slots = {}
+
+def get_executor():
+    """
+    Return this process's parse executor as configured by DIN_PARSE_EXECUTOR
+    ('thread' or 'process'), or None when parsing runs inline on the event loop.
+    Daemonic processes, such as Celery's prefork children, cannot start a
+    process pool, so they fall back to threads with a warning.
+    """
+    global _executor
+    if _executor is None and settings.DIN_PARSE_EXECUTOR != 'inline':
+        use_processes = settings.DIN_PARSE_EXECUTOR == 'process'
+        if use_processes and multiprocessing.current_process().daemon:
+            logger.warning(
+                "DIN_PARSE_EXECUTOR='process' is not possible in a daemonic worker process "
+                "(e.g. the prefork pool); parsing in threads instead"
+            )
+            use_processes = False
+        if use_processes:
+            _executor = ProcessPoolExecutor(max_workers=settings.DIN_PARSE_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=settings.DIN_PARSE_WORKERS, thread_name_prefix='din-parse')
+    return _executor
+
+def _get_slots():
+    # Bounds how many responses may wait for or sit in the parse stage at once
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        for stale in [l for l in _slots if l.is_closed()]:
+            del _slots[stale]
+        slots = asyncio.Semaphore(settings.DIN_PARSE_QUEUE_SIZE)
+        _slots[loop] = slots
+    return slots
+
+async def parse_response(text):
+    """
+    Run extract_din_fields off the event loop. When DIN_PARSE_QUEUE_SIZE responses
+    are already queued for the executor, further callers wait here instead.
+    """
+    executor = get_executor()
+    if executor is None:
+        return extract_din_fields(text)
+    async with _get_slots():
+        return await asyncio.get_running_loop().run_in_executor(executor, extract_din_fields, text)
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
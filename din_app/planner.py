@@ -0,0 +1,58 @@
+import random
+from . import lookup_cache, negative_cache
+
+# A range request is split into sub-requests before planning. The planner
+# fetches DIN_PLANNER_SAMPLE_SIZE random DINs from each one, stores the share
+# that has a record as DINRequest.sampled_density and dispatches the
+# sub-requests densest first. The sampled rows go through the lookup and
+# negative caches, so the scan that follows does not fetch them again.
+
+def sample_dins(din_request, size):
+    """
+    Pick up to size distinct DINs at random from a range sub-request.
+    """
+    span = range(din_request.start_range, din_request.end_range + 1)
+    return [f"{din:08d}" for din in sorted(random.sample(span, min(size, len(span))))]
+
+def has_record(row):
+    return row[1] == "success" and not negative_cache.is_empty_row(row)
+
+def split_sample(din_request, dins):
+    """
+    Answer what the caches can for a sample.
+    Returns (rows, dins_to_fetch), rows holding the cached answers.
+    """
+    known_empty = negative_cache.find_known_empty(dins, negative_cache.effective_max_age(din_request))
+    cached = lookup_cache.get_cached_rows(
+        [din for din in dins if din not in known_empty], lookup_cache.effective_max_age(din_request)
+    )
+    rows = [row for row, _ in cached.values()]
+    rows += [[din, negative_cache.CACHED_EMPTY_STATUS] for din in known_empty]
+    return rows, [din for din in dins if din not in known_empty and din not in cached]
+
+def estimate_density(rows):
+    """
+    Share of answered sample DINs that have a record, or None when no DIN was
+    answered (every fetch failed), so the density is unknown.
+    """
+    answered = [row for row in rows if row[1] in ("success", negative_cache.CACHED_EMPTY_STATUS) or negative_cache.is_empty_row(row)]
+    if not answered:
+        return None
+    return sum(1 for row in answered if has_record(row)) / len(answered)
+
+def order_for_dispatch(din_requests, policy):
+    """
+    Order sampled sub-requests for dispatch: densest first, then those with an
+    unknown density, then those that sampled empty. Under the 'drop' policy the
+    empty ones are returned separately instead of being dispatched.
+    Returns (to_dispatch, to_skip). Ties keep range order.
+    """
+    dense = sorted(
+        (r for r in din_requests if r.sampled_density),
+        key=lambda r: (-r.sampled_density, r.start_range),
+    )
+    unknown = sorted((r for r in din_requests if r.sampled_density is None), key=lambda r: r.start_range)
+    empty = sorted((r for r in din_requests if r.sampled_density == 0), key=lambda r: r.start_range)
+    if policy == 'drop':
+        return dense + unknown, empty
+    return dense + unknown + empty, []
@@ -0,0 +1,100 @@
+from .redis_client import get_redis
+from . import events
+
+# Live progress of each request is a Redis hash of counters:
+#   din:progress:<id>    hash total, done, success, failed, cached
+#   din:progress:dirty   set of requests changed since the last flush
+# Lease workers HINCRBY the counters after each chunk, so concurrent chunks
+# never lose each other's updates and cost no database write. flush() copies
+# the counters of dirty requests to DINRequest in one bulk update; the views
+# read the live counters and fall back to the flushed columns once a
+# request's hash has expired.
+# success and failed count DINs fetched from MCA, cached those answered from
+# the lookup or negative cache; done is their sum plus results stored by
+# earlier runs, which start() counts by status.
+KEY_PREFIX = 'din:progress'
+KEY_TTL = 7 * 24 * 3600
+COUNTERS = ('done', 'success', 'failed', 'cached')
+FLUSHED_FIELDS = ['progress', 'done_dins', 'success_dins', 'failed_dins', 'cached_dins']  # DINRequest columns
+
+def _key(din_request_id):
+    return f'{KEY_PREFIX}:{din_request_id}'
+
+def start(din_request_id, total, **counts):
+    """
+    Reset a request's counters when it is dispatched, seeding them with counts
+    of results already stored.
+    """
+    values = {'total': total, **{name: counts.get(name, 0) for name in COUNTERS}}
+    with get_redis().pipeline() as pipe:
+        pipe.delete(_key(din_request_id))
+        pipe.hset(_key(din_request_id), mapping=values)
+        pipe.expire(_key(din_request_id), KEY_TTL)
+        pipe.sadd(f'{KEY_PREFIX}:dirty', din_request_id)
+        pipe.execute()
+
+def record(din_request_id, success=0, failed=0, cached=0, user_id=None):
+    """
+    Count finished DINs. With user_id, the change is also announced on the
+    user's event channel for open progress streams.
+    """
+    with get_redis().pipeline() as pipe:
+        key = _key(din_request_id)
+        pipe.hincrby(key, 'done', success + failed + cached)
+        for name, count in (('success', success), ('failed', failed), ('cached', cached)):
+            if count:
+                pipe.hincrby(key, name, count)
+        pipe.expire(key, KEY_TTL)
+        pipe.sadd(f'{KEY_PREFIX}:dirty', din_request_id)
+        if user_id is not None:
+            pipe.publish(events.channel(user_id), din_request_id)
+        pipe.execute()
+
+def _parse(values):
+    if not values:
+        return None
+    counters = {name.decode(): int(value) for name, value in values.items()}
+    total = counters.get('total', 0)
+    counters['done'] = min(counters.get('done', 0), total)
+    counters['progress'] = counters['done'] / total * 100 if total else 0
+    return counters
+
+def get_many(din_request_ids):
+    """
+    Return {din_request_id: counters} for the requests that have live counters,
+    counters holding total, done, success, failed, cached and progress (percent).
+    """
+    with get_redis().pipeline(transaction=False) as pipe:
+        for din_request_id in din_request_ids:
+            pipe.hgetall(_key(din_request_id))
+        results = pipe.execute()
+    live = {}
+    for din_request_id, values in zip(din_request_ids, results):
+        counters = _parse(values)
+        if counters is not None:
+            live[din_request_id] = counters
+    return live
+
+def get(din_request_id):
+    return get_many([din_request_id]).get(din_request_id)
+
+def take_dirty():
+    """
+    Atomically take and clear the set of requests changed since the last flush.
+    """
+    with get_redis().pipeline() as pipe:
+        pipe.smembers(f'{KEY_PREFIX}:dirty')
+        pipe.delete(f'{KEY_PREFIX}:dirty')
+        members, _ = pipe.execute()
+    return [int(member) for member in members]
+
+def apply(din_request, counters):
+    """
+    Copy counters onto a DINRequest's progress columns, without saving.
+    """
+    din_request.progress = counters['progress']
+    din_request.done_dins = counters['done']
+    din_request.success_dins = counters.get('success', 0)
+    din_request.failed_dins = counters.get('failed', 0)
+    din_request.cached_dins = counters.get('cached', 0)
+    return din_request
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+import redis
+from django.conf import settings
+from .redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger('din_app')
+
+# Reserve tokens from a bucket shared by every worker. The bucket refills at
+# `rate` tokens/second up to `burst`; a caller that finds too few tokens still
+# takes its share (the balance goes negative) and is told how long to wait, so
+# callers are admitted in order with a single round trip each. Redis TIME is
+# the clock, so workers on different hosts agree on elapsed time.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil then
+    tokens = burst
+    ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate) - requested
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst / rate + wait) * 1000) + 1000)
+return tostring(wait)
+"""
+
+class TokenBucket:
+    """
+    Cluster-wide token bucket stored in Redis.
+    """
+
+    def __init__(self, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens and return how many seconds the caller must wait before using them.
+        """
+        return float(get_redis().eval(TOKEN_BUCKET_SCRIPT, 1, self.key, self.rate, self.burst, tokens))
+
+    async def reserve_async(self, tokens=1):
+        return float(await get_async_redis().eval(TOKEN_BUCKET_SCRIPT, 1, self.key, self.rate, self.burst, tokens))
+
+    def acquire(self, tokens=1):
+        """
+        Block until the tokens may be used. Fails open (with a warning) if Redis is unreachable.
+        """
+        try:
+            wait = self.reserve(tokens)
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable, proceeding without it: {str(e)}")
+            return
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        try:
+            wait = await self.reserve_async(tokens)
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable, proceeding without it: {str(e)}")
+            return
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class _NoLimit:
+    def acquire(self, tokens=1):
+        pass
+
+    async def acquire_async(self, tokens=1):
+        pass
+
+def get_mca_rate_limiter():
+    """
+    Return the bucket that every request to the MCA endpoint draws from.
+    A non-positive MCA_RATE_LIMIT_PER_SECOND disables the global limit.
+    """
+    if settings.MCA_RATE_LIMIT_PER_SECOND <= 0:
+        return _NoLimit()
+    return TokenBucket('din:ratelimit:mca', settings.MCA_RATE_LIMIT_PER_SECOND, settings.MCA_RATE_LIMIT_BURST)
@@ -0,0 +1,30 @@
+import asyncio
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_client = None
+_async_clients = {}
+
+def get_redis():
+    """
+    Return the process-wide synchronous Redis client for DIN_REDIS_URL.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.DIN_REDIS_URL)
+    return _client
+
+def get_async_redis():
+    """
+    Return an asyncio Redis client bound to the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        # Drop clients left behind by loops that have since been closed
+        for stale in [l for l in _async_clients if l.is_closed()]:
+            del _async_clients[stale]
+        client = redis.asyncio.Redis.from_url(settings.DIN_REDIS_URL)
+        _async_clients[loop] = client
+    return client
@@ -0,0 +1,206 @@
+import csv
+import gzip
+import io
+import json
+import os
+from django.db import connection, transaction
+from django.db.models import Q
+from .models import DINResult
+from .utils import PARAMETERS, concat_files
+
+RESULT_EXPORT_CHUNK_SIZE = 5000
+NOT_FOUND_STATUS = "failed: DIN not found (404)"
+# Failures other than a 404 (server errors, timeouts, ...) are fetched again when a
+# request is resumed, and the new row replaces the stored one
+RETRYABLE_FAILURES = Q(status__startswith='failed') & ~Q(status=NOT_FOUND_STATUS)
+
+def row_to_result_fields(row):
+    """
+    Split a [din, status, *PARAMETERS values] row into (din, status, data),
+    keeping only the parameters that have a value.
+    """
+    din, status = row[0], row[1]
+    data = {param: value for param, value in zip(PARAMETERS, row[2:]) if value not in (None, "")}
+    return din, status, data
+
+def result_to_row(din, status, data):
+    return [din, status] + [data.get(param, "") for param in PARAMETERS]
+
+def ingest_din_results(din_request_id, rows):
+    """
+    Store a batch of (position, row, fetched_at) results for a request in one round trip.
+    On PostgreSQL the rows are streamed with COPY into a temporary table and
+    merged with ON CONFLICT DO UPDATE, which only replaces stored
+    RETRYABLE_FAILURES, so re-ingesting a batch is harmless. Other databases
+    delete those failures and fall back to bulk_create(ignore_conflicts=True).
+    """
+    if not rows:
+        return
+    records = [(position,) + row_to_result_fields(row) + (fetched_at,) for position, row, fetched_at in rows]
+    if connection.vendor != 'postgresql':
+        dins = [record[1] for record in records]
+        with transaction.atomic():
+            for start in range(0, len(dins), 500):
+                DINResult.objects.filter(RETRYABLE_FAILURES, din_request_id=din_request_id, din__in=dins[start:start + 500]).delete()
+            DINResult.objects.bulk_create(
+                [
+                    DINResult(din_request_id=din_request_id, position=position, din=din, status=status, data=data, fetched_at=fetched_at)
+                    for position, din, status, data, fetched_at in records
+                ],
+                ignore_conflicts=True,
+                batch_size=1000,
+            )
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for position, din, status, data, fetched_at in records:
+        writer.writerow([din_request_id, position, din, status, json.dumps(data), fetched_at.isoformat()])
+    buffer.seek(0)
+
+    table = DINResult._meta.db_table
+    columns = "din_request_id, position, din, status, data, fetched_at"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMP TABLE din_result_load "
+            "(din_request_id bigint, position integer, din varchar(20), status text, data jsonb, fetched_at timestamptz) "
+            "ON COMMIT DROP"
+        )
+        cursor.copy_expert(f"COPY din_result_load ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.execute(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM din_result_load "
+            "ON CONFLICT (din_request_id, din) DO UPDATE SET position = EXCLUDED.position, "
+            "status = EXCLUDED.status, data = EXCLUDED.data, fetched_at = EXCLUDED.fetched_at "
+            f"WHERE {table}.status LIKE 'failed%%' AND {table}.status <> %s",
+            [NOT_FOUND_STATUS],
+        )
+
+def iter_result_rows(din_request_id):
+    """
+    Stream a request's result rows in input order without loading them all.
+    """
+    results = (
+        DINResult.objects.filter(din_request_id=din_request_id)
+        .order_by('position')
+        .values_list('din', 'status', 'data')
+        .iterator(chunk_size=RESULT_EXPORT_CHUNK_SIZE)
+    )
+    for din, status, data in results:
+        yield result_to_row(din, status, data)
+
+RESULT_COLUMNS = ["DIN", "Status"] + PARAMETERS
+
+def write_results_csv(din_request_id, output_path, header=True):
+    """
+    Export a request's results to a CSV file, streaming rows from the database.
+    """
+    with open(output_path, mode='w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        if header:
+            writer.writerow(RESULT_COLUMNS)
+        writer.writerows(iter_result_rows(din_request_id))
+
+def write_results_csv_gz(din_request_id, output_path, header=True):
+    with gzip.open(output_path, mode='wt', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        if header:
+            writer.writerow(RESULT_COLUMNS)
+        writer.writerows(iter_result_rows(din_request_id))
+
+def write_results_parquet(din_request_id, output_path, header=True):
+    """
+    Export a request's results to Parquet one row group per export chunk.
+    Every column is a dictionary-encoded string, which suits the mostly empty fields.
+    header is ignored, since the schema carries the column names.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in RESULT_COLUMNS])
+    with pq.ParquetWriter(output_path, schema, use_dictionary=True, compression='zstd') as writer:
+        chunk = []
+        for row in iter_result_rows(din_request_id):
+            chunk.append(row)
+            if len(chunk) >= RESULT_EXPORT_CHUNK_SIZE:
+                writer.write_table(_rows_to_table(pa, schema, chunk))
+                chunk = []
+        if chunk:
+            writer.write_table(_rows_to_table(pa, schema, chunk))
+
+def _rows_to_table(pa, schema, rows):
+    columns = [[None if value in (None, "") else str(value) for value in column] for column in zip(*rows)]
+    return pa.Table.from_arrays([pa.array(column, type=pa.string()) for column in columns], schema=schema)
+
+RESULT_WRITERS = {
+    'csv': write_results_csv,
+    'csv.gz': write_results_csv_gz,
+    'parquet': write_results_parquet,
+}
+
+def write_results(din_request, output_dir, header=True):
+    """
+    Export a request's results in its output_format. Returns the file name written.
+    Shards of a DINJob are written without a CSV header so merge_results can append them.
+    """
+    file_name = f'din_{din_request.id}.{din_request.output_format}'
+    RESULT_WRITERS[din_request.output_format](din_request.id, os.path.join(output_dir, file_name), header=header)
+    return file_name
+
+STREAM_FORMATS = ('csv', 'ndjson')
+
+def iter_result_bytes(din_request_id, stream_format):
+    """
+    Stream a request's results as header-less CSV or as NDJSON objects
+    {"din", "status", "data"}, one encoded chunk per export chunk of rows.
+    The bytes depend only on the stored results, so a finished request always
+    encodes the same way.
+    """
+    results = (
+        DINResult.objects.filter(din_request_id=din_request_id)
+        .order_by('position')
+        .values_list('din', 'status', 'data')
+        .iterator(chunk_size=RESULT_EXPORT_CHUNK_SIZE)
+    )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, (din, status, data) in enumerate(results, 1):
+        if stream_format == 'ndjson':
+            buffer.write(json.dumps({'din': din, 'status': status, 'data': data}, separators=(',', ':')) + '\n')
+        else:
+            writer.writerow(result_to_row(din, status, data))
+        if count % RESULT_EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def csv_header():
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(RESULT_COLUMNS)
+    return buffer.getvalue().encode('utf-8')
+
+def merge_results(output_format, part_paths, output_path):
+    """
+    Merge header-less shard outputs, in order, into one file at output_path.
+    CSV parts are appended after a header with concat_files. Gzip parts are
+    appended the same way after a gzip member holding the header, since
+    concatenated gzip members form a valid gzip file. Parquet parts are copied
+    one row group at a time.
+    """
+    if output_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(column, pa.string()) for column in RESULT_COLUMNS])
+        with pq.ParquetWriter(output_path, schema, use_dictionary=True, compression='zstd') as writer:
+            for part_path in part_paths:
+                part = pq.ParquetFile(part_path)
+                for i in range(part.num_row_groups):
+                    writer.write_table(part.read_row_group(i))
+        return
+
+    header = csv_header()
+    with open(output_path, 'wb') as output:
+        output.write(gzip.compress(header) if output_format == 'csv.gz' else header)
+    concat_files(output_path, part_paths)
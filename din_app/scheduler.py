@@ -0,0 +1,207 @@
+from django.conf import settings
+from .redis_client import get_redis
+
+# Lease workers are shared by every request. Before each chunk a worker asks
+# the scheduler which request to serve, using start-time fair queuing at two
+# levels:
+#   din:sched:users                  zset user -> virtual start tag
+#   din:sched:lanes:<user>           zset priority lane -> virtual start tag
+#   din:sched:lane:<user>:<lane>     zset request -> arrival order (FIFO within a lane)
+#   din:sched:jobs                   hash request -> "<user>:<lane>"
+#   din:sched:inflight:<user>        zset chunk token -> deadline
+# The user with the lowest tag that is below DIN_USER_MAX_INFLIGHT chunks in
+# flight is served, then that user's lane with the lowest tag, then the
+# oldest request in the lane. Serving a chunk advances the user's tag by
+# chunk / weight of its heaviest lane, and the lane's tag by chunk / lane
+# weight, so users share workers evenly, and within a user an interactive
+# lane gets LANE_WEIGHTS times the share of a bulk lane. Requests in a lane
+# stay in arrival order, which keeps the planner's dense-first order.
+# In-flight tokens carry a deadline, so a worker that dies does not hold its
+# user's slot forever. The scripts build per-user key names themselves, so
+# they need a single Redis instance rather than a cluster.
+# Lease workers running at once are capped at DIN_LEASE_WORKERS across all
+# requests, so a large sweep cannot fill the Celery queue with them:
+#   din:sched:workers                zset worker slot -> deadline
+# A slot is reserved before its work_din_queue task is queued, so queued and
+# running workers count alike, and its worker renews it before each chunk. A
+# slot whose deadline passes (its worker was killed) is dropped, and the
+# sweep_din_leases beat task starts replacements while requests are queued.
+KEY_PREFIX = 'din:sched'
+LANE_WEIGHTS = {0: 1, 1: 4, 2: 16}  # DINRequest.priority -> share weight
+
+ADD_JOB_SCRIPT = """
+local prefix, user, lane, job = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local users = prefix .. ':users'
+local lanes = prefix .. ':lanes:' .. user
+local queue = prefix .. ':lane:' .. user .. ':' .. lane
+if not redis.call('ZSCORE', users, user) then
+    local vtime = tonumber(redis.call('GET', prefix .. ':vtime') or '0')
+    local lowest = redis.call('ZRANGE', users, 0, 0, 'WITHSCORES')
+    if lowest[2] and tonumber(lowest[2]) > vtime then
+        vtime = tonumber(lowest[2])
+    end
+    redis.call('ZADD', users, vtime, user)
+end
+if not redis.call('ZSCORE', lanes, lane) then
+    local lowest = redis.call('ZRANGE', lanes, 0, 0, 'WITHSCORES')
+    redis.call('ZADD', lanes, lowest[2] or 0, lane)
+end
+redis.call('ZADD', queue, 'NX', redis.call('INCR', prefix .. ':seq'), job)
+redis.call('HSET', prefix .. ':jobs', job, user .. ':' .. lane)
+return 1
+"""
+
+REMOVE_JOB_SCRIPT = """
+local prefix, job = ARGV[1], ARGV[2]
+local owner = redis.call('HGET', prefix .. ':jobs', job)
+if not owner then
+    return 0
+end
+local user, lane = string.match(owner, '([^:]+):([^:]+)')
+local lanes = prefix .. ':lanes:' .. user
+local queue = prefix .. ':lane:' .. user .. ':' .. lane
+redis.call('ZREM', queue, job)
+redis.call('HDEL', prefix .. ':jobs', job)
+if redis.call('ZCARD', queue) == 0 then
+    redis.call('ZREM', lanes, lane)
+    if redis.call('ZCARD', lanes) == 0 then
+        redis.call('ZREM', prefix .. ':users', user)
+    end
+end
+return 1
+"""
+
+# ARGV: prefix, per-user cap, chunk size, token ttl, then lane weights as
+# lane/weight pairs terminated by '-', then excluded requests
+PICK_SCRIPT = """
+local prefix = ARGV[1]
+local cap = tonumber(ARGV[2])
+local chunk = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local weights = {}
+local i = 5
+while ARGV[i] ~= '-' do
+    weights[ARGV[i]] = tonumber(ARGV[i + 1])
+    i = i + 2
+end
+local excluded = {}
+for j = i + 1, #ARGV do
+    excluded[ARGV[j]] = true
+end
+local now = tonumber(redis.call('TIME')[1])
+
+local users = redis.call('ZRANGE', prefix .. ':users', 0, -1, 'WITHSCORES')
+for u = 1, #users, 2 do
+    local user, user_tag = users[u], tonumber(users[u + 1])
+    local inflight = prefix .. ':inflight:' .. user
+    redis.call('ZREMRANGEBYSCORE', inflight, '-inf', now)
+    if redis.call('ZCARD', inflight) < cap then
+        local lanes = redis.call('ZRANGE', prefix .. ':lanes:' .. user, 0, -1, 'WITHSCORES')
+        local user_weight = 1
+        for l = 1, #lanes, 2 do
+            user_weight = math.max(user_weight, weights[lanes[l]] or 1)
+        end
+        for l = 1, #lanes, 2 do
+            local lane, lane_tag = lanes[l], tonumber(lanes[l + 1])
+            for _, job in ipairs(redis.call('ZRANGE', prefix .. ':lane:' .. user .. ':' .. lane, 0, -1)) do
+                if not excluded[job] then
+                    redis.call('SET', prefix .. ':vtime', tostring(user_tag))
+                    redis.call('ZADD', prefix .. ':users', user_tag + chunk / user_weight, user)
+                    redis.call('ZADD', prefix .. ':lanes:' .. user, lane_tag + chunk / (weights[lane] or 1), lane)
+                    local token = redis.call('INCR', prefix .. ':seq')
+                    redis.call('ZADD', inflight, now + ttl, token)
+                    return {user, job, token}
+                end
+            end
+        end
+    end
+end
+return false
+"""
+
+def _lane_args():
+    args = []
+    for lane, weight in LANE_WEIGHTS.items():
+        args += [lane, weight]
+    return args + ['-']
+
+def add_job(din_request_id, user_id, priority):
+    get_redis().eval(ADD_JOB_SCRIPT, 0, KEY_PREFIX, user_id, priority, din_request_id)
+
+def remove_job(din_request_id):
+    get_redis().eval(REMOVE_JOB_SCRIPT, 0, KEY_PREFIX, din_request_id)
+
+def pick(excluded=()):
+    """
+    Choose the request the calling worker should serve next and count one chunk
+    against its user. Returns (user_id, din_request_id, token), or None when
+    every queued request is excluded or its user is at the in-flight cap.
+    Pass the token to done() once the chunk is finished.
+    """
+    result = get_redis().eval(
+        PICK_SCRIPT, 0, KEY_PREFIX, settings.DIN_USER_MAX_INFLIGHT, settings.DIN_BATCH_SIZE,
+        settings.DIN_LEASE_TTL, *_lane_args(), *excluded,
+    )
+    if not result:
+        return None
+    return int(result[0]), int(result[1]), int(result[2])
+
+def done(user_id, token):
+    get_redis().zrem(f'{KEY_PREFIX}:inflight:{user_id}', token)
+
+def has_jobs():
+    return get_redis().zcard(f'{KEY_PREFIX}:users') > 0
+
+RESERVE_WORKERS_SCRIPT = """
+local workers, seq = KEYS[1], KEYS[2]
+local cap, ttl, limit = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', workers, '-inf', now)
+local slots = {}
+for i = redis.call('ZCARD', workers) + 1, math.min(cap, redis.call('ZCARD', workers) + limit) do
+    local slot = redis.call('INCR', seq)
+    redis.call('ZADD', workers, now + ttl, slot)
+    table.insert(slots, slot)
+end
+return slots
+"""
+
+# Renew a slot, or take it back if it expired while the cap has room again
+RENEW_WORKER_SCRIPT = """
+local workers = KEYS[1]
+local cap, ttl, slot = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3]
+local now = tonumber(redis.call('TIME')[1])
+redis.call('ZREMRANGEBYSCORE', workers, '-inf', now)
+if redis.call('ZSCORE', workers, slot) or redis.call('ZCARD', workers) < cap then
+    redis.call('ZADD', workers, now + ttl, slot)
+    return 1
+end
+return 0
+"""
+
+def reserve_workers(limit=None):
+    """
+    Reserve slots for new lease workers, up to DIN_LEASE_WORKERS live at once
+    and at most limit. Returns the slot ids; queue one work_din_queue per slot.
+    """
+    limit = settings.DIN_LEASE_WORKERS if limit is None else limit
+    slots = get_redis().eval(
+        RESERVE_WORKERS_SCRIPT, 2, f'{KEY_PREFIX}:workers', f'{KEY_PREFIX}:seq',
+        settings.DIN_LEASE_WORKERS, settings.DIN_LEASE_TTL, limit,
+    )
+    return [int(slot) for slot in slots]
+
+def renew_worker(slot):
+    """
+    Extend a worker's slot. Returns False if the slot expired and the cap is
+    full again, in which case the worker must stop.
+    """
+    return bool(get_redis().eval(
+        RENEW_WORKER_SCRIPT, 1, f'{KEY_PREFIX}:workers', settings.DIN_LEASE_WORKERS, settings.DIN_LEASE_TTL, slot,
+    ))
+
+def worker_stopped(slot):
+    """
+    Free a worker's slot.
+    """
+    get_redis().zrem(f'{KEY_PREFIX}:workers', slot)
@@ -0,0 +1,45 @@
+import logging
+import redis
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import DINRequest, EmailStatus
+from .api import invalidate_user_requests
+from .tasks import drop_din_requests
+from . import events
+
+logger = logging.getLogger('din_app')
+
+# Status and email changes saved through the ORM are announced once the
+# transaction commits, so a progress stream never reads a status that was
+# rolled back, and expire the user's cached API responses. Queryset .update()
+# calls bypass these and do both themselves.
+
+def announce(user_id, *din_request_ids):
+    events.publish(user_id, *din_request_ids)
+    invalidate_user_requests(user_id)
+
+@receiver(post_save, sender=DINRequest)
+def announce_din_request(sender, instance, **kwargs):
+    transaction.on_commit(lambda: announce(instance.user_id, instance.id))
+
+@receiver(post_save, sender=EmailStatus)
+def announce_email_status(sender, instance, **kwargs):
+    din_request = instance.din_request
+    # The request's updated_at is the API cursor, so an email change moves it too
+    DINRequest.objects.filter(id=din_request.id).update(updated_at=timezone.now())
+    transaction.on_commit(lambda: announce(din_request.user_id, din_request.id))
+
+@receiver(post_delete, sender=DINRequest)
+def drop_deleted_din_request(sender, instance, **kwargs):
+    # A deleted request, e.g. through its job's cascade, must leave the
+    # scheduler, or lease workers keep picking a request they cannot load
+    din_request_id = instance.pk  # Cleared on the instance once the delete finishes
+
+    def drop():
+        try:
+            drop_din_requests(din_request_id)
+        except redis.RedisError as e:
+            logger.warning(f"DIN request {din_request_id}: deleted, but its queued work could not be dropped: {str(e)}")
+    transaction.on_commit(drop)
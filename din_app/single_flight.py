@@ -0,0 +1,137 @@
+import asyncio
+import json
+import logging
+import uuid
+import redis
+from django.conf import settings
+from .redis_client import get_async_redis
+from . import cancellation, negative_cache
+
+logger = logging.getLogger('din_app')
+
+# Jobs fetching the same DIN at the same time share one MCA request:
+#   din:flight:lock:<din>     owner token of the batch fetching the DIN (SET NX)
+#   din:flight:result:<din>   the fetched row as JSON, kept DIN_SINGLE_FLIGHT_RESULT_TTL
+# A batch claims every DIN it needs in one pipeline, fetches the DINs it won
+# and polls the result keys of the rest, which other batches are fetching.
+# Only definitive answers are shared: records and "not found" rows. Other
+# failed rows (5xx, timeouts, retries exhausted) and exceptions release the
+# lock without a result, as does an owner that dies or whose lock expires, and
+# the waiting batch then claims the DIN and fetches it itself.
+# Redis errors fall back to fetching directly, so coalescing never stops work.
+KEY_PREFIX = 'din:flight'
+# Store the row and drop the lock in one step, and only while still the owner
+SHARE_SCRIPT = """
+local owner = ARGV[1]
+local ttl = tonumber(ARGV[2])
+for i = 1, #KEYS / 2 do
+    local lock, result, row = KEYS[2 * i - 1], KEYS[2 * i], ARGV[i + 2]
+    if row ~= '' then
+        redis.call('SET', result, row, 'EX', ttl)
+    end
+    if redis.call('GET', lock) == owner then
+        redis.call('DEL', lock)
+    end
+end
+return 0
+"""
+
+def is_shareable(row):
+    return row[1] == "success" or negative_cache.is_empty_row(row)
+
+def _lock_key(din):
+    return f'{KEY_PREFIX}:lock:{din}'
+
+def _result_key(din):
+    return f'{KEY_PREFIX}:result:{din}'
+
+async def claim(dins, owner):
+    """
+    Take the fetch of each DIN nobody else is fetching; return the DINs won.
+    """
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for din in dins:
+            pipe.set(_lock_key(din), owner, nx=True, ex=settings.DIN_SINGLE_FLIGHT_LOCK_TTL)
+        won = await pipe.execute()
+    return [din for din, ok in zip(dins, won) if ok]
+
+async def share(rows, owner, abandoned=()):
+    """
+    Publish fetched rows to waiting batches and release their locks, along
+    with the locks of abandoned DINs, which waiters will then fetch themselves.
+    """
+    dins = [row[0] for row in rows] + list(abandoned)
+    if not dins:
+        return
+    values = [json.dumps(row) for row in rows] + [''] * len(abandoned)
+    keys = [key for din in dins for key in (_lock_key(din), _result_key(din))]
+    await get_async_redis().eval(SHARE_SCRIPT, len(keys), *keys, owner, settings.DIN_SINGLE_FLIGHT_RESULT_TTL, *values)
+
+async def poll(dins):
+    """
+    Return ({din: row} for DINs whose result is ready, [DINs nobody is fetching]).
+    """
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        pipe.mget([_result_key(din) for din in dins])
+        pipe.mget([_lock_key(din) for din in dins])
+        results, locks = await pipe.execute()
+    ready = {din: json.loads(result) for din, result in zip(dins, results) if result is not None}
+    orphaned = [din for din, result, lock in zip(dins, results, locks) if result is None and lock is None]
+    return ready, orphaned
+
+async def fetch_coalesced(dins, fetch, din_request_id=None):
+    """
+    Return {din: row or exception} for dins, calling the coroutine function
+    fetch(din) only for DINs no other batch is already fetching. Exceptions and
+    failed rows other than "not found" are never shared: the lock is released
+    and a waiting batch fetches the DIN itself. Waiting stops with
+    RequestCancelled, as a value for every DIN still waited on, once
+    din_request_id is cancelled.
+    """
+    owner = uuid.uuid4().hex
+    results = {}
+    shared = 0
+
+    async def fetch_owned(owned):
+        rows = await asyncio.gather(*[fetch(din) for din in owned], return_exceptions=True)
+        fetched = [row for row in rows if not isinstance(row, BaseException) and is_shareable(row)]
+        failed = [din for din, row in zip(owned, rows) if isinstance(row, BaseException) or not is_shareable(row)]
+        try:
+            await share(fetched, owner, failed)
+        except redis.RedisError as e:
+            logger.warning(f"Single-flight unavailable, fetched DINs not shared: {str(e)}")
+        results.update(zip(owned, rows))
+
+    async def wait_for_others(pending):
+        nonlocal shared
+        while pending:
+            await asyncio.sleep(settings.DIN_SINGLE_FLIGHT_POLL_INTERVAL)
+            try:
+                if din_request_id is not None:
+                    await cancellation.check_async(din_request_id)
+                ready, orphaned = await poll(list(pending))
+                taken = await claim(orphaned, owner) if orphaned else []
+            except cancellation.RequestCancelled as e:
+                results.update((din, e) for din in pending)
+                return
+            except redis.RedisError as e:
+                logger.warning(f"Single-flight unavailable, fetching {len(pending)} awaited DINs directly: {str(e)}")
+                rows = await asyncio.gather(*[fetch(din) for din in pending], return_exceptions=True)
+                results.update(zip(pending, rows))
+                return
+            results.update(ready)
+            shared += len(ready)
+            pending = [din for din in pending if din not in ready and din not in taken]
+            if taken:
+                await fetch_owned(taken)
+
+    try:
+        owned = await claim(dins, owner)
+    except redis.RedisError as e:
+        logger.warning(f"Single-flight unavailable, fetching directly: {str(e)}")
+        owned = list(dins)
+    owned_set = set(owned)
+    await asyncio.gather(fetch_owned(owned), wait_for_others([din for din in dins if din not in owned_set]))
+    if shared:
+        logger.info(f"Single-flight: {shared} of {len(dins)} DINs served by another job's fetch")
+    return results
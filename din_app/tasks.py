@@ -1,26 +1,49 @@
 from django.conf import settings
 from django.core.mail import EmailMessage
 from django.utils import timezone
-from .models import DINRequest, EmailStatus
-from .utils import validate_din_range, validate_din_csv, xml_to_json, PARAMETERS, find_key_value
-import csv
+from .models import DINRequest, EmailStatus, DINResult, DINFrontier, DINJob
+from .utils import validate_din_range, read_din_csv, split_din_range, PARAMETERS
+from .results import ingest_din_results, write_results, merge_results, NOT_FOUND_STATUS, RETRYABLE_FAILURES
+from . import http_pool, concurrency, parse_pool, lookup_cache, negative_cache, planner, leases, scheduler, cancellation, progress, events, single_flight
+from .rate_limit import get_mca_rate_limiter
+from .circuit_breaker import get_mca_breaker, CircuitOpenError
+from .frontier import find_frontier, MAX_DIN
+from .dinset import DINSet
+from .api import invalidate_user_requests
+from django.db import transaction
 import os
 import time
 import random
 import aiohttp
 import asyncio
-import json
 from din_project.celery import app
-from celery import group, chord
 from celery.exceptions import Ignore
+from celery.signals import worker_process_init, worker_process_shutdown
 import glob
 from datetime import datetime, timedelta
+import logging
 
-async def get_din_data_async(din, session, max_retries=3, retry_delay=2):
+logger = logging.getLogger('din_app')
+
+@worker_process_init.connect
+def init_worker_pools(**kwargs):
+    http_pool.open_pool()
+
+@worker_process_shutdown.connect
+def close_worker_pools(**kwargs):
+    http_pool.close_pool()
+    parse_pool.shutdown()
+
+async def get_din_data_async(din, session=None, max_retries=3, retry_delay=2, din_request_id=None):
     """
     Fetch DIN data from MCA API asynchronously with retries.
+    Uses the worker's shared session unless one is passed in.
     Returns a list with DIN, status, and data (or empty fields if failed).
+    Raises CircuitOpenError instead of sending while the MCA circuit breaker is open,
+    and RequestCancelled once din_request_id, if given, has been cancelled.
     """
+    if session is None:
+        session = await http_pool.get_session()
     url = "http://www.mca.gov.in/FOServicesWeb/NCAPrefillService"
     headers = {
         "Accept": "*/*",
@@ -50,67 +73,305 @@ async def get_din_data_async(din, session, max_retries=3, retry_delay=2):
         </soap:Body>
     </soap:Envelope>"""
     
+    controller = concurrency.get_controller()
+    rate_limiter = get_mca_rate_limiter()
+    breaker = get_mca_breaker()
     for attempt in range(max_retries + 1):
+        status_code, text, error = None, None, None
+        healthy = False
+        await breaker.check_async()
+        await rate_limiter.acquire_async()
+        if din_request_id is not None:
+            # Checked after the rate limiter, which may have kept this request waiting
+            await cancellation.check_async(din_request_id)
+        started_at = await controller.acquire()
         try:
             async with session.post(url, headers=headers, data=xml_payload, timeout=120) as response:
-                if response.status == 200:
+                status_code = response.status
+                if status_code == 200:
                     text = await response.text()
-                    json_response = xml_to_json(text)
-                    response_data = json.loads(json_response)
-                    row_data = [find_key_value(response_data, param) for param in PARAMETERS]
-                    return [din, "success"] + row_data
-                else:
-                    if response.status >= 500 and attempt < max_retries:
-                        sleep_time = retry_delay * (2 ** attempt) + random.uniform(0, 1)
-                        await asyncio.sleep(sleep_time)
-                    else:
-                        status = f"failed: server error {response.status}" if response.status >= 500 else \
-                                 "failed: DIN not found (404)" if response.status == 404 else \
-                                 f"failed: status {response.status}"
-                        return [din, status] + [""] * len(PARAMETERS)
+            healthy = status_code < 500
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = e
+        finally:
+            controller.release(started_at, healthy)
+        await breaker.record_async(healthy)
+
+        if error is not None:
             if attempt < max_retries:
                 sleep_time = retry_delay * (2 ** attempt) + random.uniform(0, 1)
                 await asyncio.sleep(sleep_time)
-            else:
-                return [din, f"failed: request exception {str(e)}"] + [""] * len(PARAMETERS)
+                continue
+            return [din, f"failed: request exception {str(error)}"] + [""] * len(PARAMETERS)
+
+        if status_code == 200:
+            return [din, "success"] + await parse_pool.parse_response(text)
+        if status_code >= 500 and attempt < max_retries:
+            sleep_time = retry_delay * (2 ** attempt) + random.uniform(0, 1)
+            await asyncio.sleep(sleep_time)
+        else:
+            status = f"failed: server error {status_code}" if status_code >= 500 else \
+                     NOT_FOUND_STATUS if status_code == 404 else \
+                     f"failed: status {status_code}"
+            return [din, status] + [""] * len(PARAMETERS)
     return [din, "failed: max retries exceeded"] + [""] * len(PARAMETERS)
 
-@app.task(bind=True)
-def process_din_batch(self, din_batch, din_request_id):
-    din_request = DINRequest.objects.get(id=din_request_id)
-    
-    if din_request.is_cancelled:
-        self.request.callbacks = None
-        raise Ignore("Task cancelled")
-    
+def load_din_set(din_request):
+    """
+    Return (is_valid, error_message, din_set) for a request's input.
+    """
+    if din_request.din_set is not None:
+        return True, "", DINSet.from_json(din_request.din_set)
+    if din_request.input_csv:
+        with open(os.path.join(settings.MEDIA_ROOT, din_request.input_csv.name), 'rb') as file:
+            is_valid, error_msg, din_set, _ = read_din_csv(file)
+        return is_valid, error_msg, din_set
+    is_valid, error_msg = validate_din_range(din_request.start_range, din_request.end_range)
+    if not is_valid:
+        return False, error_msg, DINSet()
+    return True, "", DINSet.from_range(din_request.start_range, din_request.end_range)
+
+def fetch_din_rows(dins, din_request_id=None):
+    """
+    Fetch DINs on the worker's persistent loop and connection pool, one row per DIN.
+    A DIN another job is already fetching is not requested again: the row of
+    that job's fetch is used (see single_flight).
+    Exceptions become "failed: ..." rows. Raises CircuitOpenError if the MCA
+    breaker opened before every DIN was fetched, and RequestCancelled if
+    din_request_id was cancelled meanwhile.
+    """
     async def fetch_all_dins():
-        async with aiohttp.ClientSession() as session:
-            tasks = [get_din_data_async(din, session) for din in din_batch]
-            return await asyncio.gather(*tasks, return_exceptions=True)
+        session = await http_pool.get_session()
+        fetch = lambda din: get_din_data_async(din, session, din_request_id=din_request_id)
+        rows = await single_flight.fetch_coalesced(dins, fetch, din_request_id)
+        return [rows[din] for din in dins]
     
-    # Run async DIN fetches
-    loop = asyncio.get_event_loop()
+    loop = http_pool.get_event_loop()
     data = loop.run_until_complete(fetch_all_dins())
     
-    # Update progress
-    din_request.refresh_from_db()
-    if din_request.is_cancelled:
-        self.request.callbacks = None
-        raise Ignore("Task cancelled")
+    cancelled = [row for row in data if isinstance(row, cancellation.RequestCancelled)]
+    if cancelled:
+        raise cancelled[0]
+    open_errors = [row for row in data if isinstance(row, CircuitOpenError)]
+    if open_errors:
+        raise max(open_errors, key=lambda e: e.retry_after)
+    return [
+        [din, f"failed: {str(row)}"] + [""] * len(PARAMETERS) if isinstance(row, Exception) else row
+        for din, row in zip(dins, data)
+    ]
+
+def process_din_chunk(din_request, din_chunk):
+    """
+    Fetch a chunk of (position, din) pairs and store the rows as DINResult records.
+    DINs already stored for the request are skipped, apart from retryable
+    failures, so a reclaimed or resumed chunk only fetches what is missing, and
+    fresh lookup-cache hits are served without a request to MCA.
+    Raises CircuitOpenError, without fetching, while MCA is known to be down,
+    and RequestCancelled once the request is cancelled.
+    """
+    din_request_id = din_request.id
+    done_dins = set(
+        DINResult.objects.filter(din_request_id=din_request_id, din__in=[din for _, din in din_chunk])
+        .exclude(RETRYABLE_FAILURES)
+        .values_list('din', flat=True)
+    )
+    din_chunk = [(position, din) for position, din in din_chunk if din not in done_dins]
+    if not din_chunk:
+        return
     
-    batch_size = len(din_batch)
-    total_dins = (din_request.end_range - din_request.start_range + 1) if din_request.start_range else len(din_batch)
-    progress_increment = (batch_size / total_dins) * 100
-    din_request.progress = min(din_request.progress + progress_increment, 100)
-    din_request.save(update_fields=['progress'])
+    cached = lookup_cache.get_cached_rows([din for _, din in din_chunk], lookup_cache.effective_max_age(din_request))
+    if cached:
+        ingest_din_results(din_request_id, [
+            (position,) + cached[din] for position, din in din_chunk if din in cached
+        ])
+        # Counted as soon as they are stored, as the fetch below may give the chunk back
+        progress.record(din_request_id, cached=len(cached), user_id=din_request.user_id)
+        din_chunk = [(position, din) for position, din in din_chunk if din not in cached]
     
-    time.sleep(0.5)  # Respect API rate limits between batches
+    rows = []
+    if din_chunk:
+        # Give the chunk back while MCA is known to be down instead of burning retries on it.
+        # Only a peek: the half-open probe is left to the first fetch below.
+        get_mca_breaker().check_ready()
+        rows = fetch_din_rows([din for _, din in din_chunk], din_request_id)
+        
+        fetched_at = timezone.now()
+        ingest_din_results(din_request_id, [
+            (position, row, fetched_at) for (position, _), row in zip(din_chunk, rows)
+        ])
+        # Live counters in Redis; flush_din_progress copies them to the database
+        fetched_ok = sum(1 for row in rows if row[1] == "success")
+        progress.record(din_request_id, success=fetched_ok, failed=len(rows) - fetched_ok, user_id=din_request.user_id)
+        lookup_cache.store_rows(rows, fetched_at)
+        negative_cache.record_rows(rows)
     
-    return data
+    logger.info(
+        f"DIN request {din_request_id}: chunk done, {len(cached)} from cache, {len(rows)} fetched, "
+        f"MCA concurrency {concurrency.get_controller().snapshot()}"
+    )
+    concurrency.publish_snapshot()
+
+def complete_din_request(din_request_id):
+    scheduler.remove_job(din_request_id)
+    finalize_din_task.delay(din_request_id)
+
+def drop_din_requests(*din_request_ids):
+    """
+    Take requests off the scheduler and drop their queued and leased work, so
+    no worker picks them up again. A worker still holding one of their leases
+    gets LeaseLost on its next chunk.
+    """
+    for din_request_id in din_request_ids:
+        scheduler.remove_job(din_request_id)
+        leases.clear_job(din_request_id)
+
+def cancel_din_requests(*din_request_ids):
+    """
+    Flag requests as cancelled in Redis and drop their remaining work. Workers
+    fetching for them stop before their next MCA request.
+    """
+    cancellation.cancel(*din_request_ids)
+    drop_din_requests(*din_request_ids)
+
+def start_lease_workers():
+    """
+    Queue lease workers up to DIN_LEASE_WORKERS live at once across all requests.
+    """
+    for slot in scheduler.reserve_workers():
+        work_din_queue.delay(slot)
 
 @app.task(bind=True)
-def finalize_din_task(self, batch_results, din_request_id):
+def work_din_queue(self, slot=None):
+    """
+    Serve chunks of whichever request the fair-share scheduler picks, until no
+    request has work this worker can take. The worker keeps its lease while the
+    scheduler keeps picking the same request, and gives it back when it moves
+    on. The worker that completes a request's last position queues
+    finalize_din_task. slot is the worker's place under the DIN_LEASE_WORKERS
+    cap, renewed before each chunk (see scheduler.reserve_workers). A chunk
+    that fails unexpectedly goes back on its request's queue and the worker
+    retries after DIN_LEASE_SWEEP_INTERVAL; leases whose holder died are
+    picked up by the workers sweep_din_leases starts.
+    """
+    if slot is None:
+        # Queued without a reservation, e.g. before an upgrade
+        slots = scheduler.reserve_workers(limit=1)
+        if not slots:
+            return
+        slot = slots[0]
+    if not scheduler.renew_worker(slot):
+        return
+    started = time.monotonic()
+    jobs = {}  # din_request_id -> (din_request, din_set)
+    held = None  # (din_request_id, lease_id)
+    excluded = set()
+    handed_over = False
+    try:
+        while True:
+            if time.monotonic() - started > settings.DIN_LEASE_WORKER_RUNTIME:
+                # Hand over to a fresh task rather than outlive the broker visibility timeout
+                work_din_queue.delay(slot)
+                handed_over = True
+                break
+            if not scheduler.renew_worker(slot):
+                logger.warning(f"Lease worker slot {slot} expired and the worker cap is full, stopping")
+                break
+            picked = scheduler.pick(excluded)
+            if picked is None:
+                break
+            user_id, din_request_id, token = picked
+            try:
+                if held and held[0] != din_request_id:
+                    if leases.release(*held, chunk_done=True):
+                        complete_din_request(held[0])
+                    held = None
+                
+                if din_request_id not in jobs:
+                    try:
+                        din_request = DINRequest.objects.get(id=din_request_id)
+                    except DINRequest.DoesNotExist:
+                        # Deleted while queued; its post_delete normally drops it first
+                        logger.warning(f"DIN request {din_request_id}: deleted while queued, dropping its work")
+                        drop_din_requests(din_request_id)
+                        held = None
+                        continue
+                    jobs[din_request_id] = (din_request, load_din_set(din_request)[2])
+                din_request, din_set = jobs[din_request_id]
+                if cancellation.is_cancelled(din_request_id):
+                    drop_din_requests(din_request_id)
+                    held = None
+                    continue
+                
+                if held is None:
+                    lease = leases.acquire(din_request_id)
+                    if lease[0] is None:
+                        # Everything left is leased by other workers and too small to steal
+                        excluded.add(din_request_id)
+                        continue
+                    held = (din_request_id, lease[0])
+                
+                try:
+                    start, end, completed = leases.next_chunk(*held)
+                except leases.LeaseLost:
+                    logger.warning(f"DIN request {din_request_id}: lease {held[1]} expired and was handed to another worker")
+                    held = None
+                    continue
+                if start == end:
+                    held = None
+                    if completed:
+                        complete_din_request(din_request_id)
+                    continue
+                
+                try:
+                    process_din_chunk(din_request, [(position, din_set.din_at(position)) for position in range(start, end)])
+                except CircuitOpenError as e:
+                    leases.release(*held)
+                    held = None
+                    logger.warning(f"DIN request {din_request_id}: MCA circuit open, pausing lease worker for {e.retry_after:.0f}s")
+                    handed_over = True  # The retry keeps the slot
+                    raise self.retry(countdown=e.retry_after + random.uniform(0, 5), max_retries=None)
+                except cancellation.RequestCancelled:
+                    drop_din_requests(din_request_id)
+                    held = None
+                    logger.info(f"DIN request {din_request_id}: cancelled, stopped mid-chunk")
+                    continue
+                except Exception as e:
+                    leases.release(*held)
+                    held = None
+                    logger.exception(f"DIN request {din_request_id}: chunk {start}-{end} failed, queued again")
+                    handed_over = True  # The retry keeps the slot
+                    raise self.retry(exc=e, countdown=settings.DIN_LEASE_SWEEP_INTERVAL, max_retries=None)
+                excluded.clear()
+            finally:
+                scheduler.done(user_id, token)
+        
+        if held and leases.release(*held, chunk_done=True):
+            complete_din_request(held[0])
+        held = None
+    finally:
+        if held:
+            leases.release(*held)
+        if not handed_over:
+            scheduler.worker_stopped(slot)
+
+@app.task
+def sweep_din_leases():
+    """
+    Start lease workers, up to the cap, while requests are queued. Slots of
+    killed workers expire after DIN_LEASE_TTL and leases whose holder died are
+    reclaimed by the next acquire, so this is what resumes their work.
+    """
+    if scheduler.has_jobs():
+        start_lease_workers()
+
+def apply_final_progress(din_request):
+    counters = progress.get(din_request.id)
+    if counters:
+        progress.apply(din_request, counters)
+    din_request.progress = 100
+
+@app.task(bind=True)
+def finalize_din_task(self, din_request_id):
     try:
         din_request = DINRequest.objects.get(id=din_request_id)
         
@@ -121,33 +382,44 @@ def finalize_din_task(self, batch_results, din_request_id):
             email_status = din_request.email_status
             email_status.status = 'cancelled'
             email_status.save()
+            finalize_din_job_if_done(din_request.job_id)
             raise Ignore("Task cancelled")
         
+        if din_request.job_id:
+            # A shard is written without a header for merge_results and is delivered with its job
+            parts_dir = os.path.join(settings.MEDIA_ROOT, 'outputs', 'parts')
+            os.makedirs(parts_dir, exist_ok=True)
+            write_results(din_request, parts_dir, header=False)
+            apply_final_progress(din_request)
+            din_request.status = 'completed'
+            din_request.completed_at = timezone.now()
+            din_request.save()
+            leases.clear_job(din_request_id)
+            finalize_din_job_if_done(din_request.job_id)
+            return "Shard completed"
+        
         output_dir = os.path.join(settings.MEDIA_ROOT, 'outputs')
         os.makedirs(output_dir, exist_ok=True)
-        output_csv_path = os.path.join(output_dir, f'din_{din_request.id}.csv')
 
-        # Write all batch results to CSV
-        with open(output_csv_path, mode='a', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            for batch_result in batch_results:
-                for row in batch_result:
-                    writer.writerow(row)
+        # Export the stored results in input order, in the requested format
+        output_name = write_results(din_request, output_dir)
+        output_path = os.path.join(output_dir, output_name)
 
-        din_request.output_csv = os.path.join('outputs', f'din_{din_request.id}.csv')
+        din_request.output_csv = os.path.join('outputs', output_name)
+        apply_final_progress(din_request)
         din_request.status = 'completed'
         din_request.completed_at = timezone.now()
-        din_request.progress = 100
         din_request.save()
+        leases.clear_job(din_request_id)
 
         try:
             email = EmailMessage(
                 subject=f'DIN Processing Complete - Request {din_request.id}',
-                body=f'Your DIN request has been processed. See attached CSV.',
+                body=f'Your DIN request has been processed. See attached results file.',
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 to=[din_request.user.email],
             )
-            email.attach_file(output_csv_path)
+            email.attach_file(output_path)
             email.send()
             email_status = din_request.email_status
             email_status.status = 'sent'
@@ -171,39 +443,128 @@ def finalize_din_task(self, batch_results, din_request_id):
         email_status.status = 'failed'
         email_status.error_message = str(e)
         email_status.save()
+        finalize_din_job_if_done(din_request.job_id)
         raise e
 
+# Shard statuses after which a shard's share of its job is settled
+TERMINAL_SHARD_STATUSES = ('completed', 'skipped', 'failed', 'cancelled')
+
+def finalize_din_job_if_done(job_id):
+    """
+    Queue finalize_din_job once every shard of a job is completed, skipped,
+    failed or cancelled. The status change from 'processing' to 'merging' is a
+    conditional update, so only one caller queues it, and a job cancelled as a
+    whole is never merged.
+    """
+    if job_id is None:
+        return
+    if DINRequest.objects.filter(job_id=job_id).exclude(status__in=TERMINAL_SHARD_STATUSES).exists():
+        return
+    if DINJob.objects.filter(id=job_id, status='processing').update(status='merging'):
+        finalize_din_job.delay(job_id)
+
+def describe_shard(shard):
+    if shard.start_range is not None:
+        return f"sub-request {shard.id} (DINs {shard.start_range} - {shard.end_range}): {shard.status}"
+    return f"sub-request {shard.id} ({DINSet.json_len(shard.din_set)} DINs): {shard.status}"
+
 @app.task(bind=True)
-def process_din_task(self, din_request_id):
+def finalize_din_job(self, job_id):
+    """
+    Merge a job's completed shard outputs, in shard order, into one file and
+    send one email. Failed and cancelled shards are left out of the file, listed
+    in the email and the job ends 'partial'; their part files are kept, so
+    resuming a missing shard merges the job again.
+    """
+    job = DINJob.objects.select_related('user').get(id=job_id)
+    try:
+        parts_dir = os.path.join(settings.MEDIA_ROOT, 'outputs', 'parts')
+        shards = list(job.shards.order_by('id'))
+        completed = [shard for shard in shards if shard.status == 'completed']
+        gaps = [describe_shard(shard) for shard in shards if shard.status in ('failed', 'cancelled')]
+        part_paths = [os.path.join(parts_dir, f'din_{shard.id}.{shard.output_format}') for shard in completed]
+        output_name = f'din_job_{job.id}.{job.output_format}'
+        output_path = os.path.join(settings.MEDIA_ROOT, 'outputs', output_name)
+        merge_results(job.output_format, part_paths, output_path)
+        
+        job.output_file = os.path.join('outputs', output_name)
+        job.status = 'partial' if gaps else 'completed'
+        job.completed_at = timezone.now()
+        job.email_error = None
+        job.save()
+    except Exception as e:
+        job.status = 'failed'
+        job.email_status = 'failed'
+        job.email_error = str(e)
+        job.save()
+        raise e
+    
+    if gaps:
+        logger.warning(f"DIN job {job.id}: merged without {len(gaps)} sub-requests: {'; '.join(gaps)}")
+    else:
+        for part_path in part_paths:
+            try:
+                os.remove(part_path)
+            except OSError as e:
+                logger.warning(f"DIN job {job.id}: could not remove {part_path}: {str(e)}")
+    
+    try:
+        if gaps:
+            body = (
+                f'Your DIN job ({job.description}) has been processed, but {len(gaps)} of its '
+                f'{len(shards)} sub-requests are missing from the attached results file:\n\n'
+                + '\n'.join(gaps)
+                + '\n\nResume them to have the job merged and sent again.'
+            )
+        else:
+            body = f'Your DIN job ({job.description}) has been processed. See attached results file.'
+        email = EmailMessage(
+            subject=f'DIN Processing {"Incomplete" if gaps else "Complete"} - Job {job.id}',
+            body=body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[job.user.email],
+        )
+        email.attach_file(output_path)
+        email.send()
+        job.email_status = 'sent'
+        job.email_sent_at = timezone.now()
+    except Exception as e:
+        job.email_status = 'failed'
+        job.email_error = str(e)
+    job.save(update_fields=['email_status', 'email_sent_at', 'email_error'])
+    # The shards' results went out with the job's email
+    EmailStatus.objects.filter(din_request__job=job, status='pending').update(
+        status=job.email_status, sent_at=job.email_sent_at, error_message=job.email_error
+    )
+    job.shards.update(updated_at=timezone.now())
+    invalidate_user_requests(job.user_id)
+    events.publish(job.user_id, *job.shards.values_list('id', flat=True))
+    return "Job completed"
+
+def dispatch_din_request(din_request_id):
+    """
+    Queue a request's pending DINs as leases and register it with the fair-share
+    scheduler; the caller then starts lease workers with start_lease_workers.
+    DINs that already have a stored result are left out, so resuming a request
+    only dispatches the DINs that are still missing or failed with a retryable
+    error (see results.RETRYABLE_FAILURES). Returns the request's new
+    status. Any error marks the request failed and is re-raised.
+    """
     try:
         din_request = DINRequest.objects.get(id=din_request_id)
         din_request.status = 'processing'
         din_request.save()
 
         if din_request.is_cancelled:
-            self.request.callbacks = None
             din_request.status = 'cancelled'
             din_request.save()
             email_status = din_request.email_status
             email_status.status = 'cancelled'
             email_status.save()
-            raise Ignore("Task cancelled")
+            finalize_din_job_if_done(din_request.job_id)
+            return din_request.status
 
-        # Get DIN list from din_request
-        if din_request.din_list:
-            din_list = json.loads(din_request.din_list)
-            is_valid, error_msg = True, ""
-        elif din_request.input_csv:
-            file_path = os.path.join(settings.MEDIA_ROOT, din_request.input_csv.name)
-            is_valid, error_msg, din_list = validate_din_csv(file_path)
-        else:
-            start_range = din_request.start_range
-            end_range = din_request.end_range
-            is_valid, error_msg = validate_din_range(start_range, end_range)
-            if is_valid:
-                din_list = [f"{din:08d}" for din in range(start_range, end_range + 1)]
-            else:
-                din_list = []
+        is_valid, error_msg, din_set = load_din_set(din_request)
 
         if not is_valid:
             din_request.status = 'failed'
@@ -212,31 +573,48 @@ def process_din_task(self, din_request_id):
             email_status.status = 'failed'
             email_status.error_message = error_msg
             email_status.save()
-            return
+            finalize_din_job_if_done(din_request.job_id)
+            return din_request.status
 
-        batch_size = 10
-        batches = [din_list[i:i + batch_size] for i in range(0, len(din_list), batch_size)]
+        total_dins = len(din_set)
+        stored = dict(
+            DINResult.objects.filter(din_request_id=din_request_id).exclude(RETRYABLE_FAILURES)
+            .values_list('din', 'status').iterator()
+        )
+        pending = [[position, din] for position, din in enumerate(din_set.dins()) if din not in stored]
+        statuses = list(stored.values())
+        progress.start(
+            din_request_id, total_dins, done=len(statuses),
+            success=statuses.count('success'),
+            cached=statuses.count(negative_cache.CACHED_EMPTY_STATUS),
+            failed=sum(1 for status in statuses if status.startswith('failed')),
+        )
 
-        output_dir = os.path.join(settings.MEDIA_ROOT, 'outputs')
-        os.makedirs(output_dir, exist_ok=True)
-        output_csv_path = os.path.join(output_dir, f'din_{din_request.id}.csv')
-
-        # Initialize CSV with headers
-        with open(output_csv_path, mode='w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerow(["DIN", "Status"] + PARAMETERS)
-
-        # Create group of batch tasks and link to finalize task
-        task_signatures = [
-            process_din_batch.s(batch, din_request_id).set(task_id=f"din_batch_{din_request_id}_{i}")
-            for i, batch in enumerate(batches)
-        ]
-        
-        # Use chord to run batches in parallel and trigger finalize_din_task
-        chord(group(task_signatures))(finalize_din_task.s(din_request_id=din_request_id).set(task_id=f"finalize_din_task_{din_request_id}"))
+        # DINs recently seen without a record get a 'cached-empty' row instead of a request
+        known_empty = negative_cache.find_known_empty(
+            [din for _, din in pending], negative_cache.effective_max_age(din_request)
+        )
+        if known_empty:
+            skipped_at = timezone.now()
+            ingest_din_results(din_request_id, [
+                (position, [din, negative_cache.CACHED_EMPTY_STATUS] + [""] * len(PARAMETERS), skipped_at)
+                for position, din in pending if din in known_empty
+            ])
+            pending = [[position, din] for position, din in pending if din not in known_empty]
+            progress.record(din_request_id, cached=len(known_empty), user_id=din_request.user_id)
+
+        if not pending:
+            leases.clear_job(din_request_id)
+            scheduler.remove_job(din_request_id)
+            finalize_din_task.delay(din_request_id)
+            return din_request.status
+
+        # Queue the pending positions as lease intervals and hand the request to the
+        # fair-share scheduler, whose capped pool of lease workers serves every request
+        leases.create_job(din_request_id, [position for position, _ in pending])
+        scheduler.add_job(din_request_id, din_request.user_id, din_request.priority)
+        return din_request.status
 
-    except Ignore:
-        raise
     except Exception as e:
         din_request = DINRequest.objects.get(id=din_request_id)
         din_request.status = 'failed'
@@ -245,8 +623,159 @@ def process_din_task(self, din_request_id):
         email_status.status = 'failed'
         email_status.error_message = str(e)
         email_status.save()
+        finalize_din_job_if_done(din_request.job_id)
         raise e
 
+def dispatch_din_requests(din_request_ids):
+    """
+    Dispatch requests in order, then start lease workers once for all of them.
+    A request that fails to dispatch is marked failed and logged; the rest still go.
+    """
+    for din_request_id in din_request_ids:
+        try:
+            dispatch_din_request(din_request_id)
+        except Exception:
+            logger.exception(f"DIN request {din_request_id}: dispatch failed")
+    start_lease_workers()
+
+@app.task(bind=True)
+def process_din_task(self, din_request_id):
+    """
+    Dispatch one request from a worker, e.g. when it is resumed.
+    """
+    status = dispatch_din_request(din_request_id)
+    if status == 'cancelled':
+        self.request.callbacks = None
+        raise Ignore("Task cancelled")
+    start_lease_workers()
+
+@app.task(bind=True)
+def plan_din_requests(self, din_request_ids, policy):
+    """
+    Sample each range sub-request, record its hit density and queue the
+    sub-requests densest first. Sub-requests that sampled empty are queued last
+    under the 'defer' policy and marked 'skipped' under 'drop'.
+    Densities are saved as they are measured, so a retry after an MCA outage
+    only samples the sub-requests that are still unmeasured.
+    """
+    din_requests = list(DINRequest.objects.filter(id__in=din_request_ids, is_cancelled=False))
+    unsampled = [r for r in din_requests if r.sampled_density is None]
+    
+    step = settings.DIN_PLANNER_REQUESTS_PER_FETCH
+    for i in range(0, len(unsampled), step):
+        chunk = unsampled[i:i + step]
+        samples = {}
+        to_fetch = []
+        for din_request in chunk:
+            rows, dins = planner.split_sample(din_request, planner.sample_dins(din_request, settings.DIN_PLANNER_SAMPLE_SIZE))
+            samples[din_request.id] = (rows, dins)
+            to_fetch.extend(dins)
+        
+        try:
+            fetched = dict(zip(to_fetch, fetch_din_rows(to_fetch))) if to_fetch else {}
+        except CircuitOpenError as e:
+            logger.warning(f"DIN planner: MCA circuit open, retrying sampling in {e.retry_after:.0f}s")
+            raise self.retry(countdown=e.retry_after + random.uniform(0, 5), max_retries=None)
+        if fetched:
+            lookup_cache.store_rows(list(fetched.values()), timezone.now())
+            negative_cache.record_rows(list(fetched.values()))
+        
+        for din_request in chunk:
+            rows, dins = samples[din_request.id]
+            din_request.sampled_density = planner.estimate_density(rows + [fetched[din] for din in dins])
+            din_request.save(update_fields=['sampled_density'])
+    
+    to_dispatch, to_skip = planner.order_for_dispatch(din_requests, policy)
+    for din_request in to_skip:
+        din_request.status = 'skipped'
+        din_request.save(update_fields=['status'])
+        email_status = din_request.email_status
+        email_status.status = 'cancelled'
+        email_status.error_message = 'Skipped: no records found in the sampled DINs.'
+        email_status.save()
+    # Sub-requests are dispatched in density order, so the scheduler serves them in that order too
+    dispatch_din_requests([din_request.id for din_request in to_dispatch])
+    # A job whose every shard was skipped has nothing left to wait for
+    for job_id in {r.job_id for r in to_skip if r.job_id}:
+        finalize_din_job_if_done(job_id)
+    
+    logger.info(
+        f"DIN planner: {len(to_dispatch)} sub-requests queued "
+        f"({sum(1 for r in to_dispatch if r.sampled_density == 0)} sampled empty), {len(to_skip)} skipped"
+    )
+
+@app.task(bind=True)
+def discover_din_frontier(self, frontier_id):
+    """
+    Locate the allocation frontier above a user's last known frontier and queue
+    range sub-requests for the DINs allocated since.
+    Probes bypass the caches, since a DIN that was empty yesterday may be
+    allocated today, but their rows are written to both caches so the scan that
+    follows does not fetch them again.
+    """
+    din_frontier = DINFrontier.objects.select_related('user').get(id=frontier_id)
+    known = din_frontier.frontier
+    if known is None:
+        logger.warning(f"DIN frontier {frontier_id}: no starting DIN, nothing to discover")
+        return
+    width = settings.DIN_FRONTIER_PROBE_WIDTH
+    probed = {}
+
+    def probe_window(start):
+        if start not in probed:
+            rows = fetch_din_rows([f"{din:08d}" for din in range(start, min(start + width, MAX_DIN + 1))])
+            lookup_cache.store_rows(rows, timezone.now())
+            negative_cache.record_rows(rows)
+            found = [int(row[0]) for row in rows if planner.has_record(row)]
+            probed[start] = max(found) if found else None
+        return probed[start]
+
+    try:
+        new_frontier = find_frontier(known, probe_window, width, settings.DIN_FRONTIER_INITIAL_STEP)
+    except CircuitOpenError as e:
+        logger.warning(f"DIN frontier {frontier_id}: MCA circuit open, retrying discovery in {e.retry_after:.0f}s")
+        raise self.retry(countdown=e.retry_after + random.uniform(0, 5), max_retries=None)
+
+    sub_requests = []
+    with transaction.atomic():
+        job = None
+        if new_frontier > known:
+            job = DINJob.objects.create(
+                user=din_frontier.user,
+                description=f"Frontier {known + 1} - {new_frontier}",
+                output_format=din_frontier.output_format,
+                total_dins=new_frontier - known,
+            )
+        for chunk_start, chunk_end in split_din_range(known + 1, new_frontier):
+            din_request = DINRequest.objects.create(
+                user=din_frontier.user,
+                status='pending',
+                start_range=chunk_start,
+                end_range=chunk_end,
+                output_format=din_frontier.output_format,
+                job=job,
+            )
+            EmailStatus.objects.create(din_request=din_request, status='pending')
+            sub_requests.append(din_request)
+        din_frontier.frontier = new_frontier
+        din_frontier.last_run_at = timezone.now()
+        din_frontier.save(update_fields=['frontier', 'last_run_at'])
+
+    dispatch_din_requests([din_request.id for din_request in sub_requests])
+
+    logger.info(
+        f"DIN frontier {frontier_id}: frontier {known} -> {new_frontier} after {len(probed)} probes, "
+        f"{len(sub_requests)} sub-requests queued"
+    )
+
+@app.task
+def run_scheduled_frontiers():
+    """
+    Queue frontier discovery for every user with a daily frontier schedule.
+    """
+    for frontier_id in DINFrontier.objects.filter(is_scheduled=True, frontier__isnull=False).values_list('id', flat=True):
+        discover_din_frontier.delay(frontier_id)
+
 @app.task
 def cleanup_old_logs():
     """
@@ -265,4 +794,36 @@ def cleanup_old_logs():
             try:
                 os.remove(log_file)
             except OSError:
-                pass
\ No newline at end of file
+                pass
+
+@app.task
+def purge_din_cache():
+    """
+    Evict lookup cache entries older than DIN_CACHE_TTL.
+    """
+    deleted = lookup_cache.purge_expired()
+    logger.info(f"Purged {deleted} expired DIN cache entries")
+
+@app.task
+def flush_din_progress():
+    """
+    Copy the live progress counters of running requests that changed since the
+    last run to the database, in one bulk update. Finished requests are left
+    alone: finalize_din_task has already written their final progress.
+    """
+    live = progress.get_many(progress.take_dirty())
+    if not live:
+        return
+    running = dict(
+        DINRequest.objects.filter(id__in=live, status__in=['pending', 'processing']).values_list('id', 'user_id')
+    )
+    if not running:
+        return
+    now = timezone.now()
+    changed = []
+    for din_request_id in running:
+        din_request = progress.apply(DINRequest(id=din_request_id), live[din_request_id])
+        din_request.updated_at = now
+        changed.append(din_request)
+    DINRequest.objects.bulk_update(changed, progress.FLUSHED_FIELDS + ['updated_at'], batch_size=500)
+    invalidate_user_requests(*set(running.values()))
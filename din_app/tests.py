@@ -1,3 +1,1284 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from .rate_limit import TokenBucket
+from .concurrency import AIMDController
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from . import tasks, http_pool, concurrency, parse_pool, lookup_cache, negative_cache, planner, leases, scheduler, cancellation, progress, events, views, api, single_flight, bulk_api
+from .frontier import find_frontier
+from .dinset import DINSet, DINBitmap
+from .tasks import get_din_data_async, flush_din_progress, finalize_din_job, finalize_din_job_if_done
+from .redis_client import get_redis
+from .models import DINRequest, DINResult, DINJob, EmailStatus
+from .results import ingest_din_results, write_results_csv, write_results, merge_results
+from .utils import PARAMETERS, extract_din_fields, find_key_value, xml_to_json, concat_files, read_din_csv
 
-# Create your tests here.
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
+
+def redis_available():
+    try:
+        return get_redis().ping()
+    except redis.RedisError:
+        return False
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        self.key = f"din:test:ratelimit:{uuid.uuid4().hex}"
+        self.addCleanup(get_redis().delete, self.key)
+
+    def test_burst_is_served_immediately(self):
+        bucket = TokenBucket(self.key, rate=1, burst=5)
+        waits = [bucket.reserve() for _ in range(5)]
+        self.assertEqual(waits, [0.0] * 5)
+        self.assertGreater(bucket.reserve(), 0)
+
+    def test_concurrent_thread_acquirers_share_global_rate(self):
+        rate, burst, workers, per_worker = 50, 10, 20, 6
+        bucket = TokenBucket(self.key, rate=rate, burst=burst)
+        start = time.monotonic()
+        threads = [
+            threading.Thread(target=lambda: [bucket.acquire() for _ in range(per_worker)])
+            for _ in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        minimum = (workers * per_worker - burst) / rate
+        self.assertGreaterEqual(elapsed, minimum * 0.95)
+        self.assertLess(elapsed, minimum + 2)
+
+    def test_concurrent_async_acquirers_are_spaced_at_rate(self):
+        rate, burst, acquirers = 100, 5, 105
+        bucket = TokenBucket(self.key, rate=rate, burst=burst)
+
+        async def acquire_all():
+            start = time.monotonic()
+            granted = []
+
+            async def acquire():
+                await bucket.acquire_async()
+                granted.append(time.monotonic() - start)
+
+            await asyncio.gather(*[acquire() for _ in range(acquirers)])
+            return sorted(granted)
+
+        granted = asyncio.run(acquire_all())
+        # No window of one second may admit more than rate + burst requests
+        for i, t in enumerate(granted):
+            in_window = sum(1 for other in granted[i:] if other - t < 1.0)
+            self.assertLessEqual(in_window, rate + burst)
+        self.assertGreaterEqual(granted[-1], (acquirers - burst) / rate * 0.95)
+
+class AIMDControllerTests(SimpleTestCase):
+    def make_controller(self, initial_window=4):
+        return AIMDController(initial_window, min_window=2, max_window=6, decrease_factor=0.5, latency_target=5)
+
+    def round_trip(self, controller, healthy=True):
+        async def run():
+            started = [await controller.acquire() for _ in range(controller.limit)]
+            for started_at in started:
+                controller.release(started_at, healthy)
+        asyncio.run(run())
+
+    def test_window_grows_by_about_one_per_round_trip_up_to_the_ceiling(self):
+        controller = self.make_controller()
+        self.round_trip(controller)
+        self.assertEqual(controller.limit, 4)
+        self.assertAlmostEqual(controller.window, 4.92, places=2)
+        for _ in range(5):
+            self.round_trip(controller)
+        self.assertEqual(controller.window, 6)
+
+    def test_window_is_cut_once_per_round_trip_down_to_the_floor(self):
+        controller = self.make_controller()
+        self.round_trip(controller, healthy=False)
+        # Every request of the round trip failed, but they saw one congestion event
+        self.assertEqual(controller.window, 2)
+        self.round_trip(controller, healthy=False)
+        self.assertEqual(controller.window, 2)
+
+    def test_slow_responses_do_not_grow_the_window(self):
+        controller = self.make_controller()
+        controller.release(asyncio.run(controller.acquire()) - 10, healthy=True)
+        self.assertEqual(controller.window, 4)
+
+    def test_release_wakes_waiters(self):
+        controller = self.make_controller(initial_window=2)
+
+        async def run():
+            held = [await controller.acquire() for _ in range(2)]
+            waiter = asyncio.ensure_future(controller.acquire())
+            await asyncio.sleep(0)
+            blocked = not waiter.done()
+            controller.release(held[0], healthy=True)
+            await asyncio.wait_for(waiter, 1)
+            return blocked, controller.in_flight
+
+        self.assertEqual(asyncio.run(run()), (True, 2))
+
+    def test_window_is_published_for_other_processes(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:aimd:{uuid.uuid4().hex}"
+        with mock.patch.object(concurrency, 'KEY_PREFIX', prefix), \
+                mock.patch.object(concurrency, '_controller', self.make_controller()):
+            concurrency.publish_snapshot()
+            stats = concurrency.window_stats()
+        get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix])
+        self.assertEqual(list(stats.values()), [{'window': 4.0, 'limit': 4, 'in_flight': 0}])
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        self.breaker = CircuitBreaker(f"test-{uuid.uuid4().hex}", failure_threshold=3, reset_timeout=0.3)
+        self.addCleanup(get_redis().delete, self.breaker.key)
+
+    def test_opens_after_threshold_and_recloses_after_probe(self):
+        for _ in range(3):
+            self.breaker.check()
+            self.breaker.record(success=False)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+        time.sleep(0.35)
+        self.breaker.check()  # The probe is let through
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()  # Everyone else waits for the probe
+        self.breaker.record(success=True)
+        self.breaker.check()
+
+    def test_failed_probe_reopens(self):
+        for _ in range(3):
+            self.breaker.record(success=False)
+        time.sleep(0.35)
+        self.breaker.check()
+        self.breaker.record(success=False)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+
+    def test_pre_check_leaves_probe_to_first_request(self):
+        for _ in range(3):
+            self.breaker.record(success=False)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check_ready()
+        time.sleep(0.35)
+        self.breaker.check_ready()
+        self.breaker.check_ready()  # Peeking again does not take the probe either
+        self.breaker.check()  # The first real request is the probe
+        self.breaker.record(success=True)
+        self.assertEqual(get_redis().hget(self.breaker.key, 'state'), b'closed')
+        self.breaker.check()
+
+    def test_success_resets_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.record(success=False)
+        self.breaker.record(success=True)
+        for _ in range(2):
+            self.breaker.record(success=False)
+        self.breaker.check()
+
+class ExtractDinFieldsTests(SimpleTestCase):
+    def recorded_responses(self):
+        for name in sorted(os.listdir(TEST_DATA_DIR)):
+            if name.startswith('ncaprefill_'):
+                with open(os.path.join(TEST_DATA_DIR, name), encoding='utf-8') as file:
+                    yield name, file.read()
+
+    def test_matches_xml_to_json_path_on_recorded_responses(self):
+        for name, text in self.recorded_responses():
+            with self.subTest(response=name):
+                response_data = json.loads(xml_to_json(text))
+                expected = [find_key_value(response_data, param) for param in PARAMETERS]
+                self.assertEqual(extract_din_fields(text), expected)
+                self.assertEqual(extract_din_fields(text.encode('utf-8')), expected)
+
+    def test_first_match_semantics(self):
+        with open(os.path.join(TEST_DATA_DIR, 'ncaprefill_shadowed.xml'), encoding='utf-8') as file:
+            row = dict(zip(PARAMETERS, extract_din_fields(file.read())))
+        self.assertEqual(row['email'], 'sibling-last@example.com')
+        self.assertEqual(row['firstName'], '&TOP <LEVEL>')
+        self.assertEqual(row['presentAdd'], {'presentAddCity': 'MUMBAI'})
+        self.assertEqual(row['presentAddCity'], 'MUMBAI')
+
+    def test_unparseable_response_gives_empty_row(self):
+        self.assertEqual(extract_din_fields(''), [None] * len(PARAMETERS))
+
+class HttpPoolTests(SimpleTestCase):
+    def setUp(self):
+        http_pool.close_pool()
+        self.addCleanup(http_pool.close_pool)
+
+    def test_batches_reuse_one_session_and_connection(self):
+        from aiohttp import web
+
+        async def client_port(request):
+            return web.Response(text=str(request.transport.get_extra_info('peername')[1]))
+
+        app = web.Application()
+        app.router.add_get('/', client_port)
+        runner = web.AppRunner(app)
+        loop = http_pool.get_event_loop()
+        loop.run_until_complete(runner.setup())
+        self.addCleanup(loop.run_until_complete, runner.cleanup())
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        loop.run_until_complete(site.start())
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/"
+
+        async def batch():
+            session = await http_pool.get_session()
+            async with session.get(url) as response:
+                return session, await response.text()
+
+        http_pool.open_pool()
+        first_session, first_port = loop.run_until_complete(batch())
+        second_session, second_port = loop.run_until_complete(batch())
+        self.assertIs(first_session, second_session)
+        self.assertEqual(first_port, second_port)
+
+    def test_worker_shutdown_closes_session_and_loop(self):
+        from celery.signals import worker_process_init, worker_process_shutdown
+
+        worker_process_init.send(sender=None)
+        loop = http_pool.get_event_loop()
+        session = loop.run_until_complete(http_pool.get_session())
+        self.assertFalse(session.closed)
+        worker_process_shutdown.send(sender=None)
+        self.assertTrue(session.closed)
+        self.assertTrue(loop.is_closed())
+        # A later batch in the same process gets a fresh loop and session
+        self.assertFalse(http_pool.get_event_loop().run_until_complete(http_pool.get_session()).closed)
+
+@override_settings(DIN_PARSE_EXECUTOR='thread', DIN_PARSE_WORKERS=1, DIN_PARSE_QUEUE_SIZE=2)
+class ParsePoolTests(SimpleTestCase):
+    def setUp(self):
+        parse_pool.shutdown()
+        self.addCleanup(parse_pool.shutdown)
+
+    def test_queue_is_bounded_and_waiting_callers_resume(self):
+        release = threading.Event()
+        started = []
+
+        def slow_parse(text):
+            started.append(text)
+            release.wait(5)
+            return [text]
+
+        async def run():
+            parses = [asyncio.ensure_future(parse_pool.parse_response(str(i))) for i in range(5)]
+            await asyncio.sleep(0.1)
+            # One response is parsing, one waits in the executor, three wait for a slot
+            slots = parse_pool._get_slots()
+            queued = parse_pool.get_executor()._work_queue.qsize()
+            waiting = (started[:], queued, slots.locked(), all(not parse.done() for parse in parses))
+            release.set()
+            return waiting, await asyncio.gather(*parses)
+
+        with mock.patch.object(parse_pool, 'extract_din_fields', slow_parse):
+            waiting, rows = asyncio.run(run())
+        self.assertEqual(waiting, (['0'], 1, True, True))
+        self.assertEqual(rows, [[str(i)] for i in range(5)])
+
+    @override_settings(DIN_PARSE_EXECUTOR='process')
+    def test_process_pool_falls_back_to_threads_in_daemonic_workers(self):
+        with mock.patch.object(parse_pool.multiprocessing, 'current_process', return_value=mock.Mock(daemon=True)):
+            with self.assertLogs('din_app', level='WARNING'):
+                executor = parse_pool.get_executor()
+        self.assertIsInstance(executor, parse_pool.ThreadPoolExecutor)
+
+class ConcatFilesTests(SimpleTestCase):
+    def test_appends_parts_in_order(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'out.csv')
+            with open(output_path, 'w') as file:
+                file.write('DIN,Status\n')
+            part_paths = []
+            for i in range(3):
+                part_path = os.path.join(tmp_dir, f'part_{i}.csv')
+                with open(part_path, 'w') as file:
+                    file.write(f'{i:08d},success\n' * (i + 1))
+                part_paths.append(part_path)
+            concat_files(output_path, part_paths)
+            with open(output_path) as file:
+                self.assertEqual(
+                    file.read(),
+                    'DIN,Status\n00000000,success\n' + '00000001,success\n' * 2 + '00000002,success\n' * 3,
+                )
+
+class DINResultIngestTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('analyst', is_staff=True)
+        self.din_request = DINRequest.objects.create(user=user, start_range=1, end_range=4)
+
+    def make_row(self, din, status, **values):
+        return [din, status] + [values.get(param) for param in PARAMETERS]
+
+    def test_ingest_is_idempotent_and_export_keeps_input_order(self):
+        now = timezone.now()
+        ingest_din_results(self.din_request.id, [
+            (2, self.make_row('00000003', 'success', firstName='ASHA', pan='ABCDE1234F'), now),
+            (3, self.make_row('00000004', 'failed: DIN not found (404)'), now),
+        ])
+        first_batch = [
+            (0, self.make_row('00000001', 'success', firstName='RAVI'), now),
+            (1, self.make_row('00000002', 'success', email='x@example.com'), now),
+        ]
+        ingest_din_results(self.din_request.id, first_batch)
+        ingest_din_results(self.din_request.id, first_batch)  # Redelivered batch
+        self.assertEqual(DINResult.objects.filter(din_request=self.din_request).count(), 4)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, 'out.csv')
+            write_results_csv(self.din_request.id, output_path)
+            with open(output_path, newline='', encoding='utf-8') as file:
+                rows = list(csv.reader(file))
+        self.assertEqual(rows[0], ["DIN", "Status"] + PARAMETERS)
+        self.assertEqual([row[0] for row in rows[1:]], ['00000001', '00000002', '00000003', '00000004'])
+        self.assertEqual(rows[3][2 + PARAMETERS.index('pan')], 'ABCDE1234F')
+        self.assertEqual(rows[4][2:], [""] * len(PARAMETERS))
+
+    def test_ingest_replaces_only_retryable_failures(self):
+        now = timezone.now()
+        ingest_din_results(self.din_request.id, [
+            (0, self.make_row('00000001', 'failed: server error 502'), now),
+            (1, self.make_row('00000002', 'failed: DIN not found (404)'), now),
+            (2, self.make_row('00000003', 'success', firstName='ASHA'), now),
+        ])
+        ingest_din_results(self.din_request.id, [
+            (0, self.make_row('00000001', 'success', firstName='RAVI'), now),
+            (1, self.make_row('00000002', 'success', firstName='MEERA'), now),
+            (2, self.make_row('00000003', 'failed: request exception timeout'), now),
+        ])
+        stored = dict(DINResult.objects.filter(din_request=self.din_request).values_list('din', 'status'))
+        self.assertEqual(stored, {'00000001': 'success', '00000002': 'failed: DIN not found (404)', '00000003': 'success'})
+
+    def test_compressed_and_parquet_outputs_match_csv(self):
+        import pyarrow.parquet as pq
+
+        now = timezone.now()
+        ingest_din_results(self.din_request.id, [
+            (0, self.make_row('00000001', 'success', firstName='RAVI', pan='ABCDE1234F'), now),
+            (1, self.make_row('00000002', 'failed: DIN not found (404)'), now),
+        ])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_results_csv(self.din_request.id, os.path.join(tmp_dir, 'plain.csv'))
+            with open(os.path.join(tmp_dir, 'plain.csv'), newline='', encoding='utf-8') as file:
+                expected = list(csv.reader(file))
+
+            self.din_request.output_format = 'csv.gz'
+            name = write_results(self.din_request, tmp_dir)
+            with gzip.open(os.path.join(tmp_dir, name), 'rt', newline='', encoding='utf-8') as file:
+                self.assertEqual(list(csv.reader(file)), expected)
+
+            self.din_request.output_format = 'parquet'
+            name = write_results(self.din_request, tmp_dir)
+            table = pq.read_table(os.path.join(tmp_dir, name))
+        self.assertEqual(table.column_names, expected[0])
+        rows = [[value or "" for value in row.values()] for row in table.to_pylist()]
+        self.assertEqual(rows, expected[1:])
+
+    def test_merged_shards_match_a_single_export(self):
+        import pyarrow.parquet as pq
+
+        user = self.din_request.user
+        shards = [self.din_request, DINRequest.objects.create(user=user, start_range=5, end_range=6)]
+        now = timezone.now()
+        ingest_din_results(shards[0].id, [(0, self.make_row('00000001', 'success', firstName='RAVI'), now)])
+        ingest_din_results(shards[1].id, [
+            (0, self.make_row('00000005', 'success', pan='ABCDE1234F'), now),
+            (1, self.make_row('00000006', 'failed: DIN not found (404)'), now),
+        ])
+        expected = [["DIN", "Status"] + PARAMETERS] + [[value or "" for value in row] for row in (
+            self.make_row('00000001', 'success', firstName='RAVI'),
+            self.make_row('00000005', 'success', pan='ABCDE1234F'),
+            self.make_row('00000006', 'failed: DIN not found (404)'),
+        )]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for output_format in ('csv', 'csv.gz', 'parquet'):
+                parts = []
+                for shard in shards:
+                    shard.output_format = output_format
+                    parts.append(os.path.join(tmp_dir, write_results(shard, tmp_dir, header=False)))
+                merged_path = os.path.join(tmp_dir, f'merged.{output_format}')
+                merge_results(output_format, parts, merged_path)
+                if output_format == 'parquet':
+                    table = pq.read_table(merged_path)
+                    rows = [table.column_names] + [[value or "" for value in row.values()] for row in table.to_pylist()]
+                else:
+                    opener = gzip.open if output_format == 'csv.gz' else open
+                    with opener(merged_path, 'rt', newline='', encoding='utf-8') as file:
+                        rows = list(csv.reader(file))
+                self.assertEqual(rows, expected, output_format)
+
+class JobFinalizeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.parts_dir = os.path.join(media_root.name, 'outputs', 'parts')
+        os.makedirs(self.parts_dir)
+        user = User.objects.create_user('analyst', email='analyst@example.com', is_staff=True)
+        self.job = DINJob.objects.create(user=user, description='Range 1 - 4', total_dins=4)
+        self.shards = [
+            DINRequest.objects.create(user=user, job=self.job, start_range=start, end_range=start + 1)
+            for start in (1, 3)
+        ]
+
+    def test_job_with_a_failed_shard_is_merged_without_it(self):
+        completed, failed = self.shards
+        ingest_din_results(completed.id, [
+            (0, ['00000001', 'success'] + [""] * len(PARAMETERS), timezone.now()),
+            (1, ['00000002', 'success'] + [""] * len(PARAMETERS), timezone.now()),
+        ])
+        write_results(completed, self.parts_dir, header=False)
+        completed.status = 'completed'
+        completed.save()
+        failed.status = 'processing'
+        failed.save()
+        with mock.patch.object(finalize_din_job, 'delay') as delay:
+            finalize_din_job_if_done(self.job.id)
+            delay.assert_not_called()
+            failed.status = 'failed'
+            failed.save()
+            finalize_din_job_if_done(self.job.id)
+            delay.assert_called_once_with(self.job.id)
+        finalize_din_job(self.job.id)
+
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.email_status), ('partial', 'sent'))
+        with open(self.job.output_file.path, newline='', encoding='utf-8') as file:
+            self.assertEqual([row[0] for row in csv.reader(file)], ['DIN', '00000001', '00000002'])
+        self.assertIn(f'sub-request {failed.id} (DINs 3 - 4): failed', mail.outbox[0].body)
+        # Kept so that resuming the failed shard can merge the job again
+        self.assertTrue(os.path.exists(os.path.join(self.parts_dir, f'din_{completed.id}.csv')))
+
+@override_settings(DIN_CACHE_TTL=3600)
+class LookupCacheTests(TestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:cache:{uuid.uuid4().hex}"
+        for name in ('HITS_KEY', 'MISSES_KEY'):
+            patcher = mock.patch.object(lookup_cache, name, f"{prefix}:{getattr(lookup_cache, name)}")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+        now = timezone.now()
+        lookup_cache.store_rows([
+            ['00000001', 'success'] + ['ASHA'] + [""] * (len(PARAMETERS) - 1),
+            ['00000002', 'failed: server error 503'] + [""] * len(PARAMETERS),
+        ], now)
+        lookup_cache.store_rows([['00000003', 'success'] + ['RAVI'] + [""] * (len(PARAMETERS) - 1)], now - timedelta(hours=2))
+
+    def test_hits_respect_max_age_and_are_counted(self):
+        dins = ['00000001', '00000002', '00000003']
+        cached = lookup_cache.get_cached_rows(dins, 3 * 3600)
+        self.assertEqual(sorted(cached), ['00000001', '00000003'])
+        self.assertEqual(cached['00000001'][0][:3], ['00000001', 'success', 'ASHA'])
+        self.assertEqual(sorted(lookup_cache.get_cached_rows(dins, 3600)), ['00000001'])
+        self.assertEqual(lookup_cache.cache_stats(), {'hits': 3, 'misses': 3})
+
+    def test_entries_past_the_ttl_are_not_used_and_purged(self):
+        request = DINRequest(cache_max_age=3 * 3600)
+        # The request's max age is capped at DIN_CACHE_TTL
+        self.assertEqual(lookup_cache.get_cached_rows(['00000003'], lookup_cache.effective_max_age(request)), {})
+        self.assertEqual(lookup_cache.purge_expired(), 1)
+        self.assertEqual(sorted(lookup_cache.get_cached_rows(['00000001', '00000003'], 3 * 3600)), ['00000001'])
+
+    def test_force_refresh_bypasses_the_cache(self):
+        max_age = lookup_cache.effective_max_age(DINRequest(force_refresh=True))
+        self.assertEqual(lookup_cache.get_cached_rows(['00000001'], max_age), {})
+        self.assertEqual(lookup_cache.cache_stats(), {'hits': 0, 'misses': 0})
+
+class NegativeCacheTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        self.addCleanup(self.clear_bitmaps)
+
+    def clear_bitmaps(self):
+        client = get_redis()
+        keys = list(client.scan_iter(f"{negative_cache.KEY_PREFIX}:*"))
+        if keys:
+            client.delete(*keys)
+
+    def row(self, din, status, **values):
+        return [din, status] + [values.get(param) for param in PARAMETERS]
+
+    def test_records_empty_dins_and_clears_found_ones(self):
+        negative_cache.record_rows([
+            self.row('00000011', 'failed: DIN not found (404)'),
+            self.row('00000012', 'success'),
+            self.row('00000013', 'success', firstName='ASHA'),
+            self.row('00000014', 'failed: server error 503'),
+        ])
+        dins = ['00000011', '00000012', '00000013', '00000014']
+        max_age = 2 * negative_cache.BUCKET_SECONDS
+        self.assertEqual(negative_cache.find_known_empty(dins, max_age), {'00000011', '00000012'})
+        # DINs spread across a chunk take the per-bit path, other chunks are read on their own
+        self.assertEqual(negative_cache.find_known_empty(['00000011', '00999999', '99999999'], max_age), {'00000011'})
+        self.assertEqual(negative_cache.find_known_empty(dins, None), set())
+
+        negative_cache.record_rows([self.row('00000011', 'success', firstName='NEW')])
+        self.assertEqual(negative_cache.find_known_empty(dins, max_age), {'00000012'})
+
+    def test_misses_older_than_the_max_age_are_not_used(self):
+        day = negative_cache.BUCKET_SECONDS
+        now = 20000 * day + 6 * 3600
+        with mock.patch.object(negative_cache.time, 'time', return_value=now - 3 * 3600):
+            negative_cache.record_rows([self.row('00000021', 'failed: DIN not found (404)')])
+        with mock.patch.object(negative_cache.time, 'time', return_value=now - 2 * day):
+            negative_cache.record_rows([self.row('00000022', 'failed: DIN not found (404)')])
+        with mock.patch.object(negative_cache.time, 'time', return_value=now):
+            # Three hours old: outside a two-hour max age although recorded today
+            self.assertEqual(negative_cache.find_known_empty(['00000021', '00000022'], 2 * 3600), set())
+            self.assertEqual(negative_cache.find_known_empty(['00000021', '00000022'], day), {'00000021'})
+            self.assertEqual(negative_cache.find_known_empty(['00000021', '00000022'], 3 * day), {'00000021', '00000022'})
+
+    @override_settings(DIN_NEGATIVE_CACHE_MAX_CHUNKS=2)
+    def test_oldest_chunks_are_dropped_beyond_the_cap(self):
+        day = negative_cache.BUCKET_SECONDS
+        now = 20000 * day + 6 * 3600
+        far = f"{3 * negative_cache.CHUNK_DINS:08d}"
+        with mock.patch.object(negative_cache.time, 'time', return_value=now - day):
+            negative_cache.record_rows([self.row('00000031', 'failed: DIN not found (404)')])
+        with mock.patch.object(negative_cache.time, 'time', return_value=now):
+            negative_cache.record_rows([self.row('00000032', 'failed: DIN not found (404)')])
+            negative_cache.record_rows([self.row(far, 'failed: DIN not found (404)')])
+            self.assertEqual(get_redis().zcard(negative_cache._chunks_key()), 2)
+            self.assertEqual(
+                negative_cache.find_known_empty(['00000031', '00000032', far], 3 * day), {'00000032', far}
+            )
+
+class PlannerTests(SimpleTestCase):
+    def sub_request(self, start, density):
+        return DINRequest(start_range=start, end_range=start + 4999, sampled_density=density)
+
+    def test_density_counts_records_among_answered_dins(self):
+        rows = [
+            ['00000001', 'success', 'RAMESH'] + [''] * (len(PARAMETERS) - 1),
+            ['00000002', 'failed: DIN not found (404)'] + [''] * len(PARAMETERS),
+            ['00000003', negative_cache.CACHED_EMPTY_STATUS],
+            ['00000004', 'failed: server error 503'] + [''] * len(PARAMETERS),
+        ]
+        self.assertAlmostEqual(planner.estimate_density(rows), 1 / 3)
+        self.assertIsNone(planner.estimate_density(rows[3:]))
+
+    def test_dense_first_then_unknown_then_empty(self):
+        sub_requests = [
+            self.sub_request(1, 0.0), self.sub_request(5001, 0.1), self.sub_request(10001, None),
+            self.sub_request(15001, 0.6), self.sub_request(20001, 0.0),
+        ]
+        to_dispatch, to_skip = planner.order_for_dispatch(sub_requests, 'defer')
+        self.assertEqual([r.start_range for r in to_dispatch], [15001, 5001, 10001, 1, 20001])
+        self.assertEqual(to_skip, [])
+
+        to_dispatch, to_skip = planner.order_for_dispatch(sub_requests, 'drop')
+        self.assertEqual([r.start_range for r in to_dispatch], [15001, 5001, 10001])
+        self.assertEqual([r.start_range for r in to_skip], [1, 20001])
+
+    def test_sample_stays_inside_the_sub_range(self):
+        sample = planner.sample_dins(DINRequest(start_range=100, end_range=109), 20)
+        self.assertEqual(sample, [f"{din:08d}" for din in range(100, 110)])
+
+class FrontierSearchTests(SimpleTestCase):
+    def allocation(self, frontier, gap_every=7, gap_length=12):
+        # Allocated up to frontier, with runs of gap_length unallocated DINs
+        return {din for din in range(1, frontier + 1) if (din // gap_length) % gap_every != 3}
+
+    def probe(self, allocated, width):
+        probes = []
+
+        def probe_window(start):
+            probes.append(start)
+            found = [din for din in range(start, start + width) if din in allocated]
+            return max(found) if found else None
+        return probe_window, probes
+
+    def test_finds_frontier_across_short_gaps(self):
+        for frontier in (1000, 54321, 1234567):
+            allocated = self.allocation(frontier)
+            probe_window, probes = self.probe(allocated, 20)
+            self.assertEqual(find_frontier(900, probe_window, 20, 256), max(allocated))
+            self.assertLess(len(probes), 60)
+
+    def test_no_new_allocations_keeps_known_frontier(self):
+        probe_window, _ = self.probe(self.allocation(5000), 20)
+        self.assertEqual(find_frontier(max(self.allocation(5000)), probe_window, 20, 256), max(self.allocation(5000)))
+
+@override_settings(DIN_LEASE_SIZE=100, DIN_BATCH_SIZE=10, DIN_LEASE_TTL=600)
+class LeaseQueueTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        self.job = f"test-{uuid.uuid4().hex}"
+        self.addCleanup(leases.clear_job, self.job)
+
+    def drain(self, lease_id):
+        positions = []
+        completed = False
+        while True:
+            start, end, completed = leases.next_chunk(self.job, lease_id)
+            if start == end:
+                return positions, completed
+            positions.extend(range(start, end))
+
+    def test_intervals_are_split_to_lease_size(self):
+        self.assertEqual(leases.to_intervals([0, 1, 2, 5, 6, 9]), [(0, 3), (5, 7), (9, 10)])
+        leases.create_job(self.job, list(range(250)))
+        self.assertEqual(leases.acquire(self.job)[1:], (0, 100))
+        self.assertEqual(leases.acquire(self.job)[1:], (100, 200))
+        self.assertEqual(leases.acquire(self.job)[1:], (200, 250))
+
+    def test_idle_worker_steals_back_half_of_largest_lease(self):
+        leases.create_job(self.job, list(range(100)))
+        lease_id, _, _ = leases.acquire(self.job)
+        self.assertEqual(leases.next_chunk(self.job, lease_id)[:2], (0, 10))
+        thief_id, start, end = leases.acquire(self.job)
+        self.assertEqual((start, end), (55, 100))
+        victim_positions, victim_completed = self.drain(lease_id)
+        thief_positions, thief_completed = self.drain(thief_id)
+        self.assertEqual(sorted([*range(10), *victim_positions, *thief_positions]), list(range(100)))
+        self.assertEqual((victim_completed, thief_completed), (False, True))
+        self.assertEqual(leases.acquire(self.job), (None, 0))
+
+    def test_expired_lease_is_requeued_from_last_completed_chunk(self):
+        leases.create_job(self.job, list(range(30)))
+        lease_id, _, _ = leases.acquire(self.job)
+        leases.next_chunk(self.job, lease_id)
+        leases.next_chunk(self.job, lease_id)  # [0, 10) done, [10, 20) in flight
+        with override_settings(DIN_LEASE_TTL=-1):
+            leases.next_chunk(self.job, lease_id)  # [10, 20) done, renewed with a deadline in the past
+        new_id, start, end = leases.acquire(self.job)
+        self.assertEqual((start, end), (20, 30))
+        with self.assertRaises(leases.LeaseLost):
+            leases.next_chunk(self.job, lease_id)
+        self.assertEqual(self.drain(new_id), (list(range(20, 30)), True))
+
+    def test_keys_created_after_create_job_expire(self):
+        client = get_redis()
+        leases.create_job(self.job, list(range(30)))
+        lease_id, _, _ = leases.acquire(self.job)  # Empties the queue and creates the lease keys
+        self.assertTrue(all(client.ttl(key) > 0 for name, key in leases._keys(self.job).items() if name != 'queue'))
+        leases.release(self.job, lease_id)  # Creates the queue again
+        self.assertGreater(client.ttl(leases._keys(self.job)['queue']), 0)
+
+    def test_concurrent_workers_cover_every_position_and_complete_once(self):
+        leases.create_job(self.job, [p for p in range(2000) if p % 7])
+        processed, completions = [], []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                lease = leases.acquire(self.job)
+                if lease[0] is None:
+                    return
+                positions, completed = self.drain(lease[0])
+                with lock:
+                    processed.extend(positions)
+                    completions.append(completed)
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(processed), [p for p in range(2000) if p % 7])
+        self.assertEqual(completions.count(True), 1)
+        self.assertEqual(leases.remaining(self.job), 0)
+
+class DINSetTests(SimpleTestCase):
+    def test_matches_sorted_unique_list(self):
+        numbers = [7, 3, 4, 5, 100, 5, 12345678, 99, 101, 6]
+        din_set = DINSet.from_numbers(numbers)
+        expected = sorted(set(numbers))
+        self.assertEqual(din_set.intervals(), [(3, 8), (99, 102), (12345678, 12345679)])
+        self.assertEqual(len(din_set), len(expected))
+        self.assertEqual(list(din_set), expected)
+        self.assertEqual([din_set[i] for i in range(len(din_set))], expected)
+        self.assertEqual(din_set.din_at(0), '00000003')
+        self.assertIn(100, din_set)
+        self.assertNotIn(8, din_set)
+        self.assertEqual(DINSet.from_json(din_set.to_json()), din_set)
+
+    def test_chunks_split_by_position(self):
+        din_set = DINSet([(0, 5), (10, 20), (30, 33)])
+        chunks = list(din_set.chunks(6))
+        self.assertEqual([chunk.intervals() for chunk in chunks], [[(0, 5), (10, 11)], [(11, 17)], [(17, 20), (30, 33)]])
+        self.assertEqual([n for chunk in chunks for n in chunk], list(din_set))
+        self.assertEqual(len(DINSet.from_range(1, 5000000)), 5000000)
+
+    def test_sparse_sets_are_stored_compactly(self):
+        import random
+
+        numbers = random.Random(0).sample(range(1, 20000000), 5000)
+        din_set = DINSet.from_numbers(numbers + [500, 501, 502])
+        value = din_set.to_json()
+        self.assertLess(len(json.dumps(value)), 5 * len(din_set))
+        self.assertEqual(DINSet.from_json(value), din_set)
+        self.assertEqual(DINSet.from_json(json.loads(json.dumps(value))).intervals(), din_set.intervals())
+        # Pairs written before the compact encoding still load
+        self.assertEqual(DINSet.from_json([[start, end] for start, end in din_set.intervals()]), din_set)
+        self.assertEqual(DINSet([(1, 10)]).to_json(), [[1, 10]])
+
+    def test_stored_sets_are_sized_without_decoding(self):
+        din_set = DINSet.from_numbers(range(0, 200, 3))
+        with mock.patch.object(DINSet, 'from_json', side_effect=AssertionError('decoded')):
+            self.assertEqual(DINSet.json_len(din_set.to_json()), len(din_set))
+            self.assertEqual(DINSet.json_len([[1, 10], [20, 21]]), 10)
+
+    def test_din_set_migration_reverses_compact_sets(self):
+        import importlib
+
+        migration = importlib.import_module('din_app.migrations.0008_dinrequest_din_set')
+        din_set = DINSet.from_numbers([5, 6, 7, 9, 300, 12345678] + list(range(1000, 1100, 2)))
+        self.assertEqual(list(migration.stored_intervals(din_set.to_json())), din_set.intervals())
+        self.assertEqual(migration.stored_intervals([[1, 3]]), [[1, 3]])
+
+class ReadDinCsvTests(SimpleTestCase):
+    def read(self, text):
+        return read_din_csv(io.BytesIO(text.encode('utf-8')))
+
+    def test_normalizes_dedups_and_reports_invalid_rows(self):
+        is_valid, error_msg, din_set, report = self.read(
+            "\ufeffDIN\r\n123\r\n00000123\r\n\r\n 124 \r\nABC\r\n1,2\r\n0\r\n100000000\r\n99999999\r\n"
+        )
+        self.assertTrue(is_valid, error_msg)
+        self.assertEqual(list(din_set.dins()), ['00000123', '00000124', '99999999'])
+        self.assertEqual((report['rows'], report['duplicates'], report['invalid']), (8, 1, 4))
+        self.assertEqual(report['invalid_examples'][:2], [(6, 'ABC'), (7, '1,2')])
+
+    def test_first_row_is_data_when_it_is_a_din(self):
+        self.assertEqual(list(self.read("5\n6\n")[2]), [5, 6])
+
+    def test_file_without_dins_is_rejected(self):
+        is_valid, error_msg, din_set, report = self.read("DIN\nfoo\n")
+        self.assertFalse(is_valid)
+        self.assertEqual(report['invalid'], 1)
+
+    def test_bitmap_matches_from_numbers(self):
+        numbers = [7, 8, 9, 15, 16, 17, 23, 64, 65, 66, 67, 68, 69, 70, 71, 72, 99999999, 8]
+        bitmap = DINBitmap()
+        self.assertEqual(sum(bitmap.add(number) for number in numbers), len(numbers) - 1)
+        self.assertEqual(bitmap.to_dinset(), DINSet.from_numbers(numbers))
+
+@override_settings(DIN_USER_MAX_INFLIGHT=100, DIN_BATCH_SIZE=10, DIN_LEASE_TTL=600)
+class FairShareSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:sched:{uuid.uuid4().hex}"
+        patcher = mock.patch.object(scheduler, 'KEY_PREFIX', prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+
+    def serve(self, picks):
+        served = []
+        for _ in range(picks):
+            user_id, din_request_id, token = scheduler.pick()
+            scheduler.done(user_id, token)
+            served.append(din_request_id)
+        return served
+
+    def test_users_share_workers_evenly_regardless_of_job_count(self):
+        for job in (1, 2, 3, 4):
+            scheduler.add_job(job, 10, 1)
+        scheduler.add_job(5, 20, 1)
+        served = self.serve(20)
+        self.assertEqual(served.count(5), 10)
+        # One user's requests are served in arrival order
+        self.assertEqual(set(served) - {5}, {1})
+
+    def test_interactive_lane_outweighs_bulk_lane(self):
+        scheduler.add_job(1, 10, 0)
+        scheduler.add_job(2, 10, 2)
+        served = self.serve(34)
+        self.assertEqual(served.count(1), 2)
+        scheduler.remove_job(2)
+        self.assertEqual(self.serve(3), [1, 1, 1])
+
+    def test_in_flight_cap_and_exclusions(self):
+        scheduler.add_job(1, 10, 1)
+        scheduler.add_job(2, 10, 1)
+        with override_settings(DIN_USER_MAX_INFLIGHT=2):
+            first = scheduler.pick()
+            self.assertEqual(scheduler.pick(excluded=[1])[1], 2)
+            self.assertIsNone(scheduler.pick())
+            scheduler.done(first[0], first[2])
+            self.assertIsNotNone(scheduler.pick())
+
+    @override_settings(DIN_LEASE_WORKERS=2)
+    def test_lease_workers_are_capped_across_requests(self):
+        first = scheduler.reserve_workers()
+        self.assertEqual(len(first), 2)
+        self.assertEqual(scheduler.reserve_workers(), [])
+        self.assertTrue(scheduler.renew_worker(first[0]))
+        scheduler.worker_stopped(first[0])
+        self.assertEqual(len(scheduler.reserve_workers()), 1)
+        # A slot that expired while the cap filled up again is not given back
+        self.assertFalse(scheduler.renew_worker(first[0]))
+
+class LeaseWorkerTests(TestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:sched:{uuid.uuid4().hex}"
+        patcher = mock.patch.object(scheduler, 'KEY_PREFIX', prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+        user = User.objects.create_user('analyst', is_staff=True)
+        self.din_request = DINRequest.objects.create(user=user, start_range=1, end_range=20, status='processing')
+        self.addCleanup(leases.clear_job, self.din_request.id)
+        leases.create_job(self.din_request.id, list(range(20)))
+        scheduler.add_job(self.din_request.id, user.id, 1)
+
+    def test_failed_chunk_is_queued_again_and_the_worker_retries(self):
+        slot, = scheduler.reserve_workers(limit=1)
+        with mock.patch.object(tasks, 'process_din_chunk', side_effect=RuntimeError('database went away')):
+            with self.assertLogs('din_app', level='ERROR'), self.assertRaises(RuntimeError):
+                tasks.work_din_queue(slot)
+        self.assertEqual(leases.remaining(self.din_request.id), 20)
+        self.assertEqual(leases.acquire(self.din_request.id)[1:], (0, 20))
+        # The retry keeps its slot
+        self.assertTrue(scheduler.renew_worker(slot))
+
+    def test_resumed_request_only_queues_dins_without_results(self):
+        din_request = DINRequest.objects.create(user=self.din_request.user, start_range=1, end_range=10, force_refresh=True)
+        EmailStatus.objects.create(din_request=din_request)
+        self.addCleanup(leases.clear_job, din_request.id)
+        prefix = f"din:test:progress:{uuid.uuid4().hex}"
+        patcher = mock.patch.object(progress, 'KEY_PREFIX', prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+        ingest_din_results(din_request.id, [
+            (position, [f"{position + 1:08d}", "success"] + [""] * len(PARAMETERS), timezone.now())
+            for position in (0, 1, 2, 5)
+        ] + [
+            # A server error is fetched again, a 404 is a result
+            (6, ["00000007", "failed: server error 503"] + [""] * len(PARAMETERS), timezone.now()),
+            (7, ["00000008", "failed: DIN not found (404)"] + [""] * len(PARAMETERS), timezone.now()),
+        ])
+        # Dispatched again, as on a resume or a redelivered dispatch task
+        for _ in range(2):
+            self.assertEqual(tasks.dispatch_din_request(din_request.id), 'processing')
+            self.assertEqual(leases.remaining(din_request.id), 5)
+            self.assertEqual((progress.get(din_request.id)['done'], progress.get(din_request.id)['failed']), (5, 1))
+            queued = []
+            while (lease := leases.acquire(din_request.id))[0] is not None:
+                queued.extend(range(lease[1], lease[2]))
+            self.assertEqual(queued, [3, 4, 6, 8, 9])
+
+    def test_deleted_request_leaves_the_scheduler(self):
+        din_request_id = self.din_request.id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.din_request.delete()
+        self.assertFalse(scheduler.has_jobs())
+        self.assertEqual(leases.remaining(din_request_id), 0)
+
+    def test_worker_drops_a_request_deleted_behind_the_signal(self):
+        scheduler.add_job(999999, self.din_request.user_id, 1)
+        scheduler.remove_job(self.din_request.id)
+        slot, = scheduler.reserve_workers(limit=1)
+        with mock.patch.object(tasks, 'process_din_chunk') as process:
+            with self.assertLogs('din_app', level='WARNING'):
+                tasks.work_din_queue(slot)
+        process.assert_not_called()
+        self.assertFalse(scheduler.has_jobs())
+
+    @override_settings(DIN_LEASE_WORKERS=2)
+    def test_sweep_starts_workers_while_requests_are_queued(self):
+        with mock.patch.object(tasks.work_din_queue, 'delay') as delay:
+            tasks.sweep_din_leases()
+            self.assertEqual(delay.call_count, 2)
+            scheduler.remove_job(self.din_request.id)
+            tasks.sweep_din_leases()
+            self.assertEqual(delay.call_count, 2)
+
+class CancellationTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:cancel:{uuid.uuid4().hex}"
+        patcher = mock.patch.object(cancellation, 'KEY_PREFIX', prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+
+    def test_flag_is_per_request_and_cleared_on_resume(self):
+        cancellation.cancel(1, 2)
+        with self.assertRaises(cancellation.RequestCancelled):
+            cancellation.check(1)
+        cancellation.check(3)
+        cancellation.clear(1)
+        cancellation.check(1)
+        self.assertTrue(cancellation.is_cancelled(2))
+
+    def test_cancelled_request_is_not_sent_to_mca(self):
+        cancellation.cancel(7)
+        session = mock.MagicMock()
+        with self.assertRaises(cancellation.RequestCancelled):
+            asyncio.run(get_din_data_async('00000001', session, din_request_id=7))
+        session.post.assert_not_called()
+
+@override_settings(DIN_SINGLE_FLIGHT_POLL_INTERVAL=0.02)
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:flight:{uuid.uuid4().hex}"
+        patcher = mock.patch.object(single_flight, 'KEY_PREFIX', prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+        self.calls = []
+
+    async def fetch(self, din):
+        self.calls.append(din)
+        await asyncio.sleep(0.1)
+        return [din, "success"] + [f"{din}-{len(self.calls)}"] * len(PARAMETERS)
+
+    def test_overlapping_jobs_fetch_each_din_once(self):
+        async def run():
+            return await asyncio.gather(
+                single_flight.fetch_coalesced(['00000001', '00000002', '00000003'], self.fetch),
+                single_flight.fetch_coalesced(['00000002', '00000003', '00000004'], self.fetch),
+            )
+
+        first, second = asyncio.run(run())
+        self.assertEqual(sorted(self.calls), ['00000001', '00000002', '00000003', '00000004'])
+        self.assertEqual(first['00000002'], second['00000002'])
+        self.assertEqual(first['00000003'], second['00000003'])
+
+    def test_waiter_fetches_din_whose_owner_failed(self):
+        async def failing(din):
+            await asyncio.sleep(0.05)
+            raise RuntimeError("connection reset")
+
+        async def run():
+            return await asyncio.gather(
+                single_flight.fetch_coalesced(['00000005'], failing),
+                single_flight.fetch_coalesced(['00000005'], self.fetch),
+            )
+
+        first, second = asyncio.run(run())
+        self.assertIsInstance(first['00000005'], RuntimeError)
+        self.assertEqual(second['00000005'][1], "success")
+        self.assertEqual(self.calls, ['00000005'])
+
+    def test_failed_rows_are_not_shared_but_not_found_is(self):
+        async def server_error(din):
+            await asyncio.sleep(0.05)
+            status = "failed: DIN not found (404)" if din == '00000008' else "failed: server error 503"
+            return [din, status] + [""] * len(PARAMETERS)
+
+        async def run():
+            return await asyncio.gather(
+                single_flight.fetch_coalesced(['00000007', '00000008'], server_error),
+                single_flight.fetch_coalesced(['00000007', '00000008'], self.fetch),
+            )
+
+        first, second = asyncio.run(run())
+        self.assertEqual(first['00000007'][1], "failed: server error 503")
+        self.assertEqual(second['00000007'][1], "success")
+        self.assertEqual(second['00000008'][1], "failed: DIN not found (404)")
+        self.assertEqual(self.calls, ['00000007'])
+
+    def test_cancelled_waiter_stops_waiting(self):
+        with mock.patch.object(cancellation, 'KEY_PREFIX', f"{single_flight.KEY_PREFIX}:cancel"):
+            cancellation.cancel(9)
+
+            async def run():
+                return await asyncio.gather(
+                    single_flight.fetch_coalesced(['00000006'], self.fetch),
+                    single_flight.fetch_coalesced(['00000006'], self.fetch, din_request_id=9),
+                )
+
+            first, second = asyncio.run(run())
+        self.assertEqual(first['00000006'][1], "success")
+        self.assertIsInstance(second['00000006'], cancellation.RequestCancelled)
+
+class ProgressCounterTests(TestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = f"din:test:progress:{uuid.uuid4().hex}"
+        patcher = mock.patch.object(progress, 'KEY_PREFIX', prefix)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: get_redis().delete(*get_redis().keys(f"{prefix}*") or [prefix]))
+        user = User.objects.create_user('analyst', is_staff=True)
+        self.din_request = DINRequest.objects.create(user=user, start_range=1, end_range=1000)
+
+    def test_concurrent_chunks_do_not_lose_updates(self):
+        progress.start(self.din_request.id, 1000, done=100, success=100)
+
+        def worker():
+            for _ in range(30):
+                progress.record(self.din_request.id, success=2, failed=1)
+
+        threads = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        progress.record(self.din_request.id, cached=100)
+
+        counters = progress.get(self.din_request.id)
+        self.assertEqual(
+            (counters['done'], counters['success'], counters['failed'], counters['cached']), (1000, 700, 300, 100)
+        )
+        self.assertEqual(counters['progress'], 100)
+
+    def test_flush_writes_only_changed_requests(self):
+        progress.start(self.din_request.id, 1000)
+        progress.record(self.din_request.id, success=200, failed=50)
+        flush_din_progress()
+        self.din_request.refresh_from_db()
+        self.assertEqual(self.din_request.progress, 25)
+        self.assertEqual((self.din_request.success_dins, self.din_request.failed_dins), (200, 50))
+
+        with self.assertNumQueries(0):
+            flush_din_progress()
+
+    def test_flush_leaves_finished_requests_alone(self):
+        progress.start(self.din_request.id, 1000)
+        progress.record(self.din_request.id, success=200)
+        DINRequest.objects.filter(id=self.din_request.id).update(status='completed', progress=100, done_dins=1000)
+        flush_din_progress()
+        self.din_request.refresh_from_db()
+        self.assertEqual((self.din_request.progress, self.din_request.done_dins), (100, 1000))
+
+    def test_cache_hits_are_counted_when_the_fetch_gives_the_chunk_back(self):
+        progress.start(self.din_request.id, 1000)
+        row = ["00000001", "success"] + [""] * len(PARAMETERS)
+        breaker = mock.Mock(**{'check_ready.side_effect': CircuitOpenError('mca', 30)})
+        with mock.patch.object(lookup_cache, 'get_cached_rows', return_value={'00000001': (row, timezone.now())}), \
+                mock.patch.object(tasks, 'get_mca_breaker', return_value=breaker):
+            with self.assertRaises(CircuitOpenError):
+                tasks.process_din_chunk(self.din_request, [(0, '00000001'), (1, '00000002')])
+        self.assertEqual(DINResult.objects.filter(din_request=self.din_request).count(), 1)
+        self.assertEqual(progress.get(self.din_request.id)['cached'], 1)
+
+@override_settings(DIN_EVENTS_COALESCE_SECONDS=0.2, DIN_EVENTS_KEEPALIVE_SECONDS=0.1)
+class EventStreamTests(SimpleTestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        patcher = mock.patch.object(events, 'CHANNEL_PREFIX', f"din:test:events:{uuid.uuid4().hex}")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(
+            views, 'recent_request_data', lambda user_id, ids=None: [{'id': i} for i in sorted(ids or [9])]
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snapshot_then_coalesced_updates(self):
+        async def read_stream():
+            stream = views.din_event_stream(5)
+            received = []
+            async for item in stream:
+                if item.startswith(': keepalive'):
+                    if len(received) == 2:
+                        events.publish(5, 1, 2, 1)
+                        events.publish(6, 3)  # Another user's channel
+                    continue
+                received.append(item)
+                if len(received) == 3:
+                    break
+            await stream.aclose()
+            return received
+
+        retry, snapshot, update = asyncio.run(read_stream())
+        self.assertTrue(retry.startswith('retry:'))
+        self.assertEqual(snapshot, 'event: snapshot\ndata: [{"id": 9}]\n\n')
+        self.assertEqual(update, 'event: update\ndata: [{"id": 1}, {"id": 2}]\n\n')
+
+class RequestsApiTests(TestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        prefix = uuid.uuid4().hex
+        for name in ('VERSION_KEY', 'RESPONSE_KEY'):
+            patcher = mock.patch.object(api, name, f"test:{prefix}:{getattr(api, name)}")
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('analyst', is_staff=True)
+        self.requests = [
+            DINRequest.objects.create(user=self.user, start_range=i, end_range=i + 9) for i in (1, 11, 21)
+        ]
+        self.client.force_login(self.user)
+
+    @override_settings(DIN_API_CURSOR_LAG=0)
+    def test_etag_and_since_cursor_return_only_changes(self):
+        response = self.client.get('/api/v1/requests/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([req['id'] for req in response.json()['requests']], [r.id for r in reversed(self.requests)])
+        etag, since = response['ETag'], response.json()['next_since']
+
+        # Nothing changed: 304 without querying requests (the queries are session and user)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/v1/requests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        changed = self.requests[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            changed.status = 'processing'
+            changed.save()
+        response = self.client.get('/api/v1/requests/', {'since': since}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([req['id'] for req in response.json()['requests']], [changed.id])
+        self.assertEqual(response.json()['requests'][0]['status'], 'processing')
+
+    def test_change_committed_after_a_later_stamp_is_not_skipped(self):
+        now = timezone.now()
+        DINRequest.objects.filter(user=self.user).update(updated_at=now - timedelta(hours=2))
+        DINRequest.objects.filter(id=self.requests[1].id).update(updated_at=now - timedelta(seconds=10))
+        since = self.client.get('/api/v1/requests/').json()['next_since']
+
+        # Stamped before requests[1] was returned, but only visible now
+        late = self.requests[0]
+        DINRequest.objects.filter(id=late.id).update(updated_at=now - timedelta(seconds=20))
+        api.invalidate_user_requests(self.user.id)
+        response = self.client.get('/api/v1/requests/', {'since': since})
+        self.assertEqual([req['id'] for req in response.json()['requests']], [late.id, self.requests[1].id])
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/api/v1/requests/', {'since': 'yesterday'}).status_code, 400)
+
+    def test_csv_upload_shows_up_on_the_next_poll(self):
+        response = self.client.get('/api/v1/requests/')
+        etag = response['ETag']
+        upload = io.BytesIO(b'DIN\n00000001\n00000002\n')
+        upload.name = 'dins.csv'
+        with mock.patch.object(views, 'queue_din_job'), mock.patch.object(events, 'publish') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post('/process-din/', {'input_type': 'csv', 'input_csv': upload, 'output_format': 'csv'})
+        job = DINJob.objects.get()
+        shard_ids = list(job.shards.values_list('id', flat=True))
+        publish.assert_any_call(self.user.id, *shard_ids)
+
+        response = self.client.get('/api/v1/requests/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['requests'][0]['id'], shard_ids[-1])
+
+class BulkJobsApiTests(TestCase):
+    def setUp(self):
+        if not redis_available():
+            self.skipTest(f"Redis not reachable at {settings.DIN_REDIS_URL}")
+        patcher = mock.patch.object(bulk_api, 'SIZE_KEY', f"test:{uuid.uuid4().hex}:{bulk_api.SIZE_KEY}")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('pipeline', is_staff=True)
+        self.token, key = bulk_api.create_token(self.user, 'nightly')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+    def make_job(self, statuses, rows_per_shard=3):
+        job = DINJob.objects.create(user=self.user, total_dins=rows_per_shard * len(statuses))
+        for i, status in enumerate(statuses):
+            shard = DINRequest.objects.create(user=self.user, job=job, status=status, start_range=1, end_range=9)
+            ingest_din_results(shard.id, [
+                (n, [f"{i * 10 + n:08d}", "success"] + [f"name{n}"] + [""] * (len(PARAMETERS) - 1), timezone.now())
+                for n in range(rows_per_shard)
+            ])
+        return job
+
+    async def download(self, job, **headers):
+        response = await self.async_client.get(
+            f'/api/v1/jobs/{job.id}/results/', headers={'Authorization': self.auth['HTTP_AUTHORIZATION'], **headers}
+        )
+        if not response.streaming:
+            return response, response.content
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get('/api/v1/jobs/1/').status_code, 401)
+        self.assertEqual(self.client.get('/api/v1/jobs/1/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.token.is_active = False
+        self.token.save()
+        self.assertEqual(self.client.get('/api/v1/jobs/1/', **self.auth).status_code, 401)
+
+    def test_submit_list_job(self):
+        with mock.patch.object(bulk_api, 'queue_din_job') as queue:
+            response = self.client.post(
+                '/api/v1/jobs/', {'type': 'list', 'dins': ['00000003', 1, '1'], 'output_format': 'csv.gz'},
+                content_type='application/json', **self.auth,
+            )
+        self.assertEqual(response.status_code, 201)
+        job = DINJob.objects.get(id=response.json()['id'])
+        self.assertEqual((job.total_dins, job.output_format), (2, 'csv.gz'))
+        self.assertEqual(response['Location'], f'/api/v1/jobs/{job.id}/')
+        queue.assert_called_once()
+        self.assertEqual(self.client.get(response['Location'], **self.auth).json()['shards']['total'], 1)
+
+        response = self.client.post('/api/v1/jobs/', {'type': 'list', 'dins': ['abc']}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_results_stream_finished_shards_and_resume_with_range(self):
+        job = await sync_to_async(self.make_job)(['completed', 'completed', 'processing'])
+        response, body = await self.download(job)
+        self.assertEqual(response.status_code, 200)
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['DIN', 'Status'])
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], ['00000000', '00000001', '00000002', '00000010', '00000011', '00000012'])
+
+        offset = len(body) - 10
+        response, tail = await self.download(job, Range=f'bytes={offset}-', **{'If-Range': response['ETag']})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {offset}-{len(body) - 1}/*')
+        self.assertEqual(tail, body[offset:])
+
+        response, _ = await self.download(job, Range=f'bytes={len(body)}-')
+        self.assertEqual(response.status_code, 416)
+
+    async def test_results_stream_past_failed_shards(self):
+        job = await sync_to_async(self.make_job)(['completed', 'failed', 'cancelled', 'completed'])
+        response, body = await self.download(job)
+        self.assertEqual(
+            [line.split(',')[0] for line in body.decode().splitlines()[1:]],
+            ['00000000', '00000001', '00000002', '00000030', '00000031', '00000032'],
+        )
+        response, tail = await self.download(job, Range='bytes=10-')
+        self.assertEqual(response['Content-Range'], f'bytes 10-{len(body) - 1}/{len(body)}')
+        self.assertEqual(tail, body[10:])
+
+        # Resuming the failed shard changes the stream, so the old ETag no longer matches
+        await DINRequest.objects.filter(job=job, status='failed').aupdate(status='completed')
+        response, resumed = await self.download(job, Range='bytes=10-', **{'If-Range': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(resumed.decode().splitlines()), 10)
+
+    async def test_results_as_ndjson(self):
+        job = await sync_to_async(self.make_job)(['completed'])
+        response = await self.async_client.get(
+            f'/api/v1/jobs/{job.id}/results/', {'format': 'ndjson'}, headers={'Authorization': self.auth['HTTP_AUTHORIZATION']}
+        )
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(records[0], {'din': '00000000', 'status': 'success', 'data': {PARAMETERS[0]: 'name0'}})
+        self.assertEqual(len(records), 3)
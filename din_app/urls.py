@@ -1,6 +1,6 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import views, api, bulk_api
 
 urlpatterns = [
     path('', views.index, name='index'),
@@ -10,5 +10,13 @@ urlpatterns = [
     path('process-din/', views.process_din, name='process_din'),
     path('din-status/<int:request_id>/', views.din_status, name='din_status'),
     path('get-recent-requests/', views.get_recent_requests, name='get_recent_requests'),
+    path('din-events/', views.din_events, name='din_events'),
+    path('api/v1/requests/', api.requests_api, name='requests_api'),
+    path('api/v1/jobs/', bulk_api.jobs_api, name='api_jobs'),
+    path('api/v1/jobs/<int:job_id>/', bulk_api.job_api, name='api_job'),
+    path('api/v1/jobs/<int:job_id>/results/', bulk_api.job_results_api, name='api_job_results'),
     path('cancel-din/<int:request_id>/', views.cancel_din_request, name='cancel_din'),
+    path('resume-din/<int:request_id>/', views.resume_din_request, name='resume_din'),
+    path('din-job/<int:job_id>/', views.din_job_status, name='din_job_status'),
+    path('cancel-din-job/<int:job_id>/', views.cancel_din_job, name='cancel_din_job'),
 ]
\ No newline at end of file
@@ -1,5 +1,7 @@
 import requests
 import xml.etree.ElementTree as ET
+from lxml import etree
+import io
 import json
 import csv
 from django.core.mail import EmailMessage
@@ -7,6 +9,9 @@ import os
 from django.conf import settings
 import time
 import random
+from .rate_limit import get_mca_rate_limiter
+from .dinset import DINSet, DINBitmap
+from .frontier import MAX_DIN
 
 PARAMETERS = [
     "addCorrregofc", "adhaar", "amountSecured", "amountSecuredWords", "areaOfoccu",
@@ -27,39 +32,76 @@ PARAMETERS = [
     "pMobile"
 ]
 
+# Column position of each parameter in an output row
+PARAMETER_INDEX = {param: i for i, param in enumerate(PARAMETERS)}
+
+# SOAP responses never need DTDs or external entities
+_XML_PARSER = etree.XMLParser(remove_comments=True, remove_pis=True, resolve_entities=False, no_network=True)
+_XML_TEXT_PARSER = etree.XMLParser(remove_comments=True, remove_pis=True, resolve_entities=False, no_network=True, encoding='utf-8')
+
+def staff_check(user):
+    return user.is_active and user.is_staff and not user.is_superuser
+
 def validate_din_range(start, end):
     if start > end:
         return False, "Start range must be less than or equal to end range"
     return True, ""
 
-def validate_din_csv(file_path):
+def split_din_range(start, end, chunk_size=5000):
+    """
+    Split the inclusive range [start, end] into (chunk_start, chunk_end) pairs of at most chunk_size DINs.
+    """
+    ranges = []
+    current = start
+    while current <= end:
+        chunk_end = min(current + chunk_size - 1, end)
+        ranges.append((current, chunk_end))
+        current = chunk_end + 1
+    return ranges
+
+def read_din_csv(file, max_reported=10):
+    """
+    Stream a one-column CSV of DINs from a binary file object in a single pass.
+    Each DIN is validated and normalized to a number (so "123" and "00000123"
+    are the same DIN), duplicates are dropped with a DINBitmap, and the result
+    is built directly as a DINSet. A first row that is not a DIN is taken as
+    the header. Invalid rows are counted and reported rather than rejecting
+    the file.
+    Returns (is_valid, error_message, din_set, report), report holding the
+    counts of rows, duplicates and invalid rows, and up to max_reported
+    (line number, row) examples of invalid rows.
+    """
+    report = {'rows': 0, 'duplicates': 0, 'invalid': 0, 'invalid_examples': []}
+    seen = DINBitmap()
+    add = seen.add
+    valid = invalid = 0
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
     try:
-        if not os.path.exists(file_path):
-            return False, f"CSV file not found at {file_path}", []
-        
-        din_numbers = []
-        with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            header = next(reader, None)  # Check for header
-            if header and len(header) > 1:
-                return False, "CSV file must contain only one column with DIN numbers", []
-            
-            for row in reader:
-                if not row:
-                    continue
-                if len(row) != 1:
-                    return False, f"Invalid row in CSV: {row} (must contain exactly one DIN)", []
+        for line_number, row in enumerate(csv.reader(text), 1):
+            # Fast path for the common single-cell row
+            if len(row) == 1:
                 din = row[0].strip()
-                if not din.isdigit():
-                    return False, f"Invalid DIN number in CSV: {din} (must be a positive integer)", []
-                din_numbers.append(din)
-        
-        if not din_numbers:
-            return False, "CSV file is empty or contains no valid DIN numbers", []
-        
-        return True, "", din_numbers
-    except Exception as e:
-        return False, f"Error reading CSV file: {str(e)}", []
+                if din.isdigit() and din.isascii():
+                    number = int(din)
+                    if 0 < number <= MAX_DIN:
+                        valid += 1
+                        add(number)
+                        continue
+            cells = [cell for cell in row if cell.strip()]
+            if not cells or line_number == 1:
+                continue  # Blank row or header
+            invalid += 1
+            if len(report['invalid_examples']) < max_reported:
+                report['invalid_examples'].append((line_number, ','.join(row)[:50]))
+    except (csv.Error, UnicodeDecodeError) as e:
+        return False, f"Error reading CSV file: {str(e)}", DINSet(), report
+    finally:
+        text.detach()  # Leave the caller's file open
+    report.update(rows=valid + invalid, duplicates=valid - len(seen), invalid=invalid)
+
+    if not len(seen):
+        return False, "CSV file is empty or contains no valid DIN numbers", DINSet(), report
+    return True, "", seen.to_dinset(), report
 
 def generate_din_csv(file_path, start_range, end_range):
     try:
@@ -87,6 +129,102 @@ def xml_to_json(xml_string):
     except Exception:
         return "{}"
 
+def _element_to_dict(element):
+    # Same shape as xml_to_json: repeated tags keep the last element, at the first one's position
+    parsed_data = {}
+    for child in element:
+        if len(child):
+            parsed_data[child.tag] = _element_to_dict(child)
+        else:
+            parsed_data[child.tag] = child.text
+    return parsed_data
+
+def _fill_parameters(element, row, pending, excluded=frozenset()):
+    children = {}
+    for child in element:
+        children[child.tag] = child
+    # A parameter whose element is empty here hides any deeper match in this subtree
+    empty_here = set()
+    for tag, child in children.items():
+        if tag in pending and tag not in excluded:
+            if len(child):
+                row[PARAMETER_INDEX[tag]] = _element_to_dict(child)
+                pending.discard(tag)
+            elif child.text is not None:
+                row[PARAMETER_INDEX[tag]] = child.text
+                pending.discard(tag)
+            else:
+                empty_here.add(tag)
+    if empty_here:
+        excluded = excluded | empty_here
+    for child in children.values():
+        if not pending:
+            return
+        if len(child):
+            _fill_parameters(child, row, pending, excluded)
+
+def extract_din_fields(xml_string):
+    """
+    Extract PARAMETERS from a SOAP response (str or bytes) in a single walk of the parsed tree.
+    Returns a list in PARAMETERS order with None for missing fields, identical to
+    running find_key_value over xml_to_json's output for every parameter.
+    """
+    row = [None] * len(PARAMETERS)
+    try:
+        if isinstance(xml_string, str):
+            root = etree.fromstring(xml_string.encode('utf-8'), _XML_TEXT_PARSER)
+        else:
+            root = etree.fromstring(xml_string, _XML_PARSER)
+    except (etree.XMLSyntaxError, ValueError):
+        return row
+    if root is None:
+        return row
+    _fill_parameters(root, row, set(PARAMETER_INDEX))
+    return row
+
+def _copy_fd_range(src_fd, dst_fd, offset, count):
+    # Kernel-side copy at dst's current position: copy_file_range, then sendfile,
+    # then a plain read/write loop where neither is supported
+    try:
+        while count > 0:
+            copied = os.copy_file_range(src_fd, dst_fd, count, offset)
+            if copied == 0:
+                break
+            offset += copied
+            count -= copied
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        while count > 0:
+            copied = os.sendfile(dst_fd, src_fd, offset, count)
+            if copied == 0:
+                break
+            offset += copied
+            count -= copied
+        return
+    except (AttributeError, OSError):
+        pass
+    os.lseek(src_fd, offset, os.SEEK_SET)
+    while count > 0:
+        chunk = os.read(src_fd, min(count, 1024 * 1024))
+        if not chunk:
+            break
+        os.write(dst_fd, chunk)
+        count -= len(chunk)
+
+def concat_files(output_path, part_paths):
+    """
+    Append part files to output_path in order without copying them through Python.
+    """
+    # copy_file_range and sendfile refuse O_APPEND descriptors, so seek to the end instead
+    with open(output_path, 'r+b' if os.path.exists(output_path) else 'wb') as output:
+        output.seek(0, os.SEEK_END)
+        output.flush()
+        for part_path in part_paths:
+            with open(part_path, 'rb') as part:
+                _copy_fd_range(part.fileno(), output.fileno(), 0, os.fstat(part.fileno()).st_size)
+
 def read_din_numbers_from_csv(file_path):
     try:
         din_numbers = []
@@ -172,6 +310,7 @@ def send_post_request(din, output_file, max_retries=3, retry_delay=2):
                     </tns:getNCAPrefillDetails>
                 </soap:Body>
             </soap:Envelope>"""
+            get_mca_rate_limiter().acquire()
             response = requests.post(url, headers=headers, data=xml_payload, timeout=30)
             if response.status_code == 200:
                 json_response = xml_to_json(response.text)
@@ -204,7 +343,6 @@ def process_din_csv(input_csv, output_csv):
         for i, din in enumerate(din_numbers):
             if send_post_request(din, output_csv, max_retries=3, retry_delay=2):
                 success_count += 1
-            time.sleep(0.5)
         return success_count, total_count
     except Exception:
         return 0, 0
\ No newline at end of file
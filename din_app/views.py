@@ -1,23 +1,23 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.conf import settings
 from django.utils import timezone
-from .models import DINRequest, EmailStatus
-from .utils import validate_din_range, validate_din_csv
-from .tasks import process_din_task
-import os
-from celery import Celery
-import csv
+from django.db import transaction
+from .models import DINRequest, EmailStatus, DINFrontier, DINJob
+from .utils import validate_din_range, read_din_csv, split_din_range, staff_check
+from .dinset import DINSet
+from .tasks import process_din_task, dispatch_din_requests, plan_din_requests, discover_din_frontier, cancel_din_requests, finalize_din_job_if_done
+from . import cancellation, progress, events
+from .signals import announce
+from .api import invalidate_user_requests
+from .redis_client import get_async_redis
+from asgiref.sync import sync_to_async
+import asyncio
 import json
-
-app = Celery('din_project')
-app.config_from_object('django.conf:settings', namespace='CELERY')
-
-def staff_check(user):
-    return user.is_active and user.is_staff and not user.is_superuser
+import csv
 
 def index(request):
     if request.user.is_authenticated:
@@ -58,18 +58,177 @@ def user_logout(request):
 @login_required
 @user_passes_test(staff_check)
 def din_form(request):
-    return render(request, 'din_form.html')
+    return render(request, 'din_form.html', {
+        'output_formats': DINRequest.OUTPUT_FORMAT_CHOICES,
+        'priorities': DINRequest.PRIORITY_CHOICES,
+        'interactive_max_dins': settings.DIN_INTERACTIVE_MAX_DINS,
+        'empty_policies': DINRequest.EMPTY_POLICY_CHOICES,
+        'din_frontier': DINFrontier.objects.filter(user=request.user).first(),
+        'default_cache_max_age_hours': settings.DIN_CACHE_TTL // 3600,
+    })
 
 @login_required
 @user_passes_test(staff_check)
 def din_status(request, request_id):
     try:
         din_request = DINRequest.objects.get(id=request_id, user=request.user)
+        with_live_progress([din_request])
         return render(request, 'din_status.html', {'din_request': din_request})
     except DINRequest.DoesNotExist:
         messages.error(request, 'Request not found or you do not have permission to view it.')
         return redirect('din_form')
 
+def with_live_progress(din_requests):
+    """
+    Overlay the live Redis progress counters on requests that are still running;
+    the database columns lag by up to DIN_PROGRESS_FLUSH_INTERVAL.
+    """
+    running = [din_request for din_request in din_requests if din_request.status in ('pending', 'processing')]
+    live = progress.get_many([din_request.id for din_request in running]) if running else {}
+    for din_request in running:
+        if din_request.id in live:
+            progress.apply(din_request, live[din_request.id])
+    return din_requests
+
+def shard_size(din_request):
+    if din_request.start_range is not None:
+        return din_request.end_range - din_request.start_range + 1
+    return DINSet.json_len(din_request.din_set)
+
+def job_progress(shards):
+    """
+    Percent done of a job's shards, weighted by shard size so a short last shard counts for less.
+    """
+    total = sum(shard_size(shard) for shard in shards)
+    done = sum(
+        shard_size(shard) * (100 if shard.status in ('completed', 'skipped') else shard.progress)
+        for shard in shards
+    )
+    return done / total if total else 0
+
+@login_required
+@user_passes_test(staff_check)
+def din_job_status(request, job_id):
+    try:
+        job = DINJob.objects.get(id=job_id, user=request.user)
+    except DINJob.DoesNotExist:
+        messages.error(request, 'Job not found or you do not have permission to view it.')
+        return redirect('din_form')
+    
+    shards = with_live_progress(list(job.shards.select_related('email_status').order_by('id')))
+    status_counts = {}
+    for shard in shards:
+        status_counts[shard.status] = status_counts.get(shard.status, 0) + 1
+    return render(request, 'din_job_status.html', {
+        'job': job,
+        'shards': shards,
+        'progress': job_progress(shards),
+        'status_counts': sorted(status_counts.items()),
+    })
+
+def parse_job_options(data):
+    """
+    Read the per-request options shared by every sub-request from the submitted form.
+    Returns (options, error_message).
+    """
+    output_format = data.get('output_format', 'csv')
+    if output_format not in dict(DINRequest.OUTPUT_FORMAT_CHOICES):
+        return {}, 'Invalid output format selected.'
+    
+    cache_max_age = None
+    max_age_hours = (data.get('cache_max_age_hours') or '').strip()
+    if max_age_hours:
+        if not max_age_hours.isdigit():
+            return {}, 'Cache max age must be a whole number of hours.'
+        cache_max_age = int(max_age_hours) * 3600
+    
+    options = {
+        'output_format': output_format,
+        'cache_max_age': cache_max_age,
+        'force_refresh': data.get('force_refresh') in ('on', 'true', '1'),
+    }
+    
+    # 'auto' leaves the priority to auto_priority once the request size is known
+    priority = data.get('priority', 'auto')
+    if priority != 'auto':
+        if not priority.isdigit() or int(priority) not in dict(DINRequest.PRIORITY_CHOICES):
+            return {}, 'Invalid priority selected.'
+        options['priority'] = int(priority)
+    return options, ''
+
+def auto_priority(total_dins):
+    return 2 if total_dins <= settings.DIN_INTERACTIVE_MAX_DINS else 1
+
+def create_din_set_job(user, description, din_set, job_options):
+    """
+    Create a DINJob for a set of DINs, split into sub-requests of 5000 DINs
+    inserted in bulk and announced once committed. Returns (job, sub_requests);
+    nothing is queued yet.
+    """
+    job_options = {'priority': auto_priority(len(din_set)), **job_options}
+    with transaction.atomic():
+        job = DINJob.objects.create(
+            user=user,
+            description=description,
+            output_format=job_options['output_format'],
+            total_dins=len(din_set),
+        )
+        sub_requests = DINRequest.objects.bulk_create([
+            DINRequest(user=user, status='pending', din_set=chunk.to_json(), job=job, **job_options)
+            for chunk in din_set.chunks(5000)
+        ], batch_size=500)
+        EmailStatus.objects.bulk_create([
+            EmailStatus(din_request=sub_request, status='pending') for sub_request in sub_requests
+        ], batch_size=500)
+        # bulk_create sends no post_save, so announce the new sub-requests here
+        transaction.on_commit(lambda: announce(user.id, *[sub_request.id for sub_request in sub_requests]))
+    return job, sub_requests
+
+def create_range_job(user, start_range, end_range, empty_policy, job_options):
+    """
+    Create a DINJob for a validated DIN range, split into sub-ranges of 5000.
+    Returns (job, sub_requests); nothing is queued yet.
+    """
+    job_options = {'priority': auto_priority(end_range - start_range + 1), **job_options}
+    with transaction.atomic():
+        job = DINJob.objects.create(
+            user=user,
+            description=f'Range {start_range} - {end_range}',
+            output_format=job_options['output_format'],
+            total_dins=end_range - start_range + 1,
+        )
+        sub_requests = []
+        for chunk_start, chunk_end in split_din_range(start_range, end_range):
+            din_request = DINRequest.objects.create(
+                user=user,
+                status='pending',
+                start_range=chunk_start,
+                end_range=chunk_end,
+                empty_policy=empty_policy,
+                job=job,
+                **job_options
+            )
+            EmailStatus.objects.create(din_request=din_request, status='pending')
+            sub_requests.append(din_request)
+    return job, sub_requests
+
+def queue_din_job(job, sub_requests, empty_policy='scan'):
+    """
+    Hand a new job's sub-requests to the fair-share scheduler, or let the planner
+    sample its sub-ranges and dispatch the dense ones first. A job of up to
+    DIN_INTERACTIVE_MAX_DINS is dispatched here rather than from a task, so it
+    is served within seconds instead of waiting behind a sweep's dispatch tasks
+    on the Celery queue.
+    """
+    din_request_ids = [din_request.id for din_request in sub_requests]
+    if empty_policy != 'scan':
+        plan_din_requests.delay(din_request_ids, empty_policy)
+    elif job.total_dins <= settings.DIN_INTERACTIVE_MAX_DINS:
+        dispatch_din_requests(din_request_ids)
+    else:
+        for din_request_id in din_request_ids:
+            process_din_task.delay(din_request_id)
+
 @login_required
 @user_passes_test(staff_check)
 def process_din(request):
@@ -77,6 +236,12 @@ def process_din(request):
         try:
             input_type = request.POST.get('input_type')
             sub_requests = []
+            job = None
+            
+            job_options, error_msg = parse_job_options(request.POST)
+            if error_msg:
+                messages.error(request, error_msg)
+                return redirect('din_form')
             
             if input_type == 'csv':
                 if 'input_csv' not in request.FILES:
@@ -88,43 +253,23 @@ def process_din(request):
                     messages.error(request, 'Please upload a valid CSV file.')
                     return redirect('din_form')
                 
-                # Save CSV file
-                din_request = DINRequest.objects.create(
-                    user=request.user,
-                    status='pending',
-                    input_csv=csv_file
-                )
-                file_path = os.path.join(settings.MEDIA_ROOT, din_request.input_csv.name)
-                
-                # Validate CSV and get DINs
-                is_valid, error_msg, din_numbers = validate_din_csv(file_path)
+                # Stream the upload into a deduplicated DIN set in one pass; Django has
+                # already spooled a large upload to a temporary file
+                csv_file.seek(0)
+                is_valid, error_msg, din_set, report = read_din_csv(csv_file.file)
                 if not is_valid:
-                    din_request.delete()
                     messages.error(request, error_msg)
                     return redirect('din_form')
-                
-                # Store DINs in din_request
-                din_request.din_list = json.dumps(din_numbers)
-                din_request.save()
-                
-                # Split DINs into chunks of 5000
-                chunk_size = 5000
-                din_chunks = [din_numbers[i:i + chunk_size] for i in range(0, len(din_numbers), chunk_size)]
-                
-                for chunk in din_chunks:
-                    sub_request = DINRequest.objects.create(
-                        user=request.user,
-                        status='pending',
-                        din_list=json.dumps(chunk)  # Store chunk directly
-                    )
-                    EmailStatus.objects.create(
-                        din_request=sub_request,
-                        status='pending'
+                if report['invalid'] or report['duplicates']:
+                    examples = '; '.join(f'line {line}: {row}' for line, row in report['invalid_examples'])
+                    messages.warning(
+                        request,
+                        f"{report['invalid']} invalid rows skipped and {report['duplicates']} duplicate DINs removed."
+                        + (f' Invalid rows include {examples}.' if examples else '')
                     )
-                    sub_requests.append(sub_request)
                 
-                # Delete the original request after splitting
-                din_request.delete()
+                empty_policy = 'scan'
+                job, sub_requests = create_din_set_job(request.user, csv_file.name, din_set, job_options)
             
             elif input_type == 'range':
                 start_range = request.POST.get('start_range')
@@ -142,47 +287,57 @@ def process_din(request):
                     messages.error(request, error_msg)
                     return redirect('din_form')
                 
-                # Split range into chunks of 5000
-                chunk_size = 5000
-                ranges = []
-                current = start_range
-                while current <= end_range:
-                    chunk_end = min(current + chunk_size - 1, end_range)
-                    ranges.append((current, chunk_end))
-                    current = chunk_end + 1
+                empty_policy = request.POST.get('empty_policy', 'scan')
+                if empty_policy not in dict(DINRequest.EMPTY_POLICY_CHOICES):
+                    messages.error(request, 'Invalid empty sub-range policy selected.')
+                    return redirect('din_form')
                 
-                for chunk_start, chunk_end in ranges:
-                    din_request = DINRequest.objects.create(
-                        user=request.user,
-                        status='pending',
-                        start_range=chunk_start,
-                        end_range=chunk_end
-                    )
-                    EmailStatus.objects.create(
-                        din_request=din_request,
-                        status='pending'
-                    )
-                    sub_requests.append(din_request)
+                job, sub_requests = create_range_job(request.user, start_range, end_range, empty_policy, job_options)
+            
+            elif input_type == 'frontier':
+                start_din = (request.POST.get('frontier_start') or '').strip()
+                din_frontier, _ = DINFrontier.objects.get_or_create(user=request.user)
+                if start_din:
+                    if not start_din.isdigit() or int(start_din) < 1:
+                        messages.error(request, 'Starting DIN must be a positive integer.')
+                        return redirect('din_form')
+                    din_frontier.frontier = int(start_din) - 1
+                elif din_frontier.frontier is None:
+                    messages.error(request, 'Enter a starting DIN for the first frontier discovery.')
+                    return redirect('din_form')
+                din_frontier.is_scheduled = request.POST.get('frontier_schedule') in ('on', 'true', '1')
+                din_frontier.output_format = job_options['output_format']
+                din_frontier.save()
+                
+                # Discovery creates and queues the sub-requests once it knows the new frontier
+                discover_din_frontier.delay(din_frontier.id)
+                messages.success(request, f'Frontier discovery started above DIN {din_frontier.frontier}. Newly allocated DINs will be queued as sub-requests.')
+                return redirect('din_form')
             
             else:
                 messages.error(request, 'Invalid input type selected.')
                 return redirect('din_form')
             
-            # Queue all sub-requests
-            for din_request in sub_requests:
-                process_din_task.delay(din_request.id)
-            
-            messages.success(request, f'DIN processing initiated for {len(sub_requests)} sub-requests. You will receive emails when each is complete.')
+            queue_din_job(job, sub_requests, empty_policy)
+            if empty_policy != 'scan':
+                messages.success(request, f'DIN job {job.id} initiated with {len(sub_requests)} sub-requests. Sub-ranges are being sampled and the densest will be processed first.')
+            else:
+                messages.success(request, f'DIN job {job.id} initiated with {len(sub_requests)} sub-requests. You will receive one email with the merged results when the job is complete.')
             return redirect('din_form')
         
         except ValueError:
+            # Deleting a sub-request also drops any work queued for it (see signals.py)
             for din_request in sub_requests:
                 din_request.delete()
+            if job:
+                job.delete()
             messages.error(request, 'Please enter valid numbers for DIN range.')
             return redirect('din_form')
         except Exception as e:
             for din_request in sub_requests:
                 din_request.delete()
+            if job:
+                job.delete()
             messages.error(request, f'Error processing request: {str(e)}')
             return redirect('din_form')
     
@@ -202,31 +357,10 @@ def cancel_din_request(request, request_id):
             email_status.status = 'cancelled'
             email_status.save()
             
-            # Revoke main task
-            app.control.revoke(f"process_din_task_{request_id}", terminate=True, 
-                             destination=['worker1@localhost', 'worker2@localhost', 
-                                        'worker3@localhost', 'worker4@localhost', 
-                                        'worker5@localhost'])
-            # Revoke finalize task
-            app.control.revoke(f"finalize_din_task_{request_id}", terminate=True, 
-                             destination=['worker1@localhost', 'worker2@localhost', 
-                                        'worker3@localhost', 'worker4@localhost', 
-                                        'worker5@localhost'])
-            
-            # Revoke batch tasks
-            max_batches = 10000
-            if din_request.input_csv:
-                file_path = os.path.join(settings.MEDIA_ROOT, din_request.input_csv.name)
-                _, _, din_numbers = validate_din_csv(file_path)
-                max_batches = (len(din_numbers) // 10) + 1 if din_numbers else max_batches
-            elif din_request.end_range and din_request.start_range:
-                max_batches = ((din_request.end_range - din_request.start_range + 1) // 10) + 1
-            
-            for i in range(max_batches):
-                app.control.revoke(f"din_batch_{request_id}_{i}", terminate=True, 
-                                 destination=['worker1@localhost', 'worker2@localhost', 
-                                            'worker3@localhost', 'worker4@localhost', 
-                                            'worker5@localhost'])
+            # Workers see the Redis flag before their next MCA request and stop on their own
+            cancel_din_requests(din_request.id)
+            # The rest of its job is merged without it once the other shards finish
+            finalize_din_job_if_done(din_request.job_id)
                 
             messages.success(request, 'DIN request has been cancelled.')
         else:
@@ -235,22 +369,159 @@ def cancel_din_request(request, request_id):
         messages.error(request, 'Request not found or you do not have permission to cancel it.')
     return redirect('din_form')
 
+@login_required
+@user_passes_test(staff_check)
+def cancel_din_job(request, job_id):
+    if request.method != 'POST':
+        return redirect('din_job_status', job_id=job_id)
+    try:
+        job = DINJob.objects.get(id=job_id, user=request.user)
+    except DINJob.DoesNotExist:
+        messages.error(request, 'Job not found or you do not have permission to cancel it.')
+        return redirect('din_form')
+    
+    if job.status == 'processing' and not job.is_cancelled:
+        job.is_cancelled = True
+        job.status = 'cancelled'
+        job.email_status = 'cancelled'
+        job.save()
+        
+        unfinished = list(job.shards.filter(status__in=['pending', 'processing']).values_list('id', flat=True))
+        EmailStatus.objects.filter(din_request_id__in=unfinished).update(status='cancelled')
+        DINRequest.objects.filter(id__in=unfinished).update(is_cancelled=True, status='cancelled', updated_at=timezone.now())
+        # Workers see the Redis flags before their next MCA request and stop on their own
+        cancel_din_requests(*unfinished)
+        events.publish(request.user.id, *unfinished)
+        invalidate_user_requests(request.user.id)
+        messages.success(request, 'DIN job has been cancelled.')
+    else:
+        messages.error(request, 'Cannot cancel job: It is not in processing state.')
+    return redirect('din_job_status', job_id=job_id)
+
+@login_required
+@user_passes_test(staff_check)
+def resume_din_request(request, request_id):
+    if request.method != 'POST':
+        return redirect('din_status', request_id=request_id)
+    try:
+        din_request = DINRequest.objects.get(id=request_id, user=request.user)
+    except DINRequest.DoesNotExist:
+        messages.error(request, 'Request not found or you do not have permission to resume it.')
+        return redirect('din_form')
+    
+    if din_request.status in ('failed', 'cancelled', 'processing', 'skipped'):
+        din_request.is_cancelled = False
+        din_request.status = 'pending'
+        din_request.completed_at = None
+        din_request.save()
+        cancellation.clear(din_request.id)
+        
+        email_status = din_request.email_status
+        email_status.status = 'pending'
+        email_status.error_message = None
+        email_status.save()
+        
+        # Resuming a shard of a cancelled, failed or partial job puts the job back in
+        # processing, so it is merged and sent again once the shard completes
+        if din_request.job_id:
+            DINJob.objects.filter(id=din_request.job_id, status__in=['cancelled', 'failed', 'partial']).update(
+                status='processing', is_cancelled=False, email_status='pending', email_error=None
+            )
+        
+        # Only DINs without a stored result are dispatched again
+        process_din_task.delay(din_request.id)
+        messages.success(request, 'DIN request resumed. Only DINs that have not been fetched yet will be processed.')
+    else:
+        messages.error(request, 'Cannot resume request: It is not failed, cancelled, skipped or processing.')
+    return redirect('din_status', request_id=request_id)
+
+def din_request_data(req):
+    email_status = req.email_status.status if req.email_status else 'Not Initiated'
+    return {
+        'id': req.id,
+        'job_id': req.job_id,
+        'start_range': req.start_range,
+        'end_range': req.end_range,
+        'input_csv': req.input_csv.url if req.input_csv else None,
+        'status': req.status,
+        'progress': req.progress,
+        'done_dins': req.done_dins,
+        'success_dins': req.success_dins,
+        'failed_dins': req.failed_dins,
+        'cached_dins': req.cached_dins,
+        'email_status': email_status,
+        'output_csv': req.output_csv.url if req.output_csv else None,
+        'is_cancelled': req.is_cancelled
+    }
+
+def recent_request_data(user_id, din_request_ids=None):
+    """
+    Serialize the user's 100 most recent requests, or only din_request_ids,
+    with live progress for the running ones.
+    """
+    queryset = DINRequest.objects.filter(user_id=user_id).select_related('email_status')
+    if din_request_ids is not None:
+        queryset = queryset.filter(id__in=din_request_ids)
+    recent_requests = with_live_progress(list(queryset.order_by('-created_at')[:100]))
+    return [din_request_data(req) for req in recent_requests]
+
 @login_required
 @user_passes_test(staff_check)
 def get_recent_requests(request):
-    recent_requests = DINRequest.objects.filter(user=request.user).order_by('-created_at')[:100]
-    data = []
-    for req in recent_requests:
-        email_status = req.email_status.status if req.email_status else 'Not Initiated'
-        data.append({
-            'id': req.id,
-            'start_range': req.start_range,
-            'end_range': req.end_range,
-            'input_csv': req.input_csv.url if req.input_csv else None,
-            'status': req.status,
-            'progress': req.progress,
-            'email_status': email_status,
-            'output_csv': req.output_csv.url if req.output_csv else None,
-            'is_cancelled': req.is_cancelled
-        })
-    return JsonResponse(data, safe=False)
\ No newline at end of file
+    return JsonResponse(recent_request_data(request.user.id), safe=False)
+
+def server_sent_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+async def din_event_stream(user_id):
+    """
+    Yield a snapshot of the user's recent requests, then the requests that
+    changed, as Server-Sent Events. Changes announced within
+    DIN_EVENTS_COALESCE_SECONDS of each other go out as one update. The
+    stream ends after DIN_EVENTS_STREAM_MAX_AGE; EventSource reconnects and
+    starts again from a fresh snapshot.
+    """
+    pubsub = get_async_redis().pubsub()
+    # Subscribe before the snapshot, so no change falls between the two
+    await pubsub.subscribe(events.channel(user_id))
+    try:
+        yield "retry: 3000\n\n"
+        yield server_sent_event('snapshot', await sync_to_async(recent_request_data)(user_id))
+        
+        loop = asyncio.get_running_loop()
+        closes_at = loop.time() + settings.DIN_EVENTS_STREAM_MAX_AGE
+        changed, flush_at = set(), None
+        while loop.time() < closes_at:
+            timeout = flush_at - loop.time() if flush_at else settings.DIN_EVENTS_KEEPALIVE_SECONDS
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=max(timeout, 0))
+            if message is not None:
+                changed.add(int(message['data']))
+                if flush_at is None:
+                    flush_at = loop.time() + settings.DIN_EVENTS_COALESCE_SECONDS
+            elif flush_at is None:
+                yield ": keepalive\n\n"
+            if flush_at is not None and loop.time() >= flush_at:
+                rows = await sync_to_async(recent_request_data)(user_id, changed)
+                changed, flush_at = set(), None
+                yield server_sent_event('update', rows)
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+async def din_events(request):
+    """
+    Stream progress and status changes of the user's requests (see din_event_stream).
+    Served by the ASGI application, where an open stream holds no worker thread.
+    """
+    def allowed_user_id():
+        if request.user.is_authenticated and staff_check(request.user):
+            return request.user.id
+        return None
+    
+    user_id = await sync_to_async(allowed_user_id)()
+    if user_id is None:
+        return HttpResponse(status=403)
+    response = StreamingHttpResponse(din_event_stream(user_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Tell proxies not to buffer the stream
+    return response
\ No newline at end of file
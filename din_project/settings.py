@@ -152,6 +152,108 @@ CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3600}
 CELERY_TASK_DEFAULT_QUEUE = 'default'
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
+# Redis used for shared worker state (rate limiting etc.), separate from Celery's own use
+DIN_REDIS_URL = os.environ.get('DIN_REDIS_URL', CELERY_BROKER_URL)
+
+# MCA HTTP connection pool (one per Celery worker process)
+MCA_HTTP_POOL_LIMIT = int(os.environ.get('MCA_HTTP_POOL_LIMIT', '100'))  # Total open connections
+MCA_HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get('MCA_HTTP_POOL_LIMIT_PER_HOST', '20'))
+MCA_HTTP_DNS_CACHE_TTL = int(os.environ.get('MCA_HTTP_DNS_CACHE_TTL', '300'))  # seconds
+MCA_HTTP_KEEPALIVE_TIMEOUT = int(os.environ.get('MCA_HTTP_KEEPALIVE_TIMEOUT', '60'))  # seconds
+
+# Adaptive (AIMD) limit on in-flight MCA requests per worker process
+MCA_AIMD_INITIAL_WINDOW = int(os.environ.get('MCA_AIMD_INITIAL_WINDOW', '10'))
+MCA_AIMD_MIN_WINDOW = int(os.environ.get('MCA_AIMD_MIN_WINDOW', '1'))
+MCA_AIMD_MAX_WINDOW = int(os.environ.get('MCA_AIMD_MAX_WINDOW', '50'))
+MCA_AIMD_DECREASE_FACTOR = float(os.environ.get('MCA_AIMD_DECREASE_FACTOR', '0.5'))
+MCA_AIMD_LATENCY_TARGET = float(os.environ.get('MCA_AIMD_LATENCY_TARGET', '5'))  # seconds
+
+# Global token bucket for MCA requests, shared by all workers through Redis (<= 0 disables)
+MCA_RATE_LIMIT_PER_SECOND = float(os.environ.get('MCA_RATE_LIMIT_PER_SECOND', '10'))
+MCA_RATE_LIMIT_BURST = int(os.environ.get('MCA_RATE_LIMIT_BURST', '20'))
+
+# Circuit breaker around the MCA endpoint, shared by all workers through Redis
+MCA_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('MCA_BREAKER_FAILURE_THRESHOLD', '20'))  # Consecutive 5xx/timeouts
+MCA_BREAKER_RESET_TIMEOUT = int(os.environ.get('MCA_BREAKER_RESET_TIMEOUT', '60'))  # seconds before a probe
+
+# Where SOAP responses are parsed: 'thread' or 'process' pool, or 'inline' on the event loop.
+# 'process' needs a non-daemonic worker (e.g. celery -P threads or solo); prefork children fall back to threads
+DIN_PARSE_EXECUTOR = os.environ.get('DIN_PARSE_EXECUTOR', 'thread')
+DIN_PARSE_WORKERS = int(os.environ.get('DIN_PARSE_WORKERS', '2'))
+DIN_PARSE_QUEUE_SIZE = int(os.environ.get('DIN_PARSE_QUEUE_SIZE', '32'))  # Responses queued for the parse pool
+
+# Cross-request cache of successful DIN lookups (PostgreSQL), in seconds
+DIN_CACHE_TTL = int(os.environ.get('DIN_CACHE_TTL', str(7 * 24 * 3600)))
+
+# How long DINs that returned 404 or an empty record are skipped on rescans (Redis bitmaps), in seconds
+DIN_NEGATIVE_CACHE_TTL = int(os.environ.get('DIN_NEGATIVE_CACHE_TTL', str(30 * 24 * 3600)))
+# Bitmap chunks of at most 128KB the negative cache keeps at once; the oldest are dropped beyond it
+DIN_NEGATIVE_CACHE_MAX_CHUNKS = int(os.environ.get('DIN_NEGATIVE_CACHE_MAX_CHUNKS', '256'))
+
+# DINs per chunk a lease worker fetches at once; in-flight requests are governed by the AIMD window
+DIN_BATCH_SIZE = int(os.environ.get('DIN_BATCH_SIZE', '50'))
+
+# Lease scheduler: positions per lease, seconds a lease survives without progress, lease workers
+# live at once across all requests (keep below the Celery worker processes, so dispatch and
+# finalize tasks always find one free), and seconds a worker runs before handing over to a new task
+DIN_LEASE_SIZE = int(os.environ.get('DIN_LEASE_SIZE', '500'))
+DIN_LEASE_TTL = int(os.environ.get('DIN_LEASE_TTL', '600'))
+DIN_LEASE_WORKERS = int(os.environ.get('DIN_LEASE_WORKERS', '4'))
+DIN_LEASE_WORKER_RUNTIME = int(os.environ.get('DIN_LEASE_WORKER_RUNTIME', '1800'))
+# Seconds between sweeps that restart lease workers for queued requests, and a failed chunk's retry delay
+DIN_LEASE_SWEEP_INTERVAL = int(os.environ.get('DIN_LEASE_SWEEP_INTERVAL', '60'))
+
+# Fair-share scheduler: chunks one user may have in flight across all workers, and the
+# request size up to which "Auto" priority picks the interactive lane
+DIN_USER_MAX_INFLIGHT = int(os.environ.get('DIN_USER_MAX_INFLIGHT', '3'))
+DIN_INTERACTIVE_MAX_DINS = int(os.environ.get('DIN_INTERACTIVE_MAX_DINS', '1000'))
+
+# Seconds between flushes of the live Redis progress counters to the database
+DIN_PROGRESS_FLUSH_INTERVAL = int(os.environ.get('DIN_PROGRESS_FLUSH_INTERVAL', '10'))
+
+# Progress event stream (SSE): seconds over which changes are coalesced into one update,
+# between keepalive comments, and before the stream closes and the browser reconnects
+DIN_EVENTS_COALESCE_SECONDS = float(os.environ.get('DIN_EVENTS_COALESCE_SECONDS', '0.5'))
+DIN_EVENTS_KEEPALIVE_SECONDS = float(os.environ.get('DIN_EVENTS_KEEPALIVE_SECONDS', '15'))
+DIN_EVENTS_STREAM_MAX_AGE = int(os.environ.get('DIN_EVENTS_STREAM_MAX_AGE', '300'))
+
+# Random DINs probed per range sub-request by the density planner, and sub-requests sampled per fetch round
+DIN_PLANNER_SAMPLE_SIZE = int(os.environ.get('DIN_PLANNER_SAMPLE_SIZE', '20'))
+DIN_PLANNER_REQUESTS_PER_FETCH = int(os.environ.get('DIN_PLANNER_REQUESTS_PER_FETCH', '50'))
+
+# Frontier discovery: consecutive DINs checked per probe (the longest gap of 404s tolerated)
+# and the first galloping step above the last known frontier
+DIN_FRONTIER_PROBE_WIDTH = int(os.environ.get('DIN_FRONTIER_PROBE_WIDTH', '20'))
+DIN_FRONTIER_INITIAL_STEP = int(os.environ.get('DIN_FRONTIER_INITIAL_STEP', '256'))
+
+# Requests API: changed requests returned per page, and seconds a cached response is kept
+DIN_API_PAGE_SIZE = int(os.environ.get('DIN_API_PAGE_SIZE', '100'))
+DIN_API_CACHE_TTL = int(os.environ.get('DIN_API_CACHE_TTL', '300'))
+# Seconds a `since` cursor stays behind the clock, so a change stamped before
+# another but committed after it is still returned. Must exceed the longest
+# request-saving transaction plus the clock skew between app hosts
+DIN_API_CURSOR_LAG = int(os.environ.get('DIN_API_CURSOR_LAG', '60'))
+
+# Bulk jobs API: seconds between checks for newly finished shards while a ?follow=1 results
+# download waits, and seconds before such a download ends and the client resumes with a Range
+DIN_API_FOLLOW_INTERVAL = float(os.environ.get('DIN_API_FOLLOW_INTERVAL', '2'))
+DIN_API_FOLLOW_MAX_AGE = int(os.environ.get('DIN_API_FOLLOW_MAX_AGE', '300'))
+
+# Single-flight DIN fetches shared across jobs: seconds a DIN's fetch stays claimed, seconds its
+# row is kept for jobs that waited on it, and seconds between polls of the rows being waited on
+DIN_SINGLE_FLIGHT_LOCK_TTL = int(os.environ.get('DIN_SINGLE_FLIGHT_LOCK_TTL', '300'))
+DIN_SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get('DIN_SINGLE_FLIGHT_RESULT_TTL', '120'))
+DIN_SINGLE_FLIGHT_POLL_INTERVAL = float(os.environ.get('DIN_SINGLE_FLIGHT_POLL_INTERVAL', '0.5'))
+
+# Django cache in DIN_REDIS_URL, used for API responses and their per-user versions
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': DIN_REDIS_URL,
+        'KEY_PREFIX': 'din:django',
+    }
+}
+
 # Authentication settings
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'din_form'